@@ -0,0 +1,134 @@
+"""Event loop lag while censor checks hit Firestore concurrently.
+
+$ gcloud emulators firestore start --host-port=127.0.0.1:8086
+$ FIRESTORE_EMULATOR_HOST=127.0.0.1:8086 python -m benchmarks.loop_lag --checks 200
+
+--sync replays the Firestore calls of the censors before the async client,
+with the synchronous client inside the coroutines: TimeCensor streams the
+user's minute buckets and writes the bucket and a message, NewUserCensor
+reads the user's allowlist document. Bench users are seeded into the
+allowlist first, so NewUserCensor never runs the explainer.
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from google.cloud import firestore
+from google.cloud.firestore import FieldFilter, Increment
+
+from memebot.censor import NewUserCensor, TimeCensor
+from memebot.payload import MemePayload
+
+TICK = 0.005
+
+
+async def monitor(lags: list[float], done: asyncio.Event) -> None:
+    while not done.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - start - TICK)
+
+
+def seed(db: firestore.Client, n_checks: int) -> None:
+    dt = datetime.now(timezone.utc)
+    batch = db.batch()
+    for i in range(n_checks):
+        batch.set(
+            db.collection(NewUserCensor.collection).document(str(i)),
+            {"user_id": str(i), "dt": dt, "expiresAt": dt + timedelta(days=1)},
+        )
+    batch.commit()
+
+
+async def sync_check(db: firestore.Client, uid: str, message_id: int) -> None:
+    # TimeCensor.check
+    since = datetime.now(timezone.utc) - TimeCensor.time_horizon
+    buckets = (
+        db.collection("posts")
+        .document(uid)
+        .collection("minutes")
+        .where(filter=FieldFilter("ts", ">=", since))
+        .order_by("ts", direction=firestore.Query.DESCENDING)
+    )
+    for doc in buckets.stream():
+        doc.to_dict()
+    # TimeCensor.register
+    dt = datetime.now(timezone.utc)
+    minute = dt.strftime("%Y%m%d%H%M")
+    db.collection("posts").document(uid).collection("minutes").document(
+        f"{uid}_{minute}"
+    ).set(
+        {
+            "ts": dt.replace(second=0, microsecond=0),
+            "expiresAt": dt + TimeCensor.firestore_ttl,
+            "count": Increment(1),
+        },
+        merge=True,
+    )
+    db.collection("messages").document().set(
+        {
+            "uid": uid,
+            "createdAt": firestore.SERVER_TIMESTAMP,
+            "expiresAt": dt + TimeCensor.firestore_ttl,
+            "message_id": message_id,
+        }
+    )
+    # NewUserCensor.check
+    db.collection(NewUserCensor.collection).document(uid).get()
+
+
+async def async_check(
+    time_censor: TimeCensor, new_user_censor: NewUserCensor, payload: MemePayload
+) -> None:
+    await time_censor.check(payload)
+    await new_user_censor.check(payload)
+
+
+async def main(n_checks: int, sync: bool) -> None:
+    db = firestore.Client()
+    seed(db, n_checks)
+    time_censor = TimeCensor()
+    new_user_censor = NewUserCensor()
+    lags: list[float] = []
+    done = asyncio.Event()
+    ticker = asyncio.create_task(monitor(lags, done))
+    await asyncio.sleep(TICK * 2)
+    start = time.perf_counter()
+    if sync:
+        await asyncio.gather(
+            *(sync_check(db, uid=str(i), message_id=i) for i in range(n_checks))
+        )
+    else:
+        await asyncio.gather(
+            *(
+                async_check(
+                    time_censor,
+                    new_user_censor,
+                    MemePayload(message_id=i, chat_id=i, user_id=i),
+                )
+                for i in range(n_checks)
+            )
+        )
+    elapsed = time.perf_counter() - start
+    done.set()
+    await ticker
+    lags.sort()
+    print(
+        f"{n_checks} checks in {elapsed:.2f}s [{'sync' if sync else 'async'}], "
+        f"loop lag p50: {lags[len(lags) // 2] * 1000:.1f}ms, "
+        f"p99: {lags[int(len(lags) * 0.99)] * 1000:.1f}ms, "
+        f"max: {lags[-1] * 1000:.1f}ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--checks", type=int, default=200)
+    parser.add_argument("--sync", action="store_true")
+    args = parser.parse_args()
+    if "FIRESTORE_EMULATOR_HOST" not in os.environ:
+        parser.error("FIRESTORE_EMULATOR_HOST is not set")
+    asyncio.run(main(args.checks, args.sync))
@@ -0,0 +1,57 @@
+"""Compares the Pub/Sub payload of a forwarded meme: the full Message.to_json()
+against the compact MemePayload.
+
+$ python -m benchmarks.payload
+"""
+
+import datetime
+import json
+import timeit
+
+from telegram import Chat, Message, PhotoSize, User
+
+from memebot.payload import MemePayload
+
+
+def make_message() -> Message:
+    return Message(
+        message_id=777,
+        date=datetime.datetime.now(datetime.timezone.utc),
+        chat=Chat(id=111, type="private", first_name="Tester", username="tester"),
+        from_user=User(id=666, is_bot=False, first_name="Tester", username="tester"),
+        caption="Es ist Mittwoch, meine Kerle",
+        photo=[
+            PhotoSize(
+                file_id=f"AgACAgIAAxkBAAPCaD_nTtiDmdw0A6l-iExxgpTY708AAibwMRtgXAABSnQ4QNG5CmZMAQADAgADeAADNg{size}",
+                file_unique_id=f"AQADJvAxG2BcAAFK{size}",
+                file_size=size * 100,
+                width=size,
+                height=size,
+            )
+            for size in (90, 320, 800, 1280)
+        ],
+    )
+
+
+def main(number: int = 10_000) -> None:
+    message = make_message()
+    json_data = message.to_json().encode("utf-8")
+    payload_data = MemePayload.from_message(message).encode()
+
+    def json_roundtrip() -> None:
+        data = message.to_json().encode("utf-8")
+        Message.de_json(data=json.loads(data.decode("utf-8")), bot=None)
+
+    def payload_roundtrip() -> None:
+        MemePayload.decode(MemePayload.from_message(message).encode())
+
+    for name, size, stmt in (
+        ("Message.to_json", len(json_data), json_roundtrip),
+        ("MemePayload", len(payload_data), payload_roundtrip),
+    ):
+        seconds = timeit.timeit(stmt, number=number)
+        print(f"{name:16} {size:5d} bytes {seconds / number * 1e6:8.1f} us/roundtrip")
+
+
+if __name__ == "__main__":
+    main()
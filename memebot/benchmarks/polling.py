@@ -0,0 +1,120 @@
+"""Drives the long-polling runtime against a local fake Bot API server.
+
+$ python -m benchmarks.polling --updates 5000 --chats 100
+
+Every update is a /help command, so each one costs a sendMessage round trip
+to the fake server. The few fake users would be throttled by the default
+rate limits, the limits are raised above the load unless RATELIMIT_* is set.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import time
+from datetime import timedelta
+from typing import Any
+from urllib.parse import parse_qs
+
+HOST = "127.0.0.1"
+PORT = 8089
+os.environ.setdefault("BOT_API_URL", f"http://{HOST}:{PORT}/bot")
+# read once get_rate_limiter() is first built
+for name in ("RATELIMIT_USER_PER_MINUTE", "RATELIMIT_CHAT_PER_MINUTE"):
+    os.environ.setdefault(name, "1000000")
+for name in ("RATELIMIT_USER_BURST", "RATELIMIT_CHAT_BURST"):
+    os.environ.setdefault(name, "1000000")
+
+from fastapi import FastAPI, Request  # noqa: E402
+from hypercorn.asyncio import serve  # noqa: E402
+from hypercorn.config import Config  # noqa: E402
+
+from memebot.bot import get_bot, get_bot_pool  # noqa: E402
+from memebot.config import PollingConfig  # noqa: E402
+from memebot.polling import Poller  # noqa: E402
+
+
+def fake_bot_api(n_updates: int, n_chats: int, sent: list[int]) -> FastAPI:
+    app = FastAPI()
+
+    def update(update_id: int) -> dict[str, Any]:
+        chat_id = update_id % n_chats + 1
+        return {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": "Tester"},
+                "text": "/help",
+            },
+        }
+
+    @app.post("/bot{token}/{method}")
+    async def api(method: str, request: Request) -> dict[str, Any]:
+        params = {k: v[0] for k, v in parse_qs((await request.body()).decode()).items()}
+        if method == "getUpdates":
+            offset = int(params.get("offset", 0))
+            limit = int(params.get("limit", 100))
+            last = min(offset + limit, n_updates)
+            return {"ok": True, "result": [update(i) for i in range(offset, last)]}
+        if method == "sendMessage":
+            sent.append(int(params["chat_id"]))
+            return {
+                "ok": True,
+                "result": {
+                    "message_id": len(sent),
+                    "date": int(time.time()),
+                    "chat": {"id": int(params["chat_id"]), "type": "private"},
+                    "text": params.get("text", ""),
+                },
+            }
+        return {"ok": True, "result": True}
+
+    return app
+
+
+async def main(n_updates: int, n_chats: int, limit: int, concurrency: int) -> None:
+    sent: list[int] = []
+    config = Config()
+    config.bind = [f"{HOST}:{PORT}"]
+    shutdown = asyncio.Event()
+    app = fake_bot_api(n_updates, n_chats, sent)
+    server = asyncio.create_task(
+        serve(app, config, shutdown_trigger=shutdown.wait)  # type: ignore[arg-type]
+    )
+    await asyncio.sleep(0.5)
+    try:
+        async with get_bot_pool().session():
+            poller = Poller(
+                config=PollingConfig(
+                    limit=limit,
+                    timeout=timedelta(0),
+                    concurrency=concurrency,
+                    offset_path="",
+                ),
+                bot=get_bot(),
+            )
+            start = time.perf_counter()
+            while await poller.poll_once():
+                ...
+            elapsed = time.perf_counter() - start
+    finally:
+        shutdown.set()
+        await server
+    print(
+        f"{len(sent)}/{n_updates} updates in {elapsed:.2f}s: "
+        f"{len(sent) / elapsed:.0f} updates/s "
+        f"[limit: {limit}, concurrency: {concurrency}, pool: {get_bot_pool().config.pool_size}]"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    asyncio.run(main(args.updates, args.chats, args.limit, args.concurrency))
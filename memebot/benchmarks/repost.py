@@ -0,0 +1,33 @@
+"""Lookup latency of the repost hash index.
+
+$ python -m benchmarks.repost --hashes 100000 --lookups 1000
+"""
+
+import argparse
+import random
+import time
+
+from memebot.phash import HashIndex
+
+
+def main(n_hashes: int, n_lookups: int) -> None:
+    index = HashIndex(capacity=n_hashes)
+    for _ in range(n_hashes):
+        index.add(random.getrandbits(64))
+    queries = [random.getrandbits(64) for _ in range(n_lookups)]
+    start = time.perf_counter()
+    for query in queries:
+        index.distance(query)
+    elapsed = time.perf_counter() - start
+    print(
+        f"{n_lookups} lookups in {n_hashes} hashes: "
+        f"{elapsed / n_lookups * 1e6:.0f} us per lookup"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hashes", type=int, default=100_000)
+    parser.add_argument("--lookups", type=int, default=1_000)
+    args = parser.parse_args()
+    main(args.hashes, args.lookups)
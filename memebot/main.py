@@ -3,75 +3,120 @@ from __future__ import annotations
 import asyncio
 import logging
 import os
+import time
 import traceback
-from collections.abc import AsyncGenerator
-from contextlib import asynccontextmanager
+from collections.abc import AsyncGenerator, Generator
+from contextlib import AsyncExitStack, ExitStack, asynccontextmanager, contextmanager
 from http import HTTPStatus
 from logging import getLogger
 
+import orjson
 from fastapi import FastAPI, Request, Response
-from telegram import Bot, Update
-
-from memebot.censor import get_censor
-from memebot.commands import CommandInterface, build_command
-from memebot.config import get_token
-from memebot.explainer import get_explainer
+from telegram import Update
+
+from memebot.bot import get_bot, get_bot_pool
+from memebot.commands import CommandInterface, build_command, handled_update_kinds
+from memebot.config import get_secrets_loader
+from memebot.dedup import get_deduplicator
+from memebot.metrics import get_metrics
+from memebot.publisher import get_publisher
+from memebot.ratelimit import get_rate_limiter
+from memebot.storage import get_firestore_pool
+from memebot.updates import prefilter
+from memebot.workers import get_command_queue
 
 logger = getLogger(__name__)
 
 
 async def set_webhook() -> None:
-    """Sets the webhook for the Telegram Bot and manages its lifecycle (start/stop)."""
-    if webhook_url := os.getenv("WEBHOOK_URL"):
-        # https://core.telegram.org/bots/api#setwebhook
-        # allowed_updates = all types except
-        # - chat_member
-        # - message_reaction
-        # - message_reaction_count
-        # need to list all types explicitly to add them
-        # TODO: add some telegram api library to get the list of available options
-        # instead of copying them from the doc
-        allowed_updates = [
-            "message",
-            "edited_message",
-            "channel_post",
-            "edited_channel_post",
-            "business_connection",
-            "business_message",
-            "edited_business_message",
-            "deleted_business_messages",
-            "message_reaction",
-            "message_reaction_count",
-            "inline_query",
-            "chosen_inline_result",
-            "callback_query",
-            "shipping_query",
-            "pre_checkout_query",
-            "purchased_paid_media",
-            "poll",
-            "poll_answer",
-            "my_chat_member",
-            "chat_member",
-            "chat_join_request",
-            "chat_boost",
-            "removed_chat_boost",
-        ]
-        try:
-            await Bot(token=get_token()).set_webhook(
-                url=webhook_url,
-                allowed_updates=allowed_updates,
-            )
-        except Exception:  # noqa: BLE001
-            logging.exception("Could not set webhook")
+    """Sets the webhook for the Telegram Bot, unless it's already up to date.
+
+    Every instance runs it on start, most of the time the webhook is already set
+    and getWebhookInfo is enough."""
+    if not (webhook_url := os.getenv("WEBHOOK_URL")):
+        return
+    # https://core.telegram.org/bots/api#setwebhook
+    # subscribe only to the updates some command handles
+    allowed_updates = handled_update_kinds()
+    bot = get_bot()
+    try:
+        info = await bot.get_webhook_info()
+        if info.url == webhook_url and set(info.allowed_updates or ()) == set(
+            allowed_updates
+        ):
+            logger.info("Webhook is up to date")
+            return
+        await bot.set_webhook(url=webhook_url, allowed_updates=allowed_updates)
+        logger.info("Webhook is set, allowed updates: %s", allowed_updates)
+    except Exception:  # noqa: BLE001
+        logging.exception("Could not set webhook")
+
+
+@contextmanager
+def startup_phase(name: str) -> Generator[None, None, None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        get_metrics().histogram(f"startup.{name}").observe(elapsed)
+        logger.info("Startup [%s]: %.0f ms", name, elapsed * 1000)
+
+
+async def update_webhook() -> None:
+    with startup_phase("webhook"):
+        await set_webhook()
+
+
+def start_subscribers(
+    app: FastAPI, loop: asyncio.AbstractEventLoop, stack: ExitStack
+) -> None:
+    """Starts explainer and censor Pub/Sub subscribers.
+
+    It runs in a thread once the app serves requests: the subscribers import
+    dspy, vertexai, PIL and firestore, webhook calls don't need to wait for them.
+    If they fail to start, the health check fails: the instance would accept
+    updates nothing processes.
+    """
+    from memebot.censor import get_censor
+    from memebot.explainer import get_explainer
+
+    try:
+        with startup_phase("subscribers"):
+            app.state.explainer = get_explainer(loop=loop)
+            app.state.censor = get_censor(loop=loop)
+            stack.enter_context(app.state.explainer.subscription())
+            stack.enter_context(app.state.censor.subscription())
+    except Exception as exc:
+        logging.exception("Could not start subscribers")
+        app.state.subscribers_error = exc
+        raise
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncGenerator[None]:
-    await set_webhook()
-    app.state.explainer = get_explainer(loop=asyncio.get_running_loop())
-    app.state.censor = get_censor(loop=asyncio.get_running_loop())
-    with app.state.explainer.subscription(), app.state.censor.subscription():
-        yield
+    loop = asyncio.get_running_loop()
+    async with AsyncExitStack() as stack:
+        with startup_phase("serving"):
+            with startup_phase("secrets"):
+                await get_secrets_loader().prefetch()
+            await stack.enter_async_context(get_bot_pool().session())
+            await stack.enter_async_context(get_command_queue().running())
+            stack.callback(get_publisher().close)
+            health_checks = asyncio.create_task(get_firestore_pool().health_checks())
+            stack.callback(health_checks.cancel)
+            subscriptions = stack.enter_context(ExitStack())
+            # not needed to serve requests, both run in background
+            webhook = asyncio.create_task(update_webhook())
+            subscribers = asyncio.create_task(
+                asyncio.to_thread(start_subscribers, app, loop, subscriptions)
+            )
+        try:
+            yield
+        finally:
+            # the thread can't be cancelled, wait for it to close what it started
+            # a failed start was logged and reported by the health check
+            await asyncio.gather(webhook, subscribers, return_exceptions=True)
 
 
 app = FastAPI(lifespan=lifespan)
@@ -79,13 +124,42 @@ app = FastAPI(lifespan=lifespan)
 
 @app.get("/")
 async def index() -> Response:
+    if (error := getattr(app.state, "subscribers_error", None)) is not None:
+        return Response(
+            content=f"subscribers are down: {error}",
+            status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+        )
     return Response(content="OK", status_code=HTTPStatus.OK)
 
 
+@app.get("/metrics")
+async def metrics() -> Response:
+    return Response(
+        content=orjson.dumps(get_metrics().snapshot()),
+        media_type="application/json",
+        status_code=HTTPStatus.OK,
+    )
+
+
 @app.post("/webhook")
 async def telegram_webhook(request: Request) -> Response:
+    get_metrics().counter("webhook.updates").inc()
+    try:
+        data = orjson.loads(await request.body())
+    except orjson.JSONDecodeError:
+        data = None
+    # fast path: drop updates the bot doesn't handle without building
+    # python-telegram-bot objects
+    if reason := prefilter(data):
+        get_metrics().counter("webhook.fast_path").inc()
+        return Response(content=f"ignored, {reason}", status_code=HTTPStatus.OK)
+
+    update_id: int = data["update_id"]
+    if await get_deduplicator().is_duplicate(update_id):
+        get_metrics().counter("webhook.duplicates").inc()
+        return Response(content="ignored, duplicate update", status_code=HTTPStatus.OK)
+
     try:
-        data = await request.json()
         update = Update.de_json(data=data, bot=None)
     except Exception:  # noqa: BLE001
         return Response(
@@ -95,12 +169,24 @@ async def telegram_webhook(request: Request) -> Response:
     if not (message := update.message):
         return Response(content="ignored, no message", status_code=HTTPStatus.OK)
 
+    if not get_rate_limiter().admit(message):
+        return Response(content="ignored, rate limited", status_code=HTTPStatus.OK)
+
     # do not fail in any case, but log all errors
     try:
         command: CommandInterface = build_command(message)
-        await command.run()
+        dispatched = await get_command_queue().dispatch(command)
     except Exception as exc:
         tb = traceback.format_exc()
         logger.error("%s\n%s", str(exc), tb)
+        dispatched = True
+
+    if not dispatched:
+        # Telegram redelivers the update later, it must not be taken for a duplicate
+        try:
+            await get_deduplicator().forget(update_id)
+        except Exception:  # noqa: BLE001
+            logging.exception("Could not forget update %d", update_id)
+        return Response(content="busy", status_code=HTTPStatus.SERVICE_UNAVAILABLE)
 
     return Response(content="OK", status_code=HTTPStatus.OK)
@@ -0,0 +1,81 @@
+import asyncio
+from collections.abc import AsyncGenerator
+from contextlib import asynccontextmanager
+from functools import cache
+from logging import getLogger
+
+import httpx
+from telegram import Bot
+from telegram.request import HTTPXRequest
+
+from memebot.config import BotConfig, get_bot_config, get_token
+
+logger = getLogger(__name__)
+
+
+class BotPool:
+    """Process-wide Telegram Bot backed by a keep-alive HTTP connection pool.
+
+    Bot.initialize() is not used on purpose: it calls getMe on every start,
+    only the underlying HTTP clients are opened and closed here.
+    """
+
+    def __init__(self, config: BotConfig) -> None:
+        self.config = config
+        self.__request = self.__build_request(pool_size=config.pool_size)
+        # getUpdates keeps its connection busy for the whole long-poll,
+        # so it gets a dedicated client and doesn't starve replies
+        self.__updates_request = self.__build_request(pool_size=1)
+        self.__token: str | None = None
+        self.__bot: Bot
+
+    def __build_request(self, pool_size: int) -> HTTPXRequest:
+        return HTTPXRequest(
+            connection_pool_size=pool_size,
+            pool_timeout=self.config.pool_timeout,
+            httpx_kwargs={
+                "limits": httpx.Limits(
+                    max_connections=pool_size,
+                    max_keepalive_connections=pool_size,
+                    keepalive_expiry=self.config.keepalive_expiry,
+                ),
+            },
+        )
+
+    @property
+    def bot(self) -> Bot:
+        # the token is rotated through the secrets loader, the Bot is rebuilt
+        # on the same connection pools once it changes
+        if (token := get_token()) != self.__token:
+            self.__bot = Bot(
+                token=token,
+                base_url=self.config.base_url,
+                base_file_url=self.config.base_file_url,
+                request=self.__request,
+                get_updates_request=self.__updates_request,
+            )
+            self.__token = token
+        return self.__bot
+
+    @asynccontextmanager
+    async def session(self) -> AsyncGenerator[Bot]:
+        await asyncio.gather(
+            self.__request.initialize(), self.__updates_request.initialize()
+        )
+        logger.info("Bot connection pool is open [size: %d]", self.config.pool_size)
+        try:
+            yield self.bot
+        finally:
+            await asyncio.gather(
+                self.__request.shutdown(), self.__updates_request.shutdown()
+            )
+            logger.info("Bot connection pool is closed")
+
+
+@cache
+def get_bot_pool() -> BotPool:
+    return BotPool(config=get_bot_config())
+
+
+def get_bot() -> Bot:
+    return get_bot_pool().bot
@@ -0,0 +1,44 @@
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Generic, TypeVar
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    """Bounded in-process cache, least recently used entries are evicted first,
+    entries older than ttl are treated as missing."""
+
+    def __init__(self, max_size: int, ttl: timedelta | None = None) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.__entries: OrderedDict[K, tuple[V, float]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def get(self, key: K) -> V | None:
+        if (entry := self.__entries.get(key)) is None:
+            return None
+        value, stored_at = entry
+        if (
+            self.ttl is not None
+            and time.monotonic() - stored_at > self.ttl.total_seconds()
+        ):
+            del self.__entries[key]
+            return None
+        self.__entries.move_to_end(key)
+        return value
+
+    def put(self, key: K, value: V) -> None:
+        self.__entries[key] = (value, time.monotonic())
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.max_size:
+            self.__entries.popitem(last=False)
+
+    def pop(self, key: K) -> V | None:
+        if (entry := self.__entries.pop(key, None)) is None:
+            return None
+        return entry[0]
@@ -1,25 +1,36 @@
 import abc
 import asyncio
-import json
-import traceback
-from collections.abc import Generator
-from contextlib import contextmanager
+from collections import defaultdict, deque
+from collections.abc import Coroutine, Generator, Iterable, Sequence
+from contextlib import ExitStack, contextmanager
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
-from functools import cached_property
+from enum import IntEnum, StrEnum
+from functools import cache
+from io import BytesIO
 from logging import getLogger
-from typing import override
+from operator import attrgetter
+from typing import Any, NamedTuple, override
 from zoneinfo import ZoneInfo
 
 from dateutil.relativedelta import relativedelta
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition
 from google.cloud import firestore
-from google.cloud.firestore import FieldFilter, Increment
-from google.cloud.pubsub_v1 import SubscriberClient
-from google.cloud.pubsub_v1.subscriber.message import Message as PubSubMessage
-from telegram import Bot, Message
-
-from memebot.config import get_channel_id, get_messenger_config, get_token
-from memebot.explainer import Explainer
+from google.cloud.firestore import DocumentSnapshot, FieldFilter, Watch
+from google.cloud.firestore_v1.watch import ChangeType, DocumentChange
+from PIL import Image
+from telegram.error import BadRequest, Forbidden
+
+from memebot.bot import get_bot
+from memebot.cache import LRUCache
+from memebot.config import get_channel_id, get_messenger_config
+from memebot.explainer import Explainer, ExplainerException, IsAlreadyExplained
+from memebot.files import get_file_cache
+from memebot.metrics import get_metrics
+from memebot.payload import MemePayload
+from memebot.phash import HashIndex, dhash
+from memebot.storage import get_firestore_pool
+from memebot.subscriber import Subscriber
 
 logger = getLogger(__name__)
 
@@ -30,93 +41,235 @@ class CensorResult:
     reason: str = ""
 
 
+class Stage(IntEnum):
+    """CombinedCensor runs a stage once all the censors of the previous one
+    passed."""
+
+    # reads only, cheap
+    READ = 0
+    # calls the LM
+    EXPENSIVE = 1
+    # records the post, nothing may reject it afterwards
+    WRITE = 2
+
+
 class AbstractCensor(abc.ABC):
 
+    stage = Stage.READ
+
     @abc.abstractmethod
-    async def check(self, message: Message) -> CensorResult: ...
+    async def check(self, message: MemePayload) -> CensorResult: ...
+
+    async def precheck(self, message: MemePayload) -> CensorResult:
+        """Read-only part of a later stage check, run with the READ stage."""
+        return CensorResult(is_allowed=True)
+
+    async def forwarded(self, message: MemePayload) -> None:
+        """Called once the message is forwarded to the channel."""
+
+    async def prefetch(self, messages: Sequence[MemePayload]) -> None:
+        """Loads the state of a batch of messages ahead of their checks."""
+
+    @contextmanager
+    def listening(self) -> Generator[None, None, None]:
+        """Keeps the in-process state fresh while the subscription runs,
+        entered in the subscriber thread."""
+        yield
+
+
+class Post(NamedTuple):
+    ts: datetime
+    # None for posts migrated from the per-minute buckets
+    message_id: int | None = None
+
+
+class PostWindow:
+    """The most recent posts of a user, oldest first."""
+
+    __slots__ = ("posts",)
+
+    def __init__(self, posts: Iterable[Post], size: int) -> None:
+        self.posts: deque[Post] = deque(
+            sorted(posts, key=attrgetter("ts")), maxlen=size
+        )
+
+    def add(self, post: Post) -> None:
+        self.posts.append(post)
+
+    def has(self, message_id: int | None) -> bool:
+        return message_id is not None and any(
+            post.message_id == message_id for post in self.posts
+        )
+
+    def recent(self, since: datetime) -> list[Post]:
+        while self.posts and self.posts[0].ts < since:
+            self.posts.popleft()
+        return list(self.posts)
 
 
 class TimeCensor(AbstractCensor):
+    """Allows n_message_limit posts per time_horizon.
+
+    A user's state is a single posts/{uid} document holding a ring buffer
+    of the recent posts, it's read and updated in one transaction, so
+    concurrent posts of the same user can't both pass. Users still on the
+    per-minute buckets layout are migrated on their first check."""
 
+    stage = Stage.WRITE
     firestore_ttl = timedelta(hours=25)
     time_horizon = timedelta(hours=24)
     n_message_limit = 2
     tz = ZoneInfo("Europe/Berlin")
+    # windows of recent users are kept in memory to reject users over the limit
+    # without Firestore, a window only grows stale towards allowing a post
+    cache_size = 10_000
+    cache_ttl = timedelta(minutes=5)
 
-    @cached_property
-    def db(self) -> firestore.Client:
-        # Client is not pooled, it's a fair connection
-        # according to a doc, pooling is not needed due sharing a channel
-        # between clients
-        # TODO:
-        # But the connection may fail, need a custom pool to handle it
-        return firestore.Client()
-
-    def register(self, message: Message) -> None:
-        assert message.from_user is not None
-        uid = str(message.from_user.id)
-        dt = datetime.now(timezone.utc)
-        minute = dt.strftime("%Y%m%d%H%M")
-        bucket_id = f"{uid}_{minute}"
-        bucket_ref = (
-            self.db.collection("posts")
+    def __init__(self) -> None:
+        super().__init__()
+        self.windows: LRUCache[str, PostWindow] = LRUCache(
+            max_size=self.cache_size, ttl=self.cache_ttl
+        )
+
+    async def load_buckets(
+        self,
+        db: firestore.AsyncClient,
+        transaction: firestore.AsyncTransaction,
+        uid: str,
+        since: datetime,
+    ) -> list[Post]:
+        """Posts of the legacy posts/{uid}/minutes layout."""
+        buckets = (
+            db.collection("posts")
             .document(uid)
             .collection("minutes")
-            .document(bucket_id)
+            .where(filter=FieldFilter("ts", ">=", since))
         )
-        bucket_ref.set(
-            {
-                "ts": dt.replace(second=0, microsecond=0),
-                "expiresAt": dt + self.firestore_ttl,
-                "count": Increment(1),
-            },
-            merge=True,
+        posts: list[Post] = []
+        async for doc in await transaction.get(buckets):
+            if (doc_dict := doc.to_dict()) is not None:
+                posts.extend(
+                    Post(ts=doc_dict["ts"]) for _ in range(doc_dict.get("count", 0))
+                )
+        return posts
+
+    async def reserve(self, uid: str, post: Post) -> tuple[PostWindow, bool]:
+        """Checks the limit and records the post in a single transaction."""
+        since = post.ts - self.time_horizon
+
+        @firestore.async_transactional
+        async def reserve(
+            transaction: firestore.AsyncTransaction,
+        ) -> tuple[PostWindow, bool]:
+            doc_ref = db.collection("posts").document(uid)
+            snapshot = await doc_ref.get(transaction=transaction)
+            if snapshot.exists:
+                posts = [Post(**entry) for entry in snapshot.get("posts")]
+            else:
+                posts = await self.load_buckets(db, transaction, uid=uid, since=since)
+            window = PostWindow(posts, size=self.n_message_limit)
+            # a redelivered message already has its slot
+            if window.has(post.message_id):
+                return window, True
+            if len(window.recent(since)) >= self.n_message_limit:
+                return window, False
+            window.add(post)
+            transaction.set(
+                doc_ref,
+                {
+                    "posts": [entry._asdict() for entry in window.posts],
+                    "expiresAt": post.ts + self.firestore_ttl,
+                },
+            )
+            return window, True
+
+        async with get_firestore_pool().session() as db:
+            return await reserve(db.transaction())
+
+    @override
+    async def prefetch(self, messages: Sequence[MemePayload]) -> None:
+        uids = {
+            uid
+            for message in messages
+            if message.user_id is not None
+            and self.windows.get(uid := str(message.user_id)) is None
+        }
+        if not uids:
+            return
+        async with get_firestore_pool().session() as db:
+            refs = [db.collection("posts").document(uid) for uid in uids]
+            async for snapshot in db.get_all(refs):
+                if snapshot.exists:
+                    posts = (Post(**entry) for entry in snapshot.get("posts"))
+                    self.windows.put(
+                        snapshot.id, PostWindow(posts, size=self.n_message_limit)
+                    )
+
+    def __over_limit(
+        self, window: PostWindow, message: MemePayload, since: datetime
+    ) -> bool:
+        return (
+            not window.has(message.message_id)
+            and len(window.recent(since)) >= self.n_message_limit
         )
-        self.db.collection("messages").document().set(
-            {
-                "uid": uid,
-                "createdAt": firestore.SERVER_TIMESTAMP,
-                "expiresAt": dt + self.firestore_ttl,
-                "message_id": message.message_id,
-            }
+
+    @override
+    async def precheck(self, message: MemePayload) -> CensorResult:
+        """Rejects a user over the limit before the other censors run, the
+        post is only reserved once they passed."""
+        assert message.user_id is not None
+        since = datetime.now(timezone.utc) - self.time_horizon
+        uid = str(message.user_id)
+        if (window := self.windows.get(uid)) is None:
+            async with get_firestore_pool().session() as db:
+                snapshot = await db.collection("posts").document(uid).get()
+            if not snapshot.exists:
+                return CensorResult(is_allowed=True)
+            posts = (Post(**entry) for entry in snapshot.get("posts"))
+            window = PostWindow(posts, size=self.n_message_limit)
+            self.windows.put(uid, window)
+        if self.__over_limit(window, message, since):
+            get_metrics().counter("time_censor.fast_rejects").inc()
+            logger.info("TimeCensor precheck for user [%s] [failed]", uid)
+            return self.__rejected(window)
+        return CensorResult(is_allowed=True)
+
+    def __rejected(self, window: PostWindow) -> CensorResult:
+        can_post_from = (window.posts[0].ts + self.time_horizon).astimezone(self.tz)
+        return CensorResult(
+            is_allowed=False,
+            reason=(
+                f"You have {self.n_message_limit}+ posts in the last {self.time_horizon}\n"
+                f"You can post from {can_post_from}"
+            ),
         )
 
     @override
-    async def check(self, message: Message) -> CensorResult:
+    async def check(self, message: MemePayload) -> CensorResult:
         # <=n posts for the last x hours [self.time_horizon]
-        assert message.from_user is not None
-        since = datetime.now(timezone.utc) - self.time_horizon
-        uid = str(message.from_user.id)
+        assert message.user_id is not None
+        now = datetime.now(timezone.utc)
+        since = now - self.time_horizon
+        uid = str(message.user_id)
         logger.info("TimeCensor check for user [%s] ...", uid)
-        buckets = (
-            self.db.collection("posts")
-            .document(uid)
-            .collection("minutes")
-            .where(filter=FieldFilter("ts", ">=", since))
-            .order_by("ts", direction=firestore.Query.DESCENDING)
+        cached = self.windows.get(uid)
+        if cached is not None and self.__over_limit(cached, message, since):
+            get_metrics().counter("time_censor.fast_rejects").inc()
+            logger.info("TimeCensor check for user [%s] [failed] [cached]", uid)
+            return self.__rejected(cached)
+        window, is_allowed = await self.reserve(
+            uid=uid, post=Post(ts=now, message_id=message.message_id)
         )
-        n_msg = 0
-        for doc in buckets.stream():
-            doc_dict = doc.to_dict()
-            n_msg += doc_dict.get("count", 0)
-            can_post_from = (doc_dict["ts"] + self.time_horizon).astimezone(self.tz)
-            if n_msg >= self.n_message_limit:
-                logger.info("TimeCensor check for user [%s] [failed]", uid)
-                return CensorResult(
-                    is_allowed=False,
-                    reason=(
-                        f"You have {self.n_message_limit}+ posts in the last {self.time_horizon}\n"
-                        f"You can post from {can_post_from}"
-                    ),
-                )
-        # The check is performed just before the message is sent
-        # do -1, because is the check is positive, then the message that is
-        # about to be send and reported is not counted yet
-        n_msg_left = max(self.n_message_limit - n_msg - 1, 0)
+        self.windows.put(uid, window)
+        if not is_allowed:
+            logger.info("TimeCensor check for user [%s] [failed]", uid)
+            return self.__rejected(window)
+        # the window already has the message that is about to be sent
+        n_msg_left = max(self.n_message_limit - len(window.posts), 0)
         reason = f"Message sent, {n_msg_left} left for today"
-        if (n_msg > 0) and (n_msg_left == 0):
+        if (len(window.posts) > 1) and (n_msg_left == 0):
+            can_post_from = (window.posts[0].ts + self.time_horizon).astimezone(self.tz)
             reason += f"\nYou can create next post from {can_post_from}"
-        self.register(message=message)
         logger.info("TimeCensor check for user [%s] [passed]", uid)
         return CensorResult(
             is_allowed=True,
@@ -124,46 +277,138 @@ class TimeCensor(AbstractCensor):
         )
 
 
+class Allowlist:
+    """In-process copy of the allowlist, kept fresh by a snapshot listener.
+
+    The user id maps to expiresAt, expired entries are treated as absent
+    until Firestore TTL removes the document."""
+
+    def __init__(self, collection: str) -> None:
+        self.collection = collection
+        self.__expires: dict[str, datetime] = {}
+        self.__watch: Watch | None = None
+
+    def __contains__(self, uid: str) -> bool:
+        expires_at = self.__expires.get(uid)
+        return expires_at is not None and expires_at > datetime.now(timezone.utc)
+
+    def add(self, uid: str, expires_at: datetime) -> None:
+        self.__expires[uid] = expires_at
+        get_metrics().gauge("allowlist.size").set(len(self.__expires))
+
+    def on_snapshot(
+        self,
+        docs: list[DocumentSnapshot],
+        changes: list[DocumentChange],
+        read_time: datetime,
+    ) -> None:
+        # called by the listener thread, the initial snapshot adds every user
+        for change in changes:
+            if change.type == ChangeType.REMOVED:
+                self.__expires.pop(change.document.id, None)
+            elif (expires_at := change.document.get("expiresAt")) is not None:
+                self.__expires[change.document.id] = expires_at
+        get_metrics().gauge("allowlist.size").set(len(self.__expires))
+
+    @contextmanager
+    def listening(self) -> Generator[None, None, None]:
+        with get_firestore_pool().listener() as db:
+            self.__watch = db.collection(self.collection).on_snapshot(self.on_snapshot)
+            try:
+                yield
+            finally:
+                self.__watch.unsubscribe()
+                self.__watch = None
+
+
+@cache
+def get_allowlist() -> Allowlist:
+    return Allowlist(collection=NewUserCensor.collection)
+
+
 class NewUserCensor(AbstractCensor):
     """Due to recent issues with spam bots, new users have to post a meme hitting
     7/10 score given by a bot.
     After that they are added to allow list.
     """
 
+    stage = Stage.EXPENSIVE
     firestore_ttl = relativedelta(months=6)
     time_horizon = timedelta(hours=24)
     tz = ZoneInfo("Europe/Berlin")
     collection: str = "allow_users"
     threshold: int = 7
 
+    # users found missing by a prefetch, their checks skip the read
+    absent_ttl = timedelta(minutes=1)
+    try_later = CensorResult(
+        is_allowed=False,
+        reason="Sorry, your first meme can't be scored right now. Try again later.",
+    )
+
     def __init__(self):
         super().__init__()
         self.explainer = Explainer()
+        self.absent: LRUCache[str, bool] = LRUCache(max_size=1_000, ttl=self.absent_ttl)
 
-    @cached_property
-    def db(self) -> firestore.Client:
-        # FIXME: see TimeCensor.db
-        return firestore.Client()
+    @override
+    async def prefetch(self, messages: Sequence[MemePayload]) -> None:
+        allowlist = get_allowlist()
+        uids = {
+            uid
+            for message in messages
+            if message.user_id is not None
+            and (uid := str(message.user_id)) not in allowlist
+        }
+        if not uids:
+            return
+        async with get_firestore_pool().session() as db:
+            refs = [db.collection(self.collection).document(uid) for uid in uids]
+            async for user in db.get_all(refs):
+                if not user.exists:
+                    self.absent.put(user.id, True)
+                elif (expires_at := user.get("expiresAt")) is not None:
+                    allowlist.add(user.id, expires_at=expires_at)
 
     @override
-    async def check(self, message: Message) -> CensorResult:
-        assert message.from_user is not None
-        uid = str(message.from_user.id)
+    async def check(self, message: MemePayload) -> CensorResult:
+        assert message.user_id is not None
+        uid = str(message.user_id)
         logger.info("NewUserCensor check for user [%s] ...", uid)
-        user = self.db.collection(self.collection).document(uid).get()
-        if user.exists:
-            logger.info("NewUserCensor check for user [%s] [passed]", uid)
+        allowlist = get_allowlist()
+        if uid in allowlist:
+            get_metrics().counter("allowlist.hits").inc()
+            logger.info("NewUserCensor check for user [%s] [passed] [cached]", uid)
             return CensorResult(is_allowed=True)
+        # the listener may not have caught up or may not be running
+        get_metrics().counter("allowlist.misses").inc()
+        if self.absent.pop(uid) is None:
+            async with get_firestore_pool().session() as db:
+                user = await db.collection(self.collection).document(uid).get()
+            if user.exists and (expires_at := user.get("expiresAt")) is not None:
+                allowlist.add(uid, expires_at=expires_at)
+            if user.exists:
+                logger.info("NewUserCensor check for user [%s] [passed]", uid)
+                return CensorResult(is_allowed=True)
 
         # check if the message has an image
-        if message.photo is None:
+        if not message.photo:
             logger.info("NewUserCensor check for user [%s] [failed] [no image]", uid)
             return CensorResult(is_allowed=False, reason="No image in a message")
 
         logger.info("NewUserCensor check for user [%s] ... [running explain]", uid)
-        meme_info = await self.explainer.explain(message=message)
+        try:
+            meme_info = await self.explainer.explain(message=message)
+        except IsAlreadyExplained:
+            # redelivered after the scoring, the explanation is cached
+            if (cached := await self.explainer.cached(message)) is None:
+                return self.try_later
+            meme_info = cached
+        except ExplainerException as exc:
+            logger.info("NewUserCensor check for user [%s] [failed] [%r]", uid, exc)
+            return self.try_later
         if meme_info.score >= self.threshold:
-            self.__register(user_id=str(message.from_user.id))
+            await self.__register(user_id=uid)
             logger.info("NewUserCensor check for user [%s] [passed]", uid)
             return CensorResult(is_allowed=True)
         logger.info("NewUserCensor check for user [%s] [failed]", uid)
@@ -178,89 +423,417 @@ class NewUserCensor(AbstractCensor):
             ),
         )
 
-    def __register(self, user_id: str) -> None:
+    async def __register(self, user_id: str) -> None:
         dt = datetime.now(timezone.utc)
+        expires_at = dt + self.firestore_ttl
         data = {
             "user_id": user_id,
             "dt": dt,
-            "expiresAt": dt + self.firestore_ttl,
+            "expiresAt": expires_at,
         }
-        self.db.collection(self.collection).document(user_id).set(data)
+        async with get_firestore_pool().session() as db:
+            await db.collection(self.collection).document(user_id).set(data)
+        get_allowlist().add(user_id, expires_at=expires_at)
+
+
+class RepostCensor(AbstractCensor):
+    """Rejects memes close to one forwarded to the channel recently.
+
+    Memes are compared by the dHash of their smallest photo size, the hashes
+    are kept in an in-memory index and persisted to Firestore. The index is
+    loaded when the subscription starts, memes forwarded by other instances
+    are added by a snapshot listener. Until the index is loaded, or if the
+    load failed, posts are let through."""
+
+    collection = "meme_hashes"
+    firestore_ttl = timedelta(days=90)
+    capacity = 100_000
+    # recompressed or rescaled copies of a picture stay within a few bits
+    max_distance = 6
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.index = HashIndex(capacity=self.capacity)
+        # hashes of checked photos, reused once the message is forwarded
+        self.hashes: LRUCache[str, int] = LRUCache(max_size=1_000)
+        self.__watch: Watch | None = None
+
+    def load(self, db: firestore.Client) -> None:
+        docs = (
+            db.collection(self.collection)
+            .where(filter=FieldFilter("expiresAt", ">", datetime.now(timezone.utc)))
+            .order_by("expiresAt")
+            .select(["hash"])
+        )
+        for doc in docs.stream():
+            if (doc_dict := doc.to_dict()) is not None:
+                self.index.add(int(doc_dict["hash"], 16))
+        logger.info("RepostCensor loaded %d hashes", len(self.index))
+
+    def on_snapshot(
+        self,
+        docs: list[DocumentSnapshot],
+        changes: list[DocumentChange],
+        read_time: datetime,
+    ) -> None:
+        # called by the listener thread
+        for change in changes:
+            if change.type != ChangeType.ADDED:
+                continue
+            value = int(change.document.get("hash"), 16)
+            # forwarded by this instance, already in the index
+            if self.index.distance(value) != 0:
+                self.index.add(value)
+
+    @override
+    @contextmanager
+    def listening(self) -> Generator[None, None, None]:
+        # the load isn't bound by the session deadline, it may read 100k hashes
+        with get_firestore_pool().listener() as db:
+            started_at = datetime.now(timezone.utc)
+            try:
+                self.load(db)
+            except Exception:  # noqa: BLE001
+                logger.exception("RepostCensor could not load the hashes")
+            self.__watch = (
+                db.collection(self.collection)
+                .where(filter=FieldFilter("forwardedAt", ">=", started_at))
+                .on_snapshot(self.on_snapshot)
+            )
+            try:
+                yield
+            finally:
+                self.__watch.unsubscribe()
+                self.__watch = None
+
+    async def get_hash(self, message: MemePayload) -> int:
+        photo = min(message.photo, key=lambda photo: photo.width)
+        if (value := self.hashes.get(photo.file_unique_id)) is not None:
+            return value
+        async with get_file_cache().open(photo.file_id, photo.file_unique_id) as data:
+            value = await asyncio.to_thread(lambda: dhash(Image.open(BytesIO(data))))
+        self.hashes.put(photo.file_unique_id, value)
+        return value
+
+    @override
+    async def check(self, message: MemePayload) -> CensorResult:
+        if not message.photo or not len(self.index):
+            return CensorResult(is_allowed=True)
+        value = await self.get_hash(message)
+        with get_metrics().histogram("repost.lookup").time():
+            distance = self.index.distance(value)
+        if distance is not None and distance <= self.max_distance:
+            get_metrics().counter("repost.rejected").inc()
+            logger.info("RepostCensor check [failed] [distance %d]", distance)
+            return CensorResult(
+                is_allowed=False, reason="This meme was already posted recently"
+            )
+        return CensorResult(is_allowed=True)
+
+    @override
+    async def forwarded(self, message: MemePayload) -> None:
+        if not message.photo:
+            return
+        value = await self.get_hash(message)
+        if self.index.distance(value) != 0:
+            self.index.add(value)
+        async with get_firestore_pool().session() as db:
+            await db.collection(self.collection).document(f"{value:016x}").set(
+                {
+                    "hash": f"{value:016x}",
+                    "message_id": message.message_id,
+                    "forwardedAt": datetime.now(timezone.utc),
+                    "expiresAt": datetime.now(timezone.utc) + self.firestore_ttl,
+                }
+            )
 
 
 class CombinedCensor(AbstractCensor):
+    """Runs the censors stage by stage, the censors of a stage concurrently.
+
+    The first rejection wins and cancels the censors still running. The
+    READ stage runs the prechecks of the later stages as well, so a user
+    over the limit is rejected before an explain of NewUserCensor, and
+    TimeCensor reserves the post only once everything else passed."""
+
     def __init__(self) -> None:
         self.censors: list[AbstractCensor] = [
             TimeCensor(),
+            RepostCensor(),
             NewUserCensor(),
         ]
 
-    async def check(self, message: Message) -> CensorResult:
+    async def __timed(
+        self, censor: AbstractCensor, message: MemePayload
+    ) -> CensorResult:
+        with get_metrics().histogram(f"censor.{type(censor).__name__}").time():
+            return await censor.check(message)
+
+    async def __run(
+        self,
+        checks: list[tuple[AbstractCensor, Coroutine[Any, Any, CensorResult]]],
+        results: dict[AbstractCensor, CensorResult],
+    ) -> CensorResult | None:
+        """Runs the checks concurrently, returns the first rejection."""
+        tasks = {asyncio.create_task(check): censor for censor, check in checks}
+        pending: set[asyncio.Task[CensorResult]] = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in sorted(
+                    done, key=lambda task: self.censors.index(tasks[task])
+                ):
+                    result = task.result()
+                    if not result.is_allowed:
+                        return result
+                    results[tasks[task]] = result
+        finally:
+            for task in pending:
+                task.cancel()
+        return None
+
+    @override
+    async def check(self, message: MemePayload) -> CensorResult:
+        results: dict[AbstractCensor, CensorResult] = {}
+        for stage in Stage:
+            checks = [
+                (censor, self.__timed(censor, message))
+                for censor in self.censors
+                if censor.stage == stage
+            ]
+            if stage == Stage.READ:
+                checks += [
+                    (censor, censor.precheck(message))
+                    for censor in self.censors
+                    if censor.stage != Stage.READ
+                ]
+            if (rejection := await self.__run(checks, results)) is not None:
+                return rejection
         reason: str = ""
         for censor in self.censors:
-            result: CensorResult = await censor.check(message)
-            if not result.is_allowed:
-                return result
-            if result.reason:
-                reason = result.reason
+            if results[censor].reason:
+                reason = results[censor].reason
         # if all censors approved, return the recent not empty reason
         return CensorResult(is_allowed=True, reason=reason)
 
+    @override
+    async def forwarded(self, message: MemePayload) -> None:
+        await asyncio.gather(*(censor.forwarded(message) for censor in self.censors))
+
+    @override
+    async def prefetch(self, messages: Sequence[MemePayload]) -> None:
+        await asyncio.gather(*(censor.prefetch(messages) for censor in self.censors))
+
+    @override
+    @contextmanager
+    def listening(self) -> Generator[None, None, None]:
+        with ExitStack() as stack:
+            for censor in self.censors:
+                stack.enter_context(censor.listening())
+            yield
+
 
 DefaultCensor = CombinedCensor
 
 
-class CensorSubscriber:
+class ForwardState(StrEnum):
+    # claimed by a delivery, it's forwarding the message
+    CLAIMED = "claimed"
+    FORWARDED = "forwarded"
+    # the reason was sent to the user
+    REJECTED = "rejected"
+
+
+class ForwardInProgress(RuntimeError):
+    """Another delivery of the message claimed the forward, retried later."""
+
+
+class CensorSubscriber(Subscriber):
+    """Checks the posts and forwards the allowed ones to the channel.
+
+    The outcome is recorded by chat and message id, so a redelivered message
+    is neither checked again nor rejected as a repost of itself. A forward is
+    claimed before it's sent and marked forwarded once the Bot API returns.
+    A claim older than the lease is left by a delivery that died, a
+    redelivery takes it over and forwards the message: it may be forwarded
+    twice if the delivery died after the forward, but it's never lost.
+    A rejection is recorded before its reason is sent, so the reason is
+    sent once."""
+
+    name = "censor"
+    # the user blocked the bot or deleted the message
+    permanent_errors = (BadRequest, Forbidden)
+    forwards_collection = "forwards"
+    # longer than the retention of the subscription
+    forwards_ttl = timedelta(days=8)
 
     def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
-        self.__loop = loop
+        config = get_messenger_config()
+        super().__init__(
+            loop=loop,
+            subscription=config.subscription,
+            batch_size=config.batch_size,
+            batch_window=config.batch_window,
+        )
         self.censor = DefaultCensor()
 
+    @override
     @contextmanager
     def subscription(self) -> Generator[None, None, None]:
-        self.__subscriber = SubscriberClient()
-        self.__subscriber_future = self.__subscriber.subscribe(
-            subscription=get_messenger_config().subscription,
-            callback=self.pull_message,
-        )
-        yield
-        self.__subscriber_future.cancel()
-        try:
-            self.__subscriber_future.result()
-        except Exception:
-            ...
-        self.__subscriber.close()
+        # censors are up to date before the first message is pulled
+        with (
+            get_allowlist().listening(),
+            self.censor.listening(),
+            super().subscription(),
+        ):
+            yield
+
+    @override
+    async def handle(self, message: MemePayload) -> None:
+        await self.check(message)
+
+    async def __check_user(
+        self, messages: list[tuple[int, MemePayload]], errors: list[Exception | None]
+    ) -> None:
+        for i, message in messages:
+            try:
+                await self.check(message)
+            except Exception as exc:
+                errors[i] = exc
 
-    def pull_message(self, pubsub_msg: PubSubMessage) -> None:
+    @override
+    async def handle_batch(
+        self, messages: Sequence[MemePayload]
+    ) -> list[BaseException | None]:
+        """Loads the state of all the users at once, then checks the users
+        concurrently, messages of a user in the order they were pulled."""
         try:
-            logger.info("Fetching message for a Censor")
-            data = json.loads(pubsub_msg.data.decode("utf-8"))
-            message = Message.de_json(data=data, bot=None)
-            asyncio.run_coroutine_threadsafe(
-                coro=self.check(message),
-                loop=self.__loop,
-            )
-            pubsub_msg.ack()
+            await self.censor.prefetch(messages)
         except Exception as exc:
-            tb = traceback.format_exc()
-            logger.error("%s\n%s", str(exc), tb)
-            pubsub_msg.nack()
+            # checks load what they need themselves
+            logger.warning("Prefetch failed: %s", str(exc))
+        users: defaultdict[int | None, list[tuple[int, MemePayload]]] = defaultdict(
+            list
+        )
+        for i, message in enumerate(messages):
+            users[message.user_id].append((i, message))
+        errors: list[Exception | None] = [None] * len(messages)
+        await asyncio.gather(
+            *(self.__check_user(user, errors) for user in users.values())
+        )
+        return list(errors)
 
-    async def check(self, message: Message) -> None:
-        result = await self.censor.check(message=message)
-        bot = Bot(token=get_token())
-        if result.reason:
-            await bot.send_message(
-                chat_id=message.chat.id,
-                text=result.reason,
-            )
-        if result.is_allowed:
+    def __forward_ref(
+        self, db: firestore.AsyncClient, message: MemePayload
+    ) -> firestore.AsyncDocumentReference:
+        return db.collection(self.forwards_collection).document(
+            f"{message.chat_id}_{message.message_id}"
+        )
+
+    async def __claim(self, message: MemePayload, result: CensorResult) -> bool:
+        now = datetime.now(timezone.utc)
+        state = ForwardState.CLAIMED if result.is_allowed else ForwardState.REJECTED
+        async with get_firestore_pool().session() as db:
+            try:
+                await self.__forward_ref(db, message).create(
+                    {
+                        "state": state,
+                        "claimedAt": now,
+                        "reason": result.reason,
+                        "expiresAt": now + self.forwards_ttl,
+                    }
+                )
+            except AlreadyExists:
+                return False
+        return True
+
+    async def __unclaim(self, message: MemePayload) -> None:
+        async with get_firestore_pool().session() as db:
+            await self.__forward_ref(db, message).delete()
+
+    async def __take_over(
+        self, message: MemePayload, snapshot: firestore.DocumentSnapshot
+    ) -> bool:
+        async with get_firestore_pool().session() as db:
+            try:
+                # fails if another redelivery took it over first
+                await self.__forward_ref(db, message).update(
+                    {"claimedAt": datetime.now(timezone.utc)},
+                    option=db.write_option(last_update_time=snapshot.update_time),
+                )
+            except FailedPrecondition:
+                return False
+        return True
+
+    async def __forward(self, message: MemePayload, reason: str) -> None:
+        bot = get_bot()
+        try:
             response = await bot.forward_message(
                 chat_id=get_channel_id(),
-                from_chat_id=message.chat.id,
+                from_chat_id=message.chat_id,
                 message_id=message.message_id,
             )
-            logger.info(response)
+        except Exception:
+            # not forwarded, a redelivery may try again
+            await self.__unclaim(message)
+            raise
+        logger.info(response)
+        async with get_firestore_pool().session() as db:
+            await self.__forward_ref(db, message).update(
+                {
+                    "state": ForwardState.FORWARDED,
+                    "forwardedAt": datetime.now(timezone.utc),
+                }
+            )
+        await self.censor.forwarded(message)
+        if reason:
+            await bot.send_message(chat_id=message.chat_id, text=reason)
+
+    async def __redelivered(
+        self, message: MemePayload, snapshot: firestore.DocumentSnapshot
+    ) -> None:
+        # records written before the states were claimed right before the
+        # forward, they expire after forwards_ttl
+        state = (snapshot.to_dict() or {}).get("state", ForwardState.FORWARDED)
+        if state == ForwardState.REJECTED:
+            logger.info("Message [%d] is already rejected", message.message_id)
+            return
+        if state == ForwardState.FORWARDED:
+            # only the censors' records may be left
+            logger.info("Message [%d] is already forwarded", message.message_id)
+            await self.censor.forwarded(message)
+            return
+        claimed_at = snapshot.get("claimedAt")
+        if claimed_at + self.config.max_lease_duration > datetime.now(timezone.utc):
+            raise ForwardInProgress(f"Message [{message.message_id}] is claimed")
+        if not await self.__take_over(message, snapshot):
+            raise ForwardInProgress(f"Message [{message.message_id}] is taken over")
+        logger.warning("Message [%d] claim is stale, forwarding", message.message_id)
+        await self.__forward(message, reason=snapshot.get("reason"))
+
+    async def check(self, message: MemePayload) -> None:
+        async with get_firestore_pool().session() as db:
+            snapshot = await self.__forward_ref(db, message).get()
+        if snapshot.exists:
+            await self.__redelivered(message, snapshot)
+            return
+        result = await self.censor.check(message=message)
+        if not await self.__claim(message, result):
+            # a concurrent delivery of the same message got here first
+            return
+        if result.is_allowed:
+            await self.__forward(message, reason=result.reason)
+            return
+        if result.reason:
+            try:
+                await get_bot().send_message(
+                    chat_id=message.chat_id, text=result.reason
+                )
+            except Exception:
+                await self.__unclaim(message)
+                raise
 
 
 def get_censor(loop: asyncio.AbstractEventLoop) -> CensorSubscriber:
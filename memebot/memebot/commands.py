@@ -1,23 +1,22 @@
 import abc
 from functools import cached_property
 from logging import getLogger
-from typing import final, override
+from typing import ClassVar, final, override
 
-from google.cloud.pubsub_v1 import PublisherClient
-from telegram import Bot, Message
+from telegram import Message
 
-from memebot.censor import DefaultCensor
-from memebot.config import (
-    get_channel_id,
-    get_explainer_config,
-    get_messenger_config,
-    get_token,
-)
+from memebot.bot import get_bot
+from memebot.config import get_channel_id, get_explainer_config, get_messenger_config
+from memebot.payload import SCHEMA, SCHEMA_ATTRIBUTE, MemePayload
+from memebot.publisher import get_publisher
 
 logger = getLogger(__name__)
 
 
 class CommandInterface(abc.ABC):
+    # kinds of Telegram updates the command is built from
+    update_kinds: ClassVar[tuple[str, ...]] = ("message",)
+
     @final
     def __init__(self, message: Message) -> None:
         self.message = message
@@ -37,30 +36,26 @@ class HelpCommand(CommandInterface):
 
     @override
     async def run(self) -> None:
-        await Bot(token=get_token()).send_message(
+        await get_bot().send_message(
             chat_id=self.message.chat.id, text=self.HELP_MESSAGE
         )
 
 
 class ForwardCommand(CommandInterface):
 
-    @cached_property
-    def publisher(self) -> PublisherClient:
-        return PublisherClient()
-
     @cached_property
     def topic(self) -> str:
         return get_messenger_config().topic
 
     @override
     async def run(self) -> None:
-        publish_future = self.publisher.publish(
+        publish_message_id = await get_publisher().publish(
             topic=self.topic,
-            data=self.message.to_json().encode("utf-8"),
+            data=MemePayload.from_message(self.message).encode(),
             message_id=str(self.message.message_id),
             chat_id=str(self.message.chat.id),
+            **{SCHEMA_ATTRIBUTE: SCHEMA},
         )
-        publish_message_id: str = publish_future.result()
         logger.info(
             "Put message in queue [msg: %s]: %s",
             str(self.message.message_id),
@@ -75,14 +70,14 @@ class ExplainCommand(CommandInterface):
         and there is a picture to explain"""
         logger.info(message)
         if message.chat.type != "supergroup":
-            await Bot(token=get_token()).send_message(
+            await get_bot().send_message(
                 chat_id=message.chat.id,
                 reply_to_message_id=message.id,
                 text=f"message.chat.type = {message.chat.type} instead of supregroup",
             )
             return False
         if message.reply_to_message is None:
-            await Bot(token=get_token()).send_message(
+            await get_bot().send_message(
                 chat_id=message.chat.id,
                 reply_to_message_id=message.id,
                 text=f"message.reply_to_message is None",
@@ -90,14 +85,14 @@ class ExplainCommand(CommandInterface):
             return False
         assert message.reply_to_message.sender_chat is not None
         if message.reply_to_message.sender_chat.id != get_channel_id():
-            await Bot(token=get_token()).send_message(
+            await get_bot().send_message(
                 chat_id=message.chat.id,
                 reply_to_message_id=message.id,
                 text=f"message.reply_to_message.sender_chat.id = {message.reply_to_message.sender_chat.id} instead of {get_channel_id()}",
             )
             return False
-        if message.reply_to_message.photo is None:
-            await Bot(token=get_token()).send_message(
+        if not message.reply_to_message.photo:
+            await get_bot().send_message(
                 chat_id=message.chat.id,
                 reply_to_message_id=message.id,
                 text="Can comment just photos for yet, no photo found.",
@@ -106,10 +101,6 @@ class ExplainCommand(CommandInterface):
         logger.info("Message is valid for explain")
         return True
 
-    @cached_property
-    def publisher(self) -> PublisherClient:
-        return PublisherClient()
-
     @cached_property
     def topic(self) -> str:
         return get_explainer_config().topic
@@ -118,13 +109,13 @@ class ExplainCommand(CommandInterface):
     async def run(self) -> None:
         if not (await self.validate(self.message)):
             return
-        publish_future = self.publisher.publish(
+        publish_message_id = await get_publisher().publish(
             topic=self.topic,
-            data=self.message.to_json().encode("utf-8"),
+            data=MemePayload.from_message(self.message).encode(),
             message_id=str(self.message.message_id),
             chat_id=str(self.message.chat.id),
+            **{SCHEMA_ATTRIBUTE: SCHEMA},
         )
-        publish_message_id: str = publish_future.result()
         logger.info(
             "Published explain request [msg: %s]: %s",
             str(self.message.message_id),
@@ -140,6 +131,17 @@ COMMAND_REGISTRY: dict[str, type[CommandInterface]] = {
 }
 
 
+def handled_update_kinds() -> list[str]:
+    """Update kinds to subscribe to, everything else is not delivered at all."""
+    return sorted(
+        {
+            kind
+            for command_cls in COMMAND_REGISTRY.values()
+            for kind in command_cls.update_kinds
+        }
+    )
+
+
 def build_command(message: Message) -> CommandInterface:
     text = message.text if message.text else ""
     # bot commands
@@ -1,39 +1,201 @@
+import abc
+import asyncio
 import logging
 import os
+import tempfile
+import time
 from dataclasses import dataclass
-from functools import cache
+from datetime import timedelta
+from functools import cache, cached_property
+from typing import TYPE_CHECKING, override
 
-import google.cloud.secretmanager as sm
+from memebot.metrics import get_metrics
 
+if TYPE_CHECKING:
+    import google.cloud.secretmanager as sm
 
-def get_secret(resource_name: str) -> str:
-    client = sm.SecretManagerServiceClient()
-    response = client.access_secret_version(name=resource_name)
-    payload_bytes: bytes = response.payload.data  # type: ignore[assignment]
-    return payload_bytes.decode("utf-8")
+logger = logging.getLogger(__name__)
 
 
-def retrieve_secret(name: str) -> str:
-    if not (token := os.getenv(name)):
-        return "NoToken"
-    if token.startswith("projects/"):
-        return get_secret(token)
-    return token
+class SecretSource(abc.ABC):
+
+    @abc.abstractmethod
+    async def fetch(self, resource_name: str) -> str: ...
+
+    @abc.abstractmethod
+    def fetch_sync(self, resource_name: str) -> str:
+        """Blocking fetch for secrets requested before they're prefetched."""
+
+
+class SecretManagerSource(SecretSource):
+    # secrets are resolved at start, keep the clients out of the import time
+
+    @cached_property
+    def client(self) -> "sm.SecretManagerServiceAsyncClient":
+        import google.cloud.secretmanager as sm
+
+        return sm.SecretManagerServiceAsyncClient()
+
+    @cached_property
+    def sync_client(self) -> "sm.SecretManagerServiceClient":
+        import google.cloud.secretmanager as sm
+
+        return sm.SecretManagerServiceClient()
+
+    @override
+    async def fetch(self, resource_name: str) -> str:
+        response = await self.client.access_secret_version(name=resource_name)
+        payload_bytes: bytes = response.payload.data  # type: ignore[assignment]
+        return payload_bytes.decode("utf-8")
+
+    @override
+    def fetch_sync(self, resource_name: str) -> str:
+        response = self.sync_client.access_secret_version(name=resource_name)
+        payload_bytes: bytes = response.payload.data  # type: ignore[assignment]
+        return payload_bytes.decode("utf-8")
+
+
+class LocalSecretSource(SecretSource):
+    """Secrets from a dict, a stand-in for Secret Manager in tests."""
+
+    def __init__(self, secrets: dict[str, str]) -> None:
+        self.secrets = secrets
+
+    @override
+    async def fetch(self, resource_name: str) -> str:
+        return self.secrets[resource_name]
+
+    @override
+    def fetch_sync(self, resource_name: str) -> str:
+        return self.secrets[resource_name]
+
+
+class SecretNotLoaded(RuntimeError):
+    """A secret read on the event loop wasn't prefetched."""
+
+
+class SecretsLoader:
+    """Resolves secrets referenced by env variables ("projects/.../versions/x").
+
+    All secrets are prefetched concurrently at start and cached for ttl, an
+    expired secret is served stale while it's refreshed in background, so
+    rotated secrets are picked up without blocking callers. A failed refresh
+    is retried after retry_backoff, doubled on every failure up to ttl.
+
+    A secret missing from the cache is only fetched outside the event loop,
+    on the loop the read raises SecretNotLoaded: names lists every secret the
+    prefetch has to cover."""
+
+    names = ("TELEGRAM_TOKEN", "SEARCH_CX_KEY", "SEARCH_API_KEY")
+    retry_backoff = timedelta(seconds=30)
+
+    def __init__(self, source: SecretSource, ttl: timedelta) -> None:
+        self.source = source
+        self.ttl = ttl
+        self.__secrets: dict[str, tuple[str, float]] = {}
+        self.__refreshing: dict[str, asyncio.Task[None]] = {}
+        # resource name: time of the last failed fetch, failures in a row
+        self.__failures: dict[str, tuple[float, int]] = {}
+
+    def __store(self, resource_name: str, secret: str) -> str:
+        self.__secrets[resource_name] = (secret, time.monotonic())
+        self.__failures.pop(resource_name, None)
+        return secret
+
+    def __failed(self, resource_name: str) -> None:
+        logger.exception("Could not fetch secret %s", resource_name)
+        get_metrics().counter("secrets.failures").inc()
+        _, failures = self.__failures.get(resource_name, (0.0, 0))
+        self.__failures[resource_name] = (time.monotonic(), failures + 1)
+
+    def __backing_off(self, resource_name: str) -> bool:
+        if (failure := self.__failures.get(resource_name)) is None:
+            return False
+        failed_at, failures = failure
+        backoff = min(
+            self.retry_backoff.total_seconds() * 2 ** (failures - 1),
+            max(self.ttl, self.retry_backoff).total_seconds(),
+        )
+        return time.monotonic() - failed_at < backoff
+
+    async def __load(self, resource_name: str) -> None:
+        try:
+            with get_metrics().histogram("secrets.fetch").time():
+                self.__store(resource_name, await self.source.fetch(resource_name))
+        except Exception:  # noqa: BLE001
+            # the cached value is served until the next attempt
+            self.__failed(resource_name)
+        finally:
+            self.__refreshing.pop(resource_name, None)
+
+    async def prefetch(self) -> None:
+        start = time.perf_counter()
+        resource_names = {
+            value
+            for name in self.names
+            if (value := os.getenv(name, "")).startswith("projects/")
+        }
+        await asyncio.gather(*(self.__load(name) for name in resource_names))
+        logger.info(
+            "Prefetched %d secrets in %.0f ms",
+            len(resource_names),
+            (time.perf_counter() - start) * 1000,
+        )
+
+    @staticmethod
+    def __on_loop() -> bool:
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        return True
+
+    def get(self, name: str) -> str:
+        if not (value := os.getenv(name)):
+            return "NoToken"
+        if not value.startswith("projects/"):
+            return value
+        if (cached := self.__secrets.get(value)) is None:
+            if self.__on_loop():
+                raise SecretNotLoaded(f"{name} isn't prefetched")
+            return self.__store(value, self.source.fetch_sync(value))
+        secret, fetched_at = cached
+        if time.monotonic() - fetched_at > self.ttl.total_seconds():
+            self.__refresh(value)
+        return secret
+
+    def __refresh(self, resource_name: str) -> None:
+        if resource_name in self.__refreshing or self.__backing_off(resource_name):
+            return
+        if not self.__on_loop():
+            try:
+                self.__store(resource_name, self.source.fetch_sync(resource_name))
+            except Exception:  # noqa: BLE001
+                self.__failed(resource_name)
+            return
+        self.__refreshing[resource_name] = asyncio.get_running_loop().create_task(
+            self.__load(resource_name)
+        )
 
 
 @cache
+def get_secrets_loader() -> SecretsLoader:
+    return SecretsLoader(
+        source=SecretManagerSource(),
+        ttl=timedelta(seconds=int(os.getenv("SECRETS_TTL_SECONDS", "3600"))),
+    )
+
+
 def get_token() -> str:
-    return retrieve_secret("TELEGRAM_TOKEN")
+    return get_secrets_loader().get("TELEGRAM_TOKEN")
 
 
-@cache
 def get_search_cx_key() -> str:
-    return retrieve_secret("SEARCH_CX_KEY")
+    return get_secrets_loader().get("SEARCH_CX_KEY")
 
 
-@cache
 def get_search_api_key() -> str:
-    return retrieve_secret("SEARCH_API_KEY")
+    return get_secrets_loader().get("SEARCH_API_KEY")
 
 
 @cache
@@ -50,12 +212,112 @@ def get_chat_id() -> int:
 class ExplainerConfig:
     topic: str
     subscription: str
+    # program state saved by dspy after optimization, loaded at startup
+    program_path: str | None
+    max_iters: int
 
 
 @dataclass
 class MessengerConfig:
     topic: str
     subscription: str
+    # censor checks of messages pulled within the window are batched
+    batch_size: int
+    batch_window: timedelta
+
+
+@dataclass
+class BotConfig:
+    pool_size: int
+    pool_timeout: float
+    keepalive_expiry: float
+    # overridden to run against a local Bot API server
+    base_url: str
+    base_file_url: str
+
+
+@dataclass
+class PublisherConfig:
+    max_latency: timedelta
+    max_messages: int
+    max_bytes: int
+
+
+@dataclass
+class RateLimitConfig:
+    # tokens per minute and bucket capacity
+    user_rate: float
+    user_burst: int
+    chat_rate: float
+    chat_burst: int
+    # limits are divided between instances, each one admits its share
+    n_instances: int
+    max_keys: int
+
+
+@dataclass
+class PollingConfig:
+    limit: int
+    timeout: timedelta
+    concurrency: int
+    # offset checkpoint file, empty to disable
+    offset_path: str
+
+
+@dataclass
+class WorkerConfig:
+    n_workers: int
+    queue_size: int
+    # what to do when the queue is full: "reject" with 503 or run "inline"
+    overflow: str
+    drain_timeout: float
+
+
+@dataclass
+class DedupConfig:
+    ttl: timedelta
+    max_size: int
+    # shared store of seen updates across instances: "none", "memory", "firestore"
+    store: str
+
+
+@dataclass
+class FirestoreConfig:
+    pool_size: int
+    # deadline of a single session: a read, a write or a transaction
+    deadline: timedelta
+    health_check_interval: timedelta
+
+
+@dataclass
+class ImageConfig:
+    # the largest photo size within the budget is downloaded and sent to the LM
+    max_pixels: int
+    max_side: int
+    max_bytes: int
+    quality: int
+
+
+@dataclass
+class FileCacheConfig:
+    directory: str
+    # downloaded files are evicted least recently used first above it
+    max_bytes: int
+    # Telegram keeps a file_path valid for at least an hour
+    path_ttl: timedelta
+
+
+@dataclass
+class SubscriberConfig:
+    # messages leased by the client at once, FlowControl.max_messages
+    max_messages: int
+    # handlers running on the event loop at once per subscription
+    max_concurrency: int
+    # leases are extended up to it, an explain may take minutes
+    max_lease_duration: timedelta
+    # failed deliveries of a message before it's dropped, without a dead-letter
+    # policy on the subscription
+    max_delivery_attempts: int
 
 
 @cache
@@ -66,6 +328,8 @@ def get_explainer_config() -> ExplainerConfig:
             "EXPLAIN_SUBSCRIPTION",
             "projects/test-project/subscriptions/sub-explain-pull",
         ),
+        program_path=os.getenv("DSPY_PROGRAM_PATH") or None,
+        max_iters=int(os.getenv("EXPLAIN_MAX_ITERS", "5")),
     )
 
 
@@ -77,6 +341,122 @@ def get_messenger_config() -> MessengerConfig:
             "MESSAGE_SUBSCRIPTION",
             "projects/test-project/subscriptions/sub-message-pull",
         ),
+        batch_size=int(os.getenv("MESSAGE_BATCH_SIZE", "16")),
+        batch_window=timedelta(
+            milliseconds=int(os.getenv("MESSAGE_BATCH_WINDOW_MS", "100"))
+        ),
+    )
+
+
+@cache
+def get_bot_config() -> BotConfig:
+    return BotConfig(
+        pool_size=int(os.getenv("BOT_POOL_SIZE", "16")),
+        pool_timeout=float(os.getenv("BOT_POOL_TIMEOUT", "5.0")),
+        keepalive_expiry=float(os.getenv("BOT_KEEPALIVE_EXPIRY", "60.0")),
+        base_url=os.getenv("BOT_API_URL", "https://api.telegram.org/bot"),
+        base_file_url=os.getenv(
+            "BOT_API_FILE_URL", "https://api.telegram.org/file/bot"
+        ),
+    )
+
+
+@cache
+def get_publisher_config() -> PublisherConfig:
+    return PublisherConfig(
+        max_latency=timedelta(
+            milliseconds=int(os.getenv("PUBLISHER_MAX_LATENCY_MS", "10"))
+        ),
+        max_messages=int(os.getenv("PUBLISHER_MAX_MESSAGES", "100")),
+        max_bytes=int(os.getenv("PUBLISHER_MAX_BYTES", "1000000")),
+    )
+
+
+@cache
+def get_ratelimit_config() -> RateLimitConfig:
+    return RateLimitConfig(
+        user_rate=float(os.getenv("RATELIMIT_USER_PER_MINUTE", "10")),
+        user_burst=int(os.getenv("RATELIMIT_USER_BURST", "5")),
+        chat_rate=float(os.getenv("RATELIMIT_CHAT_PER_MINUTE", "60")),
+        chat_burst=int(os.getenv("RATELIMIT_CHAT_BURST", "20")),
+        n_instances=int(os.getenv("RATELIMIT_INSTANCES", "1")),
+        max_keys=int(os.getenv("RATELIMIT_MAX_KEYS", "10000")),
+    )
+
+
+@cache
+def get_polling_config() -> PollingConfig:
+    return PollingConfig(
+        # Bot API accepts 1-100 updates per getUpdates call
+        limit=int(os.getenv("POLLING_LIMIT", "100")),
+        timeout=timedelta(seconds=int(os.getenv("POLLING_TIMEOUT_SECONDS", "30"))),
+        concurrency=int(os.getenv("POLLING_CONCURRENCY", "16")),
+        offset_path=os.getenv("POLLING_OFFSET_PATH", ".polling-offset"),
+    )
+
+
+@cache
+def get_worker_config() -> WorkerConfig:
+    return WorkerConfig(
+        # 0 workers: commands are run inline by the webhook
+        n_workers=int(os.getenv("COMMAND_WORKERS", "0")),
+        queue_size=int(os.getenv("COMMAND_QUEUE_SIZE", "64")),
+        overflow=os.getenv("COMMAND_QUEUE_OVERFLOW", "reject"),
+        drain_timeout=float(os.getenv("COMMAND_QUEUE_DRAIN_TIMEOUT", "10.0")),
+    )
+
+
+@cache
+def get_dedup_config() -> DedupConfig:
+    return DedupConfig(
+        ttl=timedelta(seconds=int(os.getenv("DEDUP_TTL_SECONDS", "3600"))),
+        max_size=int(os.getenv("DEDUP_MAX_SIZE", "10000")),
+        store=os.getenv("DEDUP_STORE", "none"),
+    )
+
+
+@cache
+def get_subscriber_config() -> SubscriberConfig:
+    return SubscriberConfig(
+        max_messages=int(os.getenv("SUBSCRIBER_MAX_MESSAGES", "16")),
+        max_concurrency=int(os.getenv("SUBSCRIBER_MAX_CONCURRENCY", "4")),
+        max_lease_duration=timedelta(
+            seconds=int(os.getenv("SUBSCRIBER_MAX_LEASE_SECONDS", "600"))
+        ),
+        max_delivery_attempts=int(os.getenv("SUBSCRIBER_MAX_DELIVERY_ATTEMPTS", "5")),
+    )
+
+
+@cache
+def get_image_config() -> ImageConfig:
+    return ImageConfig(
+        # Gemini bills an image up to 768x768 as a single tile
+        max_pixels=int(os.getenv("IMAGE_MAX_PIXELS", str(768 * 768))),
+        max_side=int(os.getenv("IMAGE_MAX_SIDE", "768")),
+        max_bytes=int(os.getenv("IMAGE_MAX_BYTES", str(256 * 1024))),
+        quality=int(os.getenv("IMAGE_QUALITY", "85")),
+    )
+
+
+@cache
+def get_file_cache_config() -> FileCacheConfig:
+    return FileCacheConfig(
+        directory=os.getenv(
+            "FILE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "memebot-files")
+        ),
+        max_bytes=int(os.getenv("FILE_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+        path_ttl=timedelta(seconds=int(os.getenv("FILE_PATH_TTL_SECONDS", "600"))),
+    )
+
+
+@cache
+def get_firestore_config() -> FirestoreConfig:
+    return FirestoreConfig(
+        pool_size=int(os.getenv("FIRESTORE_POOL_SIZE", "2")),
+        deadline=timedelta(seconds=int(os.getenv("FIRESTORE_DEADLINE_SECONDS", "10"))),
+        health_check_interval=timedelta(
+            seconds=int(os.getenv("FIRESTORE_HEALTH_CHECK_SECONDS", "60"))
+        ),
     )
 
 
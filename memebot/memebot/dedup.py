@@ -0,0 +1,134 @@
+import abc
+import time
+import traceback
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from functools import cache
+from logging import getLogger
+from typing import override
+
+from memebot.config import DedupConfig, get_dedup_config
+from memebot.metrics import get_metrics
+from memebot.storage import get_firestore_pool
+
+logger = getLogger(__name__)
+
+
+class UpdateStore(abc.ABC):
+    """Registry of seen update ids shared between instances."""
+
+    def __init__(self, ttl: timedelta) -> None:
+        self.ttl = ttl
+
+    @abc.abstractmethod
+    async def add(self, update_id: int) -> bool:
+        """Registers the update, returns False if it's already registered."""
+
+    @abc.abstractmethod
+    async def discard(self, update_id: int) -> None: ...
+
+
+class InMemoryUpdateStore(UpdateStore):
+
+    def __init__(self, ttl: timedelta) -> None:
+        super().__init__(ttl=ttl)
+        self.__expires_at: dict[int, datetime] = {}
+
+    @override
+    async def add(self, update_id: int) -> bool:
+        now = datetime.now(timezone.utc)
+        if (expires_at := self.__expires_at.get(update_id)) and expires_at > now:
+            return False
+        self.__expires_at[update_id] = now + self.ttl
+        return True
+
+    @override
+    async def discard(self, update_id: int) -> None:
+        self.__expires_at.pop(update_id, None)
+
+
+class FirestoreUpdateStore(UpdateStore):
+
+    collection = "webhook_updates"
+
+    @override
+    async def add(self, update_id: int) -> bool:
+        from google.api_core.exceptions import AlreadyExists
+
+        # create() fails if the document exists, check and insert is atomic
+        try:
+            async with get_firestore_pool().session() as db:
+                await db.collection(self.collection).document(str(update_id)).create(
+                    {"expiresAt": datetime.now(timezone.utc) + self.ttl}
+                )
+        except AlreadyExists:
+            return False
+        return True
+
+    @override
+    async def discard(self, update_id: int) -> None:
+        async with get_firestore_pool().session() as db:
+            await db.collection(self.collection).document(str(update_id)).delete()
+
+
+class UpdateDeduplicator:
+    """Answers whether an update was already delivered.
+
+    Telegram redelivers an update if the webhook is slow to respond, the local
+    LRU catches retries hitting the same instance, the optional shared store
+    catches retries routed to another instance."""
+
+    def __init__(self, config: DedupConfig, store: UpdateStore | None = None) -> None:
+        self.config = config
+        self.store = store
+        self.__seen: OrderedDict[int, float] = OrderedDict()
+
+    def __remember(self, update_id: int) -> bool:
+        """Returns False if the update is already in the local cache."""
+        now = time.monotonic()
+        if (expires_at := self.__seen.get(update_id)) is not None and expires_at > now:
+            self.__seen.move_to_end(update_id)
+            return False
+        self.__seen[update_id] = now + self.config.ttl.total_seconds()
+        self.__seen.move_to_end(update_id)
+        while len(self.__seen) > self.config.max_size:
+            self.__seen.popitem(last=False)
+        return True
+
+    async def is_duplicate(self, update_id: int) -> bool:
+        metrics = get_metrics()
+        if not self.__remember(update_id):
+            metrics.counter("dedup.local_hits").inc()
+            return True
+        if self.store is None:
+            return False
+        try:
+            is_new = await self.store.add(update_id)
+        except Exception as exc:
+            # fail open, a duplicate is better than a lost update
+            tb = traceback.format_exc()
+            logger.error("%s\n%s", str(exc), tb)
+            return False
+        if not is_new:
+            metrics.counter("dedup.store_hits").inc()
+        return not is_new
+
+    async def forget(self, update_id: int) -> None:
+        """Unregisters the update, so its redelivery is processed."""
+        self.__seen.pop(update_id, None)
+        if self.store is not None:
+            await self.store.discard(update_id)
+
+
+@cache
+def get_deduplicator() -> UpdateDeduplicator:
+    config = get_dedup_config()
+    stores: dict[str, type[UpdateStore]] = {
+        "memory": InMemoryUpdateStore,
+        "firestore": FirestoreUpdateStore,
+    }
+    store_cls = stores.get(config.store)
+    return UpdateDeduplicator(
+        config=config,
+        store=store_cls(ttl=config.ttl) if store_cls is not None else None,
+    )
@@ -1,25 +1,29 @@
 import asyncio
-import json
+import base64
+import hashlib
 import logging
-import traceback
-from collections.abc import Generator
-from contextlib import contextmanager
+import threading
 from datetime import datetime, timedelta, timezone
-from functools import cached_property
-from io import BytesIO
+from functools import cache
+from typing import override
 
 import dspy
 import vertexai
 from google.cloud import firestore
-from google.cloud.firestore import FieldFilter
-from google.cloud.pubsub_v1 import SubscriberClient
-from google.cloud.pubsub_v1.subscriber.message import Message as PubSubMessage
-from PIL import Image
+from google.cloud.firestore import Increment
 from pydantic import BaseModel, Field
-from telegram import Bot, Message
-
-from memebot.config import MODEL_NAME, get_explainer_config, get_token
+from telegram.error import BadRequest, Forbidden
+
+from memebot.bot import get_bot
+from memebot.cache import LRUCache
+from memebot.config import MODEL_NAME, get_explainer_config, get_image_config
+from memebot.files import get_file_cache
+from memebot.images import preprocess, select_photo
+from memebot.metrics import get_metrics
+from memebot.payload import MemePayload, PhotoRef
 from memebot.retrievers import GoogleSearch
+from memebot.storage import get_firestore_pool
+from memebot.subscriber import Subscriber
 
 logger = logging.getLogger(__name__)
 
@@ -107,150 +111,293 @@ class TooManyExplains(ExplainerException): ...
 class IsAlreadyExplained(ExplainerException): ...
 
 
+class NoPhoto(ExplainerException): ...
+
+
+class ExplanationCache:
+    """Explanations by photo, caption and model: an in-process LRU in front
+    of Firestore, so the same meme isn't explained by the LM twice."""
+
+    collection = "explanations"
+    ttl = timedelta(days=30)
+
+    def __init__(self, max_size: int = 256) -> None:
+        self.local: LRUCache[str, MemeInfoModel] = LRUCache(max_size=max_size)
+
+    @staticmethod
+    def key(photo: PhotoRef, caption: str) -> str:
+        digest = hashlib.sha256(f"{MODEL_NAME}\n{caption}".encode()).hexdigest()
+        return f"{photo.file_unique_id}_{digest[:16]}"
+
+    async def get(self, key: str) -> MemeInfoModel | None:
+        metrics = get_metrics()
+        if (meme_info := self.local.get(key)) is not None:
+            metrics.counter("explanations.hits.memory").inc()
+            return meme_info
+        try:
+            async with get_firestore_pool().session() as db:
+                doc = await db.collection(self.collection).document(key).get()
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Could not read cached explanation: %s", str(exc))
+            doc = None
+        if doc is None or not doc.exists:
+            metrics.counter("explanations.misses").inc()
+            return None
+        metrics.counter("explanations.hits.firestore").inc()
+        meme_info = MemeInfoModel.model_validate(doc.get("meme_info"))
+        self.local.put(key, meme_info)
+        return meme_info
+
+    async def put(self, key: str, meme_info: MemeInfoModel) -> None:
+        self.local.put(key, meme_info)
+        try:
+            async with get_firestore_pool().session() as db:
+                await db.collection(self.collection).document(key).set(
+                    {
+                        "meme_info": meme_info.model_dump(mode="json"),
+                        "model": MODEL_NAME,
+                        "expiresAt": datetime.now(timezone.utc) + self.ttl,
+                    }
+                )
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Could not store explanation: %s", str(exc))
+
+
+@cache
+def get_explanation_cache() -> ExplanationCache:
+    return ExplanationCache()
+
+
+def build_program(max_iters: int, program_path: str | None = None) -> dspy.ReAct:
+    program = dspy.ReAct(
+        signature=MemeInfoSignature,
+        tools=[dspy.Tool(GoogleSearch().search)],
+        max_iters=max_iters,
+    )
+    if program_path is not None:
+        # demos and instructions tuned by an optimizer, see program.save()
+        program.load(program_path)
+        logger.info("Loaded dspy program from %s", program_path)
+    return program
+
+
+@cache
+def _get_program() -> dspy.ReAct:
+    config = get_explainer_config()
+    return build_program(max_iters=config.max_iters, program_path=config.program_path)
+
+
+_program_lock = threading.Lock()
+
+
+def get_program() -> dspy.ReAct:
+    """The ReAct program shared by all explains. It keeps no state between
+    calls, so concurrent acall() are fine. It is first built by
+    get_explainer() in a subscriber thread, the lock keeps a racing caller
+    from building a second one."""
+    with _program_lock:
+        return _get_program()
+
+
 class Explainer:
     # FIXME: rely on message id is incorrect, use file_id instead
 
     n_hour_limit = 24
     n_generations_limit = 25
+    # explains per hour, summed over the last n_hour_limit hours for the quota
+    quota_collection = "llm_quota"
+
+    def __init__(self) -> None:
+        self.__counts: LRUCache[str, int] = LRUCache(max_size=2 * self.n_hour_limit)
 
-    async def _explain(self, caption: str, image: Image.Image) -> MemeInfoModel:
+    async def _explain(self, caption: str, image: dspy.Image) -> MemeInfoModel:
         logger.info("caption: %s \nimage: [%s]", caption, str(image))
-        react = dspy.ReAct(
-            signature=MemeInfoSignature,
-            tools=[dspy.Tool(GoogleSearch().search)],
-            max_iters=5,
-        )
-        meme_image = dspy.Image.from_PIL(image)
-        result: dspy.Prediction = await react.acall(
+        result: dspy.Prediction = await get_program().acall(
             caption=caption,
-            meme_image=meme_image,
+            meme_image=image,
         )
         meme_info: MemeInfoModel = result.meme_info
         logger.info("Meme info: %s", str(meme_info))
         return meme_info
 
-    @cached_property
-    def db(self) -> firestore.Client:
-        return firestore.Client()
-
-    def __check(self, message: Message) -> None:
-        since = datetime.now(timezone.utc) - timedelta(hours=self.n_hour_limit)
-        buckets = self.db.collection("llm_requests").where(
-            filter=FieldFilter("ts", ">=", since)
-        )
-        n_requests = 0
-        for doc in buckets.stream():
-            n_requests += 1
-            message_id = (
-                message.reply_to_message.id
-                if message.reply_to_message is not None
-                else message.message_id
-            )
-            if message_id == doc.to_dict().get("message_id", 0):
-                logger.info("Is explained")
-                raise IsAlreadyExplained()
-            if n_requests >= self.n_generations_limit:
+    def __hours(self, now: datetime) -> list[str]:
+        """Hourly quota counters covering the last n_hour_limit hours."""
+        hour = now.replace(minute=0, second=0, microsecond=0)
+        return [
+            (hour - timedelta(hours=i)).strftime("%Y%m%d%H")
+            for i in range(self.n_hour_limit)
+        ]
+
+    async def __count(self, db: firestore.AsyncClient, now: datetime) -> int:
+        current, *past = self.__hours(now)
+        # past hours are complete, their counts are read once per instance
+        missing = [hour for hour in past if self.__counts.get(hour) is None]
+        refs = [
+            db.collection(self.quota_collection).document(hour)
+            for hour in (current, *missing)
+        ]
+        n_current = 0
+        async for doc in db.get_all(refs):
+            count = doc.get("count") if doc.exists else 0
+            if doc.id == current:
+                n_current = count
+            else:
+                self.__counts.put(doc.id, count)
+        return n_current + sum(self.__counts.get(hour) or 0 for hour in past)
+
+    async def __check(self, message: MemePayload, quota: bool = True) -> None:
+        now = datetime.now(timezone.utc)
+        # requests were registered by the bare message id before, drop the
+        # legacy id once those expired, n_hour_limit after the deploy
+        legacy_id = str((message.reply_to_message or message).message_id)
+        async with get_firestore_pool().session() as db:
+            requests = db.collection("llm_requests")
+            refs = [
+                requests.document(self.__request_id(message)),
+                requests.document(legacy_id),
+            ]
+            async for request in db.get_all(refs):
+                if request.exists and request.get("expiresAt") > now:
+                    logger.info("Is explained")
+                    raise IsAlreadyExplained()
+            if quota and await self.__count(db, now=now) >= self.n_generations_limit:
                 logger.info("Too many requests")
                 raise TooManyExplains()
 
-    def __register(self, message_id: str) -> None:
-        self.db.collection("llm_requests").document(message_id).set(
-            {
-                "expiresAt": datetime.now(timezone.utc)
-                + timedelta(hours=self.n_hour_limit),
-                "message_id": message_id,
-            }
-        )
-
-    async def get_image(self, message: Message) -> Image.Image:
+    def __request_id(self, message: MemePayload) -> str:
+        # message ids are unique within a chat only
+        explained = message.reply_to_message or message
+        return f"{explained.chat_id}_{explained.message_id}"
+
+    async def __register(self, message_id: str, generated: bool = True) -> None:
+        now = datetime.now(timezone.utc)
+        expires_at = now + timedelta(hours=self.n_hour_limit)
+        async with get_firestore_pool().session() as db:
+            batch = db.batch()
+            batch.set(
+                db.collection("llm_requests").document(message_id),
+                {"ts": now, "expiresAt": expires_at, "message_id": message_id},
+            )
+            if generated:
+                batch.set(
+                    db.collection(self.quota_collection).document(self.__hours(now)[0]),
+                    {
+                        "count": Increment(1),
+                        "expiresAt": expires_at + timedelta(hours=1),
+                    },
+                    merge=True,
+                )
+            await batch.commit()
+
+    def select_photo(self, message: MemePayload) -> PhotoRef:
         photo_block = (
             message.reply_to_message.photo
             if message.reply_to_message is not None
             else message.photo
         )
-        file_record = max(
-            (
-                photo
-                for photo in photo_block
-                if (photo.width < 800 and photo.height < 800)
-            ),
-            key=lambda photo: photo.width,
+        if not photo_block:
+            raise NoPhoto()
+        return select_photo(photo_block, max_pixels=get_image_config().max_pixels)
+
+    async def get_image(self, message: MemePayload) -> dspy.Image:
+        file_record = self.select_photo(message)
+        async with get_file_cache().open(
+            file_record.file_id, file_record.file_unique_id
+        ) as data:
+            with get_metrics().histogram("explainer.preprocess").time():
+                jpeg = await asyncio.to_thread(preprocess, data, get_image_config())
+            logger.info(
+                "Image [%dx%d]: %d bytes read, %d bytes sent",
+                file_record.width,
+                file_record.height,
+                len(data),
+                len(jpeg),
+            )
+        get_metrics().histogram("explainer.image_bytes").observe(len(jpeg))
+        return dspy.Image(f"data:image/jpeg;base64,{base64.b64encode(jpeg).decode()}")
+
+    def __caption(self, message: MemePayload) -> str:
+        original_caption = (
+            message.reply_to_message.caption
+            if message.reply_to_message
+            else message.caption
+        )
+        return "" "" if not original_caption else original_caption
+
+    async def cached(self, message: MemePayload) -> MemeInfoModel | None:
+        """The explanation given before, without the checks and the quota."""
+        return await get_explanation_cache().get(
+            get_explanation_cache().key(
+                photo=self.select_photo(message), caption=self.__caption(message)
+            )
         )
-        hfile = await Bot(token=get_token()).get_file(file_record.file_id)
-        buffer = BytesIO()
-        await hfile.download_to_memory(out=buffer)
-        logger.info("Image downloaded: %d bytes", buffer.tell())
-        buffer.seek(0)
-        image = Image.open(buffer)
-        logger.info("Image resolution: %s", repr(image.size))
-        return image
-
-    async def explain(self, message: Message) -> MemeInfoModel:
+
+    async def explain(self, message: MemePayload) -> MemeInfoModel:
         logger.info("Running explain")
+        caption = self.__caption(message)
+        explanations = get_explanation_cache()
+        key = explanations.key(photo=self.select_photo(message), caption=caption)
+        cached = await explanations.get(key)
         try:
-            self.__check(message=message)
+            # a cached explanation doesn't take the LM quota
+            await self.__check(message=message, quota=cached is None)
         except ExplainerException:
             raise
+        if cached is not None:
+            logger.info("Explanation is cached [%s]", key)
+            await self.__register(
+                message_id=self.__request_id(message), generated=False
+            )
+            return cached
         image = await self.get_image(message=message)
-        original_caption = (
-            message.reply_to_message.caption
-            if message.reply_to_message
-            else message.caption
-        )
-        caption = "" "" if not original_caption else original_caption
         meme_info = await self._explain(caption=caption, image=image)
         logger.info(message)
-        self.__register(
-            message_id=(
-                (str(message.reply_to_message.id))
-                if message.reply_to_message
-                else str(message.message_id)
-            )
-        )
+        await explanations.put(key, meme_info)
+        await self.__register(message_id=self.__request_id(message))
         logger.info("Registered")
         return meme_info
 
 
-class ExplainSubscriber:
+class ExplainSubscriber(Subscriber):
+
+    name = "explainer"
+    # the /explain message was deleted or the bot was removed from the chat
+    permanent_errors = (BadRequest, Forbidden)
 
     def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
-        self.__loop = loop
+        super().__init__(loop=loop, subscription=get_explainer_config().subscription)
         self.explainer = Explainer()
 
-    @contextmanager
-    def subscription(self) -> Generator[None, None, None]:
-        self.__subscriber = SubscriberClient()
-        self.__subscriber_future = self.__subscriber.subscribe(
-            subscription=get_explainer_config().subscription,
-            callback=self.pull_message,
-        )
-        yield
-        self.__subscriber_future.cancel()
-        try:
-            self.__subscriber_future.result()
-        except Exception:
-            ...
-        self.__subscriber.close()
+    @override
+    async def handle(self, message: MemePayload) -> None:
+        await self.explain(message)
 
-    async def explain(self, message: Message) -> None:
+    async def explain(self, message: MemePayload) -> None:
         try:
             meme_info = await self.explainer.explain(message=message)
         except TooManyExplains:
             text = f"Sorry, too many explain calls in {Explainer.n_hour_limit} hours. Try again later."
-            await Bot(token=get_token()).send_message(
-                chat_id=message.chat.id,
-                reply_to_message_id=message.id,
+            await get_bot().send_message(
+                chat_id=message.chat_id,
+                reply_to_message_id=message.message_id,
                 text=text,
             )
             return
         except IsAlreadyExplained:
             text = "Looks like this meme was already explained."
-            await Bot(token=get_token()).send_message(
-                chat_id=message.chat.id,
-                reply_to_message_id=message.id,
+            await get_bot().send_message(
+                chat_id=message.chat_id,
+                reply_to_message_id=message.message_id,
                 text=text,
             )
             return
+        except NoPhoto:
+            await get_bot().send_message(
+                chat_id=message.chat_id,
+                reply_to_message_id=message.message_id,
+                text="Can comment just photos for yet, no photo found.",
+            )
+            return
         part_translate = (
             "\n\n" "### Перевод:" "\n" f"{meme_info.ru_translation}"
             if meme_info.lang.upper() != "RU"
@@ -273,26 +420,13 @@ class ExplainSubscriber:
             f"{meme_info.score}/10"
         )
         logger.info(repr(meme_info))
-        logger.info("Going to send to %d", message.chat.id)
-        await Bot(token=get_token()).send_message(
-            chat_id=message.chat.id, reply_to_message_id=message.id, text=explanation
+        logger.info("Going to send to %d", message.chat_id)
+        await get_bot().send_message(
+            chat_id=message.chat_id,
+            reply_to_message_id=message.message_id,
+            text=explanation,
         )
 
-    def pull_message(self, pubsub_msg: PubSubMessage) -> None:
-        try:
-            logger.info("Fetching explain message")
-            data = json.loads(pubsub_msg.data.decode("utf-8"))
-            message = Message.de_json(data=data, bot=None)
-            asyncio.run_coroutine_threadsafe(
-                coro=self.explain(message),
-                loop=self.__loop,
-            )
-            pubsub_msg.ack()
-        except Exception as exc:
-            tb = traceback.format_exc()
-            logger.error("%s\n%s", str(exc), tb)
-            pubsub_msg.nack()
-
 
 def get_explainer(loop: asyncio.AbstractEventLoop) -> ExplainSubscriber:
     vertexai.init()
@@ -302,4 +436,6 @@ def get_explainer(loop: asyncio.AbstractEventLoop) -> ExplainSubscriber:
         max_tokens=32567,
     )
     dspy.configure(lm=lm, adapter=dspy.JSONAdapter())
+    # a broken program file fails the start, not the first explain
+    get_program()
     return ExplainSubscriber(loop=loop)
@@ -0,0 +1,146 @@
+import asyncio
+import mmap
+import os
+from collections import OrderedDict
+from collections.abc import AsyncGenerator
+from contextlib import asynccontextmanager
+from functools import cache
+from logging import getLogger
+
+from telegram import File
+
+from memebot.bot import get_bot
+from memebot.cache import LRUCache
+from memebot.config import FileCacheConfig, get_file_cache_config
+from memebot.metrics import get_metrics
+
+logger = getLogger(__name__)
+
+FileData = bytearray | mmap.mmap
+
+
+class FileCache:
+    """Telegram files on local disk, named by their file_unique_id.
+
+    The same photo is downloaded by RepostCensor, by every explain of the
+    meme and by redelivered messages. Cached files are memory-mapped, so a
+    hit costs no download and no copy. Files are evicted least recently
+    used first once they take more than max_bytes, the order survives a
+    restart through the files' mtime.
+
+    get_file results are cached for path_ttl, a download of a file that
+    isn't on disk skips the getFile call as well."""
+
+    def __init__(self, config: FileCacheConfig) -> None:
+        self.config = config
+        self.__files: OrderedDict[str, int] = OrderedDict()
+        self.__size = 0
+        self.__loaded = False
+        self.__paths: LRUCache[str, File] = LRUCache(
+            max_size=1_000, ttl=config.path_ttl
+        )
+        self.__downloads: dict[str, asyncio.Task[bytearray]] = {}
+
+    def __len__(self) -> int:
+        return len(self.__files)
+
+    @property
+    def size(self) -> int:
+        return self.__size
+
+    def path(self, file_unique_id: str) -> str:
+        return os.path.join(self.config.directory, file_unique_id)
+
+    def __load(self) -> None:
+        if self.__loaded:
+            return
+        os.makedirs(self.config.directory, exist_ok=True)
+        entries = [
+            entry
+            for entry in os.scandir(self.config.directory)
+            if entry.is_file() and not entry.name.endswith(".tmp")
+        ]
+        for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+            self.__files[entry.name] = entry.stat().st_size
+            self.__size += entry.stat().st_size
+        self.__loaded = True
+        self.__evict()
+        logger.info(
+            "FileCache loaded %d files [%d bytes]", len(self.__files), self.__size
+        )
+
+    def __evict(self) -> None:
+        while self.__size > self.config.max_bytes and self.__files:
+            file_unique_id, size = self.__files.popitem(last=False)
+            self.__size -= size
+            try:
+                os.remove(self.path(file_unique_id))
+            except FileNotFoundError:
+                ...
+            get_metrics().counter("files.evictions").inc()
+
+    def __write(self, file_unique_id: str, data: bytearray) -> None:
+        tmp_path = f"{self.path(file_unique_id)}.tmp"
+        with open(tmp_path, "wb") as fd:
+            fd.write(data)
+        os.replace(tmp_path, self.path(file_unique_id))
+
+    def __map(self, file_unique_id: str) -> mmap.mmap | None:
+        try:
+            with open(self.path(file_unique_id), "rb") as fd:
+                os.utime(fd.fileno())
+                return mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            # removed behind our back or empty
+            self.__size -= self.__files.pop(file_unique_id, 0)
+            return None
+
+    async def get_file(self, file_id: str) -> File:
+        if (hfile := self.__paths.get(file_id)) is not None:
+            get_metrics().counter("files.paths.hits").inc()
+            return hfile
+        hfile = await get_bot().get_file(file_id)
+        self.__paths.put(file_id, hfile)
+        return hfile
+
+    async def __download(self, file_id: str, file_unique_id: str) -> bytearray:
+        hfile = await self.get_file(file_id)
+        data = await hfile.download_as_bytearray()
+        get_metrics().counter("files.bytes_downloaded").inc(len(data))
+        if 0 < len(data) <= self.config.max_bytes:
+            await asyncio.to_thread(self.__write, file_unique_id, data)
+            self.__files[file_unique_id] = len(data)
+            self.__size += len(data)
+            self.__evict()
+        return data
+
+    @asynccontextmanager
+    async def open(self, file_id: str, file_unique_id: str) -> AsyncGenerator[FileData]:
+        """Contents of the file, memory-mapped if it is cached. The map is
+        closed on exit, don't keep references to it."""
+        self.__load()
+        metrics = get_metrics()
+        if (
+            file_unique_id in self.__files
+            and (data := self.__map(file_unique_id)) is not None
+        ):
+            self.__files.move_to_end(file_unique_id)
+            metrics.counter("files.hits").inc()
+            metrics.counter("files.bytes_saved").inc(len(data))
+            try:
+                yield data
+            finally:
+                data.close()
+            return
+        metrics.counter("files.misses").inc()
+        # concurrent requests of the same file share the download
+        if (task := self.__downloads.get(file_unique_id)) is None:
+            task = asyncio.create_task(self.__download(file_id, file_unique_id))
+            self.__downloads[file_unique_id] = task
+            task.add_done_callback(lambda _: self.__downloads.pop(file_unique_id, None))
+        yield await asyncio.shield(task)
+
+
+@cache
+def get_file_cache() -> FileCache:
+    return FileCache(config=get_file_cache_config())
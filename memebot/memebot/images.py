@@ -0,0 +1,57 @@
+import math
+import mmap
+from collections.abc import Sequence
+from io import BytesIO
+
+from PIL import Image
+
+from memebot.config import ImageConfig
+from memebot.payload import PhotoRef
+
+# quality isn't lowered further, the picture is downscaled instead
+MIN_QUALITY = 40
+MIN_SIDE = 64
+
+
+def select_photo(photos: Sequence[PhotoRef], max_pixels: int) -> PhotoRef:
+    """The largest photo size within the pixel budget, the smallest otherwise."""
+    fitting = [photo for photo in photos if photo.width * photo.height <= max_pixels]
+    if fitting:
+        return max(fitting, key=lambda photo: photo.width * photo.height)
+    return min(photos, key=lambda photo: photo.width * photo.height)
+
+
+def target_size(size: tuple[int, int], config: ImageConfig) -> tuple[int, int]:
+    width, height = size
+    scale = min(
+        1.0,
+        config.max_side / max(width, height),
+        math.sqrt(config.max_pixels / (width * height)),
+    )
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def preprocess(data: bytes | bytearray | mmap.mmap, config: ImageConfig) -> bytes:
+    """Decodes, downscales to the budget and re-encodes a photo as JPEG
+    of at most max_bytes. CPU bound, meant to run in a thread."""
+    with Image.open(BytesIO(data)) as image:
+        size = target_size(image.size, config)
+        # JPEG is decoded at 1/2, 1/4 or 1/8 scale right away, the full
+        # resolution bitmap is never allocated
+        image.draft("RGB", size)
+        rgb = image.convert("RGB")
+    if rgb.size != size:
+        rgb = rgb.resize(size, Image.Resampling.LANCZOS)
+    quality = config.quality
+    while True:
+        buffer = BytesIO()
+        rgb.save(buffer, format="JPEG", quality=quality, optimize=True)
+        if buffer.tell() <= config.max_bytes or max(rgb.size) <= MIN_SIDE:
+            return buffer.getvalue()
+        if quality > MIN_QUALITY:
+            quality = max(MIN_QUALITY, quality - 15)
+        else:
+            rgb = rgb.resize(
+                (max(1, rgb.width * 3 // 4), max(1, rgb.height * 3 // 4)),
+                Image.Resampling.LANCZOS,
+            )
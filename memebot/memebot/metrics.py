@@ -0,0 +1,110 @@
+import threading
+import time
+from collections.abc import Generator
+from contextlib import contextmanager
+from functools import cache
+from typing import TypeVar
+
+
+class Counter:
+
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        with self.__lock:
+            self.value += amount
+
+    def snapshot(self) -> int:
+        return self.value
+
+
+class Gauge:
+
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self.__lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.inc(-amount)
+
+    def snapshot(self) -> float:
+        return self.value
+
+
+class Histogram:
+    """Keeps count, sum and max of observed values, enough to get averages
+    and spot outliers without storing the samples."""
+
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        with self.__lock:
+            self.count += 1
+            self.total += value
+            self.max = max(self.max, value)
+
+    @contextmanager
+    def time(self) -> Generator[None, None, None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def snapshot(self) -> dict[str, float]:
+        return {
+            "count": self.count,
+            "avg": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+        }
+
+
+MetricT = TypeVar("MetricT", Counter, Gauge, Histogram)
+
+
+class Metrics:
+    """In-process metrics registry, metrics are created on first use."""
+
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.__metrics: dict[str, Counter | Gauge | Histogram] = {}
+
+    def __get(self, name: str, cls: type[MetricT]) -> MetricT:
+        with self.__lock:
+            if (metric := self.__metrics.get(name)) is None:
+                metric = self.__metrics[name] = cls()
+        if not isinstance(metric, cls):
+            raise TypeError(f"Metric {name} is {type(metric).__name__}")
+        return metric
+
+    def counter(self, name: str) -> Counter:
+        return self.__get(name, Counter)
+
+    def gauge(self, name: str) -> Gauge:
+        return self.__get(name, Gauge)
+
+    def histogram(self, name: str) -> Histogram:
+        return self.__get(name, Histogram)
+
+    def snapshot(self) -> dict[str, int | float | dict[str, float]]:
+        with self.__lock:
+            metrics = dict(self.__metrics)
+        return {name: metric.snapshot() for name, metric in sorted(metrics.items())}
+
+
+@cache
+def get_metrics() -> Metrics:
+    return Metrics()
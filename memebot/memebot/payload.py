@@ -0,0 +1,109 @@
+import json
+from collections.abc import Mapping
+from dataclasses import dataclass
+from typing import Any, Self
+
+import msgpack
+from telegram import Message
+
+# Pub/Sub attribute marking the payload format,
+# messages without it carry the full Message.to_json()
+SCHEMA_ATTRIBUTE = "schema"
+SCHEMA = "meme/1"
+VERSION = 1
+
+
+@dataclass(frozen=True, slots=True)
+class PhotoRef:
+    file_id: str
+    file_unique_id: str
+    width: int
+    height: int
+    file_size: int | None = None
+
+
+@dataclass(frozen=True, slots=True)
+class MemePayload:
+    """Part of a telegram Message the censors and the explainer rely on.
+
+    Published to Pub/Sub as a msgpack array instead of the whole
+    Message.to_json(), field order is the wire format, so new fields
+    are appended and VERSION is bumped on incompatible changes."""
+
+    message_id: int
+    chat_id: int
+    user_id: int | None = None
+    caption: str | None = None
+    photo: tuple[PhotoRef, ...] = ()
+    reply_to_message: "MemePayload | None" = None
+
+    @classmethod
+    def from_message(cls, message: Message) -> Self:
+        return cls(
+            message_id=message.message_id,
+            chat_id=message.chat.id,
+            user_id=message.from_user.id if message.from_user else None,
+            caption=message.caption,
+            photo=tuple(
+                PhotoRef(
+                    file_id=photo.file_id,
+                    file_unique_id=photo.file_unique_id,
+                    width=photo.width,
+                    height=photo.height,
+                    file_size=photo.file_size,
+                )
+                for photo in message.photo
+            ),
+            reply_to_message=(
+                cls.from_message(message.reply_to_message)
+                if message.reply_to_message
+                else None
+            ),
+        )
+
+    def __pack(self) -> list[Any]:
+        return [
+            self.message_id,
+            self.chat_id,
+            self.user_id,
+            self.caption,
+            [
+                [p.file_id, p.file_unique_id, p.width, p.height, p.file_size]
+                for p in self.photo
+            ],
+            self.reply_to_message.__pack() if self.reply_to_message else None,
+        ]
+
+    @classmethod
+    def __unpack(cls, fields: list[Any]) -> Self:
+        # fields appended by a newer publisher are ignored
+        message_id, chat_id, user_id, caption, photo, reply_to_message, *_ = fields
+        return cls(
+            message_id=message_id,
+            chat_id=chat_id,
+            user_id=user_id,
+            caption=caption,
+            photo=tuple(PhotoRef(*p) for p in photo),
+            reply_to_message=(
+                cls.__unpack(reply_to_message) if reply_to_message else None
+            ),
+        )
+
+    def encode(self) -> bytes:
+        data: bytes = msgpack.packb([VERSION, self.__pack()])
+        return data
+
+    @classmethod
+    def decode(cls, data: bytes) -> Self:
+        version, fields = msgpack.unpackb(data)
+        if version != VERSION:
+            raise ValueError(f"Unsupported payload version {version}")
+        return cls.__unpack(fields)
+
+    @classmethod
+    def from_pubsub(cls, data: bytes, attributes: Mapping[str, str]) -> Self:
+        if attributes.get(SCHEMA_ATTRIBUTE) == SCHEMA:
+            return cls.decode(data)
+        # published before the compact payload was introduced
+        message = Message.de_json(data=json.loads(data.decode("utf-8")), bot=None)
+        return cls.from_message(message)
@@ -0,0 +1,50 @@
+import threading
+
+import numpy as np
+from PIL import Image
+
+HASH_SIZE = 8
+
+
+def dhash(image: Image.Image) -> int:
+    """64-bit difference hash: whether each pixel of a 9x8 grayscale
+    thumbnail is brighter than its right neighbour."""
+    thumbnail = image.convert("L").resize(
+        (HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS
+    )
+    pixels = np.asarray(thumbnail, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+class HashIndex:
+    """Ring buffer of the most recent hashes, searched by Hamming distance.
+
+    A linear scan of a uint64 array is vectorized, 100k hashes take well
+    under a millisecond, so there is no need for a BK-tree."""
+
+    def __init__(self, capacity: int) -> None:
+        self.__hashes = np.zeros(capacity, dtype=np.uint64)
+        self.__size = 0
+        self.__next = 0
+        self.__lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.__size
+
+    def add(self, value: int) -> None:
+        with self.__lock:
+            self.__hashes[self.__next] = value
+            self.__next = (self.__next + 1) % len(self.__hashes)
+            self.__size = min(self.__size + 1, len(self.__hashes))
+
+    def distance(self, value: int) -> int | None:
+        """Distance to the nearest hash, None if the index is empty."""
+        # the listener thread adds concurrently, the scan is short enough
+        # to hold the lock
+        with self.__lock:
+            if not self.__size:
+                return None
+            hashes = self.__hashes[: self.__size]
+            distances = np.bitwise_count(np.bitwise_xor(hashes, np.uint64(value)))
+            return int(distances.min())
@@ -0,0 +1,99 @@
+import asyncio
+import os
+import traceback
+from collections import defaultdict
+from collections.abc import Sequence
+from logging import getLogger
+
+from telegram import Bot, Message, Update
+from telegram.error import TelegramError
+
+from memebot.commands import build_command, handled_update_kinds
+from memebot.config import PollingConfig
+from memebot.metrics import get_metrics
+from memebot.ratelimit import get_rate_limiter
+
+logger = getLogger(__name__)
+
+
+class Poller:
+    """getUpdates long-poll loop, an alternative to the webhook entry point.
+
+    Updates of a batch are dispatched concurrently, messages of the same chat
+    are kept in order. The offset is checkpointed after every batch, so a
+    restart doesn't replay handled updates."""
+
+    retry_delay: float = 5.0
+
+    def __init__(self, config: PollingConfig, bot: Bot) -> None:
+        self.config = config
+        self.bot = bot
+        self.offset = self.__load_offset()
+        self.__semaphore = asyncio.Semaphore(config.concurrency)
+
+    def __load_offset(self) -> int | None:
+        if not self.config.offset_path:
+            return None
+        try:
+            with open(self.config.offset_path, encoding="utf-8") as fd:
+                return int(fd.read().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def __save_offset(self) -> None:
+        if not self.config.offset_path or self.offset is None:
+            return
+        tmp_path = f"{self.config.offset_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fd:
+            fd.write(str(self.offset))
+        # a crash while writing mustn't corrupt the checkpoint
+        os.replace(tmp_path, self.config.offset_path)
+
+    async def __handle(self, message: Message) -> None:
+        if not get_rate_limiter().admit(message):
+            return
+        async with self.__semaphore:
+            try:
+                await build_command(message).run()
+            except Exception as exc:
+                tb = traceback.format_exc()
+                logger.error("%s\n%s", str(exc), tb)
+
+    async def __handle_chat(self, messages: list[Message]) -> None:
+        for message in messages:
+            await self.__handle(message)
+
+    async def dispatch(self, updates: Sequence[Update]) -> None:
+        chats: defaultdict[int, list[Message]] = defaultdict(list)
+        for update in updates:
+            if message := update.message:
+                chats[message.chat.id].append(message)
+        await asyncio.gather(*(self.__handle_chat(chat) for chat in chats.values()))
+
+    async def poll_once(self) -> int:
+        updates = await self.bot.get_updates(
+            offset=self.offset,
+            limit=self.config.limit,
+            timeout=self.config.timeout,
+            allowed_updates=handled_update_kinds(),
+        )
+        if not updates:
+            return 0
+        metrics = get_metrics()
+        metrics.counter("polling.updates").inc(len(updates))
+        with metrics.histogram("polling.batch").time():
+            await self.dispatch(updates)
+        # the next getUpdates call with this offset confirms the batch
+        self.offset = max(update.update_id for update in updates) + 1
+        self.__save_offset()
+        return len(updates)
+
+    async def run(self) -> None:
+        logger.info("Polling updates from offset %s", self.offset)
+        while True:
+            try:
+                await self.poll_once()
+            except TelegramError as exc:
+                logger.warning("getUpdates failed: %s", str(exc))
+                get_metrics().counter("polling.errors").inc()
+                await asyncio.sleep(self.retry_delay)
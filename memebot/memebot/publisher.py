@@ -0,0 +1,52 @@
+import asyncio
+from functools import cache, cached_property
+from logging import getLogger
+from typing import TYPE_CHECKING
+
+from memebot.config import PublisherConfig, get_publisher_config
+from memebot.metrics import get_metrics
+
+if TYPE_CHECKING:
+    # grpc based client is heavy, it's imported on the first publish
+    from google.cloud.pubsub_v1 import PublisherClient
+
+logger = getLogger(__name__)
+
+
+class Publisher:
+    """Process-wide Pub/Sub publisher.
+
+    A single client keeps one gRPC channel and batches messages published
+    within max_latency, publish futures are awaited without blocking the loop."""
+
+    def __init__(self, config: PublisherConfig) -> None:
+        self.config = config
+
+    @cached_property
+    def client(self) -> "PublisherClient":
+        from google.cloud.pubsub_v1 import PublisherClient
+        from google.cloud.pubsub_v1.types import BatchSettings
+
+        return PublisherClient(
+            batch_settings=BatchSettings(
+                max_bytes=self.config.max_bytes,
+                max_latency=self.config.max_latency.total_seconds(),
+                max_messages=self.config.max_messages,
+            )
+        )
+
+    async def publish(self, topic: str, data: bytes, **attrs: str) -> str:
+        with get_metrics().histogram("pubsub.publish").time():
+            publish_future = self.client.publish(topic=topic, data=data, **attrs)
+            message_id: str = await asyncio.wrap_future(publish_future)
+        return message_id
+
+    def close(self) -> None:
+        # sends pending batches
+        if "client" in self.__dict__:
+            self.client.stop()
+
+
+@cache
+def get_publisher() -> Publisher:
+    return Publisher(config=get_publisher_config())
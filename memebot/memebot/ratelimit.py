@@ -0,0 +1,92 @@
+import time
+from collections import OrderedDict
+from functools import cache
+from logging import getLogger
+
+from telegram import Message
+
+from memebot.config import ADMINS, RateLimitConfig, get_ratelimit_config
+from memebot.metrics import get_metrics
+
+logger = getLogger(__name__)
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated_at")
+
+    def __init__(self, rate: float, capacity: float, now: float) -> None:
+        # tokens per second
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = now
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+
+class RateLimiter:
+    """Per-user and per-chat token buckets checked before a command is built,
+    excess updates are shed before any Pub/Sub or Firestore call.
+
+    Buckets are in-process, with several instances every one admits
+    1/n_instances of the configured rate instead of syncing the state."""
+
+    def __init__(self, config: RateLimitConfig) -> None:
+        self.config = config
+        self.__buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+
+    def __bucket(
+        self, key: str, per_minute: float, burst: int, now: float
+    ) -> TokenBucket:
+        if (bucket := self.__buckets.get(key)) is None:
+            share = max(self.config.n_instances, 1)
+            bucket = self.__buckets[key] = TokenBucket(
+                rate=per_minute / 60 / share,
+                capacity=max(burst / share, 1),
+                now=now,
+            )
+        else:
+            bucket.refill(now)
+        self.__buckets.move_to_end(key)
+        while len(self.__buckets) > self.config.max_keys:
+            # the evicted bucket is full anyway if it's not used for a while
+            self.__buckets.popitem(last=False)
+        return bucket
+
+    def admit(self, message: Message) -> bool:
+        if message.from_user is not None and message.from_user.id in ADMINS:
+            return True
+        now = time.monotonic()
+        buckets = {
+            "chat": self.__bucket(
+                f"chat:{message.chat.id}",
+                self.config.chat_rate,
+                self.config.chat_burst,
+                now,
+            )
+        }
+        if message.from_user is not None:
+            buckets["user"] = self.__bucket(
+                f"user:{message.from_user.id}",
+                self.config.user_rate,
+                self.config.user_burst,
+                now,
+            )
+        # a token is taken only if every bucket has one
+        for kind, bucket in buckets.items():
+            if bucket.tokens < 1:
+                get_metrics().counter(f"ratelimit.shed.{kind}").inc()
+                logger.info("Rate limited [chat: %s] [%s]", str(message.chat.id), kind)
+                return False
+        for bucket in buckets.values():
+            bucket.tokens -= 1
+        return True
+
+
+@cache
+def get_rate_limiter() -> RateLimiter:
+    return RateLimiter(config=get_ratelimit_config())
@@ -12,8 +12,6 @@ from memebot.config import get_search_api_key, get_search_cx_key
 class GoogleSearch:
 
     def __init__(self, **kwargs: Any) -> None:
-        self.__search_api_key = get_search_api_key()
-        self.__search_cx_key = get_search_cx_key()
         self.__base_url = "https://www.googleapis.com/customsearch/v1"
         self.k: int = kwargs.get("k", 3)
         timeout: timedelta = kwargs.get("timeout", timedelta(seconds=30))
@@ -24,8 +22,9 @@ class GoogleSearch:
     ) -> list[Coroutine[Any, Any, httpx.Response]]:
         params = dict(
             q=query,
-            cx=self.__search_cx_key,
-            key=self.__search_api_key,
+            # read on every call, the keys may be rotated
+            cx=get_search_cx_key(),
+            key=get_search_api_key(),
         )
         try:
             response = await client.get(url=self.__base_url, params=params)
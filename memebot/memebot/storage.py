@@ -0,0 +1,150 @@
+import asyncio
+from collections.abc import AsyncGenerator, Generator
+from contextlib import asynccontextmanager, contextmanager
+from functools import cache
+from logging import getLogger
+from typing import TYPE_CHECKING
+
+from memebot.config import FirestoreConfig, get_firestore_config
+from memebot.metrics import get_metrics
+
+if TYPE_CHECKING:
+    from google.cloud import firestore
+
+logger = getLogger(__name__)
+
+
+class FirestorePool:
+    """Firestore clients shared by the censors, the explainer and dedup.
+
+    Sessions take the clients round-robin. A client whose call fails with a
+    transport error or runs out of the deadline is dropped, its slot
+    reconnects on the next use instead of failing until a restart."""
+
+    # read by health checks, the document doesn't have to exist
+    health_collection = "health"
+
+    def __init__(self, config: FirestoreConfig) -> None:
+        self.config = config
+        self.__clients: list["firestore.AsyncClient | None"] = [None] * config.pool_size
+        self.__next = 0
+        self.__closing: set[asyncio.Task[None]] = set()
+        self.__listener: "firestore.Client | None" = None
+        self.__listeners = 0
+
+    def connect(self) -> "firestore.AsyncClient":
+        from google.cloud import firestore
+
+        return firestore.AsyncClient()
+
+    def connect_listener(self) -> "firestore.Client":
+        from google.cloud import firestore
+
+        return firestore.Client()
+
+    @contextmanager
+    def listener(self) -> Generator["firestore.Client"]:
+        """The synchronous client for snapshot listeners and the reads that
+        seed them, the async client doesn't support on_snapshot.
+
+        It isn't one of the pooled clients: a listener keeps its stream open
+        for the life of the process and reconnects it itself, it can't be
+        bound by the session deadline or dropped by a health check. The
+        client is shared by the listeners and closed when the last exits."""
+        if self.__listener is None:
+            self.__listener = self.connect_listener()
+            get_metrics().counter("firestore.connects").inc()
+        self.__listeners += 1
+        try:
+            yield self.__listener
+        finally:
+            self.__listeners -= 1
+            if not self.__listeners:
+                client, self.__listener = self.__listener, None
+                try:
+                    client.close()
+                    # Client.close() leaves the gRPC channel open as well
+                    if (transport := getattr(client, "_transport", None)) is not None:
+                        transport.close()
+                except Exception as exc:  # noqa: BLE001
+                    logger.warning("Could not close Firestore listener: %s", exc)
+
+    def __acquire(self) -> tuple[int, "firestore.AsyncClient"]:
+        slot = self.__next
+        self.__next = (slot + 1) % len(self.__clients)
+        if (client := self.__clients[slot]) is None:
+            client = self.__clients[slot] = self.connect()
+            get_metrics().counter("firestore.connects").inc()
+        return slot, client
+
+    def __drop(self, slot: int, client: "firestore.AsyncClient") -> None:
+        # a concurrent session may have dropped it already
+        if self.__clients[slot] is client:
+            self.__clients[slot] = None
+            get_metrics().counter("firestore.drops").inc()
+            task = asyncio.create_task(self.__close(client))
+            self.__closing.add(task)
+            task.add_done_callback(self.__closing.discard)
+
+    async def __close(self, client: "firestore.AsyncClient") -> None:
+        # sessions still holding the client run out of their deadline first
+        await asyncio.sleep(self.config.deadline.total_seconds())
+        try:
+            client.close()
+            # AsyncClient.close() leaves the gRPC channel open
+            if (transport := getattr(client, "_transport", None)) is not None:
+                await transport.close()
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Could not close Firestore client: %s", exc)
+
+    @asynccontextmanager
+    async def session(self) -> AsyncGenerator["firestore.AsyncClient"]:
+        from google.api_core.exceptions import (
+            DeadlineExceeded,
+            InternalServerError,
+            ServiceUnavailable,
+            Unknown,
+        )
+
+        slot, client = self.__acquire()
+        metrics = get_metrics()
+        metrics.gauge("firestore.sessions").inc()
+        try:
+            with metrics.histogram("firestore.session").time():
+                async with asyncio.timeout(self.config.deadline.total_seconds()):
+                    yield client
+        except (
+            TimeoutError,
+            DeadlineExceeded,
+            InternalServerError,
+            ServiceUnavailable,
+            Unknown,
+        ):
+            metrics.counter("firestore.failures").inc()
+            self.__drop(slot, client)
+            raise
+        finally:
+            metrics.gauge("firestore.sessions").inc(-1)
+
+    async def check_health(self) -> None:
+        for slot, client in enumerate(self.__clients):
+            if client is None:
+                continue
+            try:
+                async with asyncio.timeout(self.config.deadline.total_seconds()):
+                    await client.collection(self.health_collection).document(
+                        "ping"
+                    ).get()
+            except Exception as exc:  # noqa: BLE001
+                logger.warning("Firestore client [%d] is unhealthy: %s", slot, exc)
+                self.__drop(slot, client)
+
+    async def health_checks(self) -> None:
+        while True:
+            await asyncio.sleep(self.config.health_check_interval.total_seconds())
+            await self.check_health()
+
+
+@cache
+def get_firestore_pool() -> FirestorePool:
+    return FirestorePool(config=get_firestore_config())
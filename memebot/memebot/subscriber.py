@@ -0,0 +1,206 @@
+import abc
+import asyncio
+import traceback
+from collections.abc import Generator, Sequence
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from logging import getLogger
+
+from google.cloud.pubsub_v1 import SubscriberClient
+from google.cloud.pubsub_v1.subscriber.message import Message as PubSubMessage
+from google.cloud.pubsub_v1.types import FlowControl
+
+from memebot.cache import LRUCache
+from memebot.config import SubscriberConfig, get_subscriber_config
+from memebot.metrics import get_metrics
+from memebot.payload import MemePayload
+
+logger = getLogger(__name__)
+
+
+class Subscriber(abc.ABC):
+    """Pulls a Pub/Sub subscription and handles the messages on the event loop.
+
+    A message is acked once handle() completes and nacked if it fails, so
+    Pub/Sub redelivers it. FlowControl bounds the messages leased by the
+    client, their leases are extended while handle() runs, a semaphore
+    bounds the handlers running on the loop.
+
+    With batch_size > 1 messages pulled within batch_window are collected
+    and passed to handle_batch() together.
+
+    Failures in permanent_errors are acked, a redelivery fails the same way.
+    Other failures are redelivered until the dead-letter policy of the
+    subscription parks the message, without one the failed deliveries are
+    counted here and the message is dropped after max_delivery_attempts."""
+
+    name: str
+    # errors a redelivery can't fix
+    permanent_errors: tuple[type[Exception], ...] = ()
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        subscription: str,
+        config: SubscriberConfig | None = None,
+        batch_size: int = 1,
+        batch_window: timedelta = timedelta(0),
+    ) -> None:
+        self.__loop = loop
+        self.__subscription = subscription
+        self.config = config or get_subscriber_config()
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.__semaphore = asyncio.Semaphore(self.config.max_concurrency)
+        self.__batch: list[tuple[MemePayload, asyncio.Future[None]]] = []
+        self.__batch_timer: asyncio.TimerHandle | None = None
+        self.__batches: set[asyncio.Task[None]] = set()
+        # failed deliveries by message id, when Pub/Sub doesn't count them
+        self.__failures: LRUCache[str, int] = LRUCache(max_size=10_000)
+
+    @abc.abstractmethod
+    async def handle(self, message: MemePayload) -> None: ...
+
+    async def handle_batch(
+        self, messages: Sequence[MemePayload]
+    ) -> list[BaseException | None]:
+        """Handles messages pulled together, returns an error per message."""
+        return await asyncio.gather(
+            *(self.handle(message) for message in messages), return_exceptions=True
+        )
+
+    @contextmanager
+    def subscription(self) -> Generator[None, None, None]:
+        self.__subscriber = SubscriberClient()
+        self.__subscriber_future = self.__subscriber.subscribe(
+            subscription=self.__subscription,
+            callback=self.pull_message,
+            flow_control=FlowControl(
+                max_messages=self.config.max_messages,
+                max_lease_duration=self.config.max_lease_duration.total_seconds(),
+            ),
+        )
+        yield
+        self.__subscriber_future.cancel()
+        try:
+            self.__subscriber_future.result()
+        except Exception:
+            ...
+        self.__subscriber.close()
+
+    def __flush(self) -> None:
+        if self.__batch_timer is not None:
+            self.__batch_timer.cancel()
+            self.__batch_timer = None
+        batch, self.__batch = self.__batch, []
+        task = asyncio.create_task(self.__run_batch(batch))
+        self.__batches.add(task)
+        task.add_done_callback(self.__batches.discard)
+
+    async def __run_batch(
+        self, batch: list[tuple[MemePayload, "asyncio.Future[None]"]]
+    ) -> None:
+        metrics = get_metrics()
+        metrics.histogram(f"subscriber.{self.name}.batch").observe(len(batch))
+        async with self.__semaphore:
+            in_flight = metrics.gauge(f"subscriber.{self.name}.in_flight")
+            in_flight.inc(len(batch))
+            try:
+                with metrics.histogram(f"subscriber.{self.name}.handle").time():
+                    errors = await self.handle_batch([message for message, _ in batch])
+            except Exception as exc:
+                errors = [exc] * len(batch)
+            finally:
+                in_flight.inc(-len(batch))
+        for (_, future), error in zip(batch, errors):
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+
+    async def __batched(self, message: MemePayload) -> None:
+        future = self.__loop.create_future()
+        self.__batch.append((message, future))
+        if len(self.__batch) >= self.batch_size:
+            self.__flush()
+        elif self.__batch_timer is None:
+            self.__batch_timer = self.__loop.call_later(
+                self.batch_window.total_seconds(), self.__flush
+            )
+        await future
+
+    async def __run(self, message: MemePayload) -> None:
+        metrics = get_metrics()
+        async with self.__semaphore:
+            in_flight = metrics.gauge(f"subscriber.{self.name}.in_flight")
+            in_flight.inc()
+            try:
+                with metrics.histogram(f"subscriber.{self.name}.handle").time():
+                    await self.handle(message)
+            finally:
+                in_flight.inc(-1)
+
+    def __settle(self, pubsub_msg: PubSubMessage, future: "Future[None]") -> None:
+        if future.cancelled():
+            pubsub_msg.nack()
+            return
+        if (exc := future.exception()) is None:
+            pubsub_msg.ack()
+            return
+        metrics = get_metrics()
+        if isinstance(exc, self.permanent_errors):
+            logger.warning(
+                "Dropping message [%s], it can't succeed: %s",
+                pubsub_msg.message_id,
+                exc,
+            )
+            metrics.counter(f"subscriber.{self.name}.dropped").inc()
+            pubsub_msg.ack()
+            return
+        logger.error(
+            "Message [%s] failed [attempt %s]: %s\n%s",
+            pubsub_msg.message_id,
+            pubsub_msg.delivery_attempt,
+            str(exc),
+            "".join(traceback.format_exception(exc)),
+        )
+        metrics.counter(f"subscriber.{self.name}.failures").inc()
+        if pubsub_msg.delivery_attempt is None:
+            failures = (self.__failures.get(pubsub_msg.message_id) or 0) + 1
+            self.__failures.put(pubsub_msg.message_id, failures)
+            if failures >= self.config.max_delivery_attempts:
+                logger.error(
+                    "Dropping message [%s] after %d attempts",
+                    pubsub_msg.message_id,
+                    failures,
+                )
+                metrics.counter(f"subscriber.{self.name}.dropped").inc()
+                pubsub_msg.ack()
+                return
+        pubsub_msg.nack()
+
+    def pull_message(self, pubsub_msg: PubSubMessage) -> None:
+        # runs in a thread of the subscriber client
+        get_metrics().histogram(f"subscriber.{self.name}.lag").observe(
+            (datetime.now(timezone.utc) - pubsub_msg.publish_time).total_seconds()
+        )
+        try:
+            logger.info("Fetching message for %s", self.name)
+            message = MemePayload.from_pubsub(pubsub_msg.data, pubsub_msg.attributes)
+            future = asyncio.run_coroutine_threadsafe(
+                coro=(
+                    self.__batched(message)
+                    if self.batch_size > 1
+                    else self.__run(message)
+                ),
+                loop=self.__loop,
+            )
+        except Exception as exc:
+            tb = traceback.format_exc()
+            logger.error("%s\n%s", str(exc), tb)
+            pubsub_msg.nack()
+            return
+        future.add_done_callback(lambda future: self.__settle(pubsub_msg, future))
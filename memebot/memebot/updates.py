@@ -0,0 +1,24 @@
+from typing import Any
+
+
+def prefilter(data: Any) -> str | None:
+    """Cheap check of a raw update before it's parsed into telegram objects.
+
+    Returns a reason to ignore the update or None if it has to be processed.
+    Mirrors build_command: anything that would end up as IgnoreCommand is
+    dropped here."""
+    if not isinstance(data, dict) or "update_id" not in data:
+        return "invalid update format"
+    if (message := data.get("message")) is None:
+        return "no message"
+    if not isinstance(message, dict):
+        return "invalid update format"
+    if (text := message.get("text")) is None:
+        text = ""
+    if (chat := message.get("chat")) is None:
+        chat = {}
+    if not isinstance(text, str) or not isinstance(chat, dict):
+        return "invalid update format"
+    if not text.startswith("/") and chat.get("type") != "private":
+        return "not a command"
+    return None
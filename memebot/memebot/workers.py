@@ -0,0 +1,93 @@
+import asyncio
+import time
+import traceback
+from collections.abc import AsyncGenerator
+from contextlib import asynccontextmanager
+from functools import cache
+from logging import getLogger
+
+from memebot.commands import CommandInterface
+from memebot.config import WorkerConfig, get_worker_config
+from memebot.metrics import get_metrics
+
+logger = getLogger(__name__)
+
+
+class CommandQueue:
+    """Bounded in-process queue of commands served by a fixed number of workers,
+    so the webhook can acknowledge an update before the command is done."""
+
+    def __init__(self, config: WorkerConfig) -> None:
+        self.config = config
+        self.__queue: asyncio.Queue[tuple[float, CommandInterface]] = asyncio.Queue()
+        self.__workers: list[asyncio.Task[None]] = []
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self.__workers)
+
+    async def __work(self) -> None:
+        metrics = get_metrics()
+        while True:
+            enqueued_at, command = await self.__queue.get()
+            metrics.gauge("commands.queue_depth").set(self.__queue.qsize())
+            metrics.histogram("commands.wait").observe(
+                time.perf_counter() - enqueued_at
+            )
+            try:
+                with metrics.histogram("commands.run").time():
+                    await command.run()
+            except Exception as exc:
+                tb = traceback.format_exc()
+                logger.error("%s\n%s", str(exc), tb)
+            finally:
+                self.__queue.task_done()
+
+    async def dispatch(self, command: CommandInterface) -> bool:
+        """Puts the command to the queue, returns False if it's rejected
+        because the queue is full."""
+        if not self.is_running:
+            await command.run()
+            return True
+        metrics = get_metrics()
+        try:
+            self.__queue.put_nowait((time.perf_counter(), command))
+        except asyncio.QueueFull:
+            if self.config.overflow == "inline":
+                metrics.counter("commands.inline").inc()
+                await command.run()
+                return True
+            metrics.counter("commands.rejected").inc()
+            logger.warning("Command queue is full, rejecting %s", type(command))
+            return False
+        metrics.gauge("commands.queue_depth").set(self.__queue.qsize())
+        return True
+
+    @asynccontextmanager
+    async def running(self) -> AsyncGenerator[None]:
+        # the queue is bound to the running loop, so it's created here
+        self.__queue = asyncio.Queue(maxsize=self.config.queue_size)
+        self.__workers = [
+            asyncio.create_task(self.__work()) for _ in range(self.config.n_workers)
+        ]
+        try:
+            yield
+        finally:
+            if self.__workers:
+                try:
+                    await asyncio.wait_for(
+                        self.__queue.join(), timeout=self.config.drain_timeout
+                    )
+                except TimeoutError:
+                    logger.warning(
+                        "Command queue is not drained, %d left", self.__queue.qsize()
+                    )
+                for worker in self.__workers:
+                    worker.cancel()
+                await asyncio.gather(*self.__workers, return_exceptions=True)
+                self.__workers = []
+
+
+@cache
+def get_command_queue() -> CommandQueue:
+    return CommandQueue(config=get_worker_config())
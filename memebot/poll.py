@@ -0,0 +1,39 @@
+"""Long-polling entry point, runs the bot without the webhook:
+
+$ python poll.py
+"""
+
+import asyncio
+import signal
+
+from memebot.bot import get_bot, get_bot_pool
+from memebot.censor import get_censor
+from memebot.config import get_polling_config, get_secrets_loader
+from memebot.explainer import get_explainer
+from memebot.polling import Poller
+from memebot.storage import get_firestore_pool
+
+
+async def main() -> None:
+    loop = asyncio.get_running_loop()
+    if task := asyncio.current_task():
+        loop.add_signal_handler(signal.SIGTERM, task.cancel)
+    await get_secrets_loader().prefetch()
+    async with get_bot_pool().session():
+        # getUpdates doesn't work while a webhook is set
+        await get_bot().delete_webhook()
+        explainer = get_explainer(loop=loop)
+        censor = get_censor(loop=loop)
+        health_checks = asyncio.create_task(get_firestore_pool().health_checks())
+        try:
+            with explainer.subscription(), censor.subscription():
+                await Poller(config=get_polling_config(), bot=get_bot()).run()
+        finally:
+            health_checks.cancel()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        ...
@@ -18,6 +18,7 @@ from telegram import Chat, Message, PhotoSize
 
 from main import app
 from memebot.config import get_channel_id, get_explainer_config, get_messenger_config
+from memebot.ratelimit import get_rate_limiter
 
 
 @pytest.fixture
@@ -26,6 +27,12 @@ def client() -> Generator[TestClient, None, None]:
     yield client
 
 
+@pytest.fixture(autouse=True)
+def rate_limiter() -> None:
+    # the same test users post in many tests
+    get_rate_limiter.cache_clear()
+
+
 @pytest.fixture
 def message() -> Message:
     """Minimal Telegram-style message structure reused in several tests."""
@@ -1,4 +1,13 @@
-from google.api_core.exceptions import DeadlineExceeded
+from collections.abc import AsyncGenerator
+from typing import Any
+
+from google.api_core.exceptions import (
+    AlreadyExists,
+    DeadlineExceeded,
+    FailedPrecondition,
+    NotFound,
+)
+from google.cloud.firestore import Increment
 from google.cloud.pubsub_v1 import SubscriberClient
 
 
@@ -13,3 +22,115 @@ def clean_subscription(subscription: str) -> None:
             ...
     except DeadlineExceeded:
         ...  # no more messages left
+
+
+class FakeSnapshot:
+
+    def __init__(
+        self, id: str, data: dict[str, Any] | None, update_time: int = 0
+    ) -> None:
+        self.id = id
+        self.exists = data is not None
+        self.update_time = update_time
+        self.__data = data or {}
+
+    def get(self, field: str) -> Any:
+        return self.__data[field]
+
+    def to_dict(self) -> dict[str, Any] | None:
+        return dict(self.__data) if self.exists else None
+
+
+class FakeDocument:
+
+    def __init__(self, db: "FakeFirestore", path: tuple[str, str]) -> None:
+        self.db = db
+        self.path = path
+
+    async def get(self, **kwargs: Any) -> FakeSnapshot:
+        self.db.reads += 1
+        return FakeSnapshot(
+            self.path[1],
+            self.db.docs.get(self.path),
+            update_time=self.db.versions.get(self.path, 0),
+        )
+
+    async def set(self, data: dict[str, Any], merge: bool = False) -> None:
+        self.db.write(self.path, data, merge=merge)
+
+    async def create(self, data: dict[str, Any]) -> None:
+        if self.path in self.db.docs:
+            raise AlreadyExists(f"{self.path} exists")
+        self.db.write(self.path, data)
+
+    async def update(self, data: dict[str, Any], option: Any = None) -> None:
+        if self.path not in self.db.docs:
+            raise NotFound(f"{self.path} doesn't exist")
+        if option is not None and option != self.db.versions.get(self.path, 0):
+            raise FailedPrecondition(f"{self.path} was updated")
+        self.db.write(self.path, data, merge=True)
+
+    async def delete(self) -> None:
+        self.db.docs.pop(self.path, None)
+
+
+class FakeCollection:
+
+    def __init__(self, db: "FakeFirestore", name: str) -> None:
+        self.db = db
+        self.name = name
+
+    def document(self, document_id: str) -> FakeDocument:
+        return FakeDocument(self.db, (self.name, document_id))
+
+
+class FakeBatch:
+
+    def __init__(self, db: "FakeFirestore") -> None:
+        self.db = db
+        self.writes: list[tuple[FakeDocument, dict[str, Any], bool]] = []
+
+    def set(
+        self, document: FakeDocument, data: dict[str, Any], merge: bool = False
+    ) -> None:
+        self.writes.append((document, data, merge))
+
+    async def commit(self) -> None:
+        for document, data, merge in self.writes:
+            self.db.write(document.path, data, merge=merge)
+
+
+class FakeFirestore:
+    """Documents in a dict, enough of AsyncClient for direct lookups."""
+
+    def __init__(self) -> None:
+        self.docs: dict[tuple[str, str], dict[str, Any]] = {}
+        # update_time of the documents, a counter of their writes
+        self.versions: dict[tuple[str, str], int] = {}
+        self.reads = 0
+
+    def collection(self, name: str) -> FakeCollection:
+        return FakeCollection(self, name)
+
+    def batch(self) -> FakeBatch:
+        return FakeBatch(self)
+
+    def write_option(self, last_update_time: int) -> int:
+        return last_update_time
+
+    async def get_all(
+        self, documents: list[FakeDocument]
+    ) -> AsyncGenerator[FakeSnapshot, None]:
+        for document in documents:
+            yield await document.get()
+
+    def write(
+        self, path: tuple[str, str], data: dict[str, Any], merge: bool = False
+    ) -> None:
+        current = self.docs.get(path, {}) if merge else {}
+        for field, value in data.items():
+            if isinstance(value, Increment):
+                value = current.get(field, 0) + value._value
+            current[field] = value
+        self.docs[path] = current
+        self.versions[path] = self.versions.get(path, 0) + 1
@@ -0,0 +1,42 @@
+import pytest
+from pytest_mock import MockerFixture
+from telegram.request import HTTPXRequest
+
+from memebot.bot import BotPool, get_bot, get_bot_pool
+from memebot.config import BotConfig
+
+
+class TestBotPool:
+
+    def test_bot_is_shared(self) -> None:
+        assert get_bot() is get_bot()
+        assert get_bot() is get_bot_pool().bot
+
+    @pytest.mark.asyncio
+    async def test_session(self, mocker: MockerFixture) -> None:
+        initialize = mocker.patch.object(HTTPXRequest, "initialize")
+        shutdown = mocker.patch.object(HTTPXRequest, "shutdown")
+        pool = BotPool(
+            config=BotConfig(
+                pool_size=2,
+                pool_timeout=1.0,
+                keepalive_expiry=5.0,
+                base_url="http://localhost:8081/bot",
+                base_file_url="http://localhost:8081/file/bot",
+            )
+        )
+        async with pool.session() as bot:
+            assert bot is pool.bot
+            # regular requests and getUpdates
+            assert initialize.call_count == 2
+            assert shutdown.call_count == 0
+        assert shutdown.call_count == 2
+
+    def test_token_rotation(self, mocker: MockerFixture) -> None:
+        get_token = mocker.patch("memebot.bot.get_token", return_value="old")
+        pool = get_bot_pool()
+        bot = pool.bot
+        assert pool.bot is bot
+        get_token.return_value = "new"
+        assert pool.bot is not bot
+        assert pool.bot.token == "new"
@@ -0,0 +1,617 @@
+import asyncio
+from collections.abc import AsyncGenerator, Generator
+from datetime import datetime, timedelta, timezone
+from typing import Any
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+import pytest_asyncio
+from google.api_core.exceptions import ServiceUnavailable
+from google.cloud.firestore_v1.watch import ChangeType
+from pytest_mock import MockerFixture
+from telegram.error import TimedOut
+
+from memebot.censor import (
+    AbstractCensor,
+    Allowlist,
+    CensorResult,
+    CensorSubscriber,
+    CombinedCensor,
+    ForwardInProgress,
+    ForwardState,
+    NewUserCensor,
+    Post,
+    PostWindow,
+    RepostCensor,
+    Stage,
+    TimeCensor,
+    get_allowlist,
+)
+from memebot.explainer import IsAlreadyExplained, TooManyExplains
+from memebot.payload import MemePayload, PhotoRef
+from memebot.storage import FirestorePool, get_firestore_pool
+from tests.helpers import FakeFirestore
+
+
+def make_payload(user_id: int = 666, message_id: int = 1) -> MemePayload:
+    return MemePayload(message_id=message_id, chat_id=111, user_id=user_id)
+
+
+class FakePosts:
+    """posts/{uid} document and the legacy minute buckets behind a mocked db."""
+
+    def __init__(self, buckets: list[dict[str, Any]] | None = None) -> None:
+        self.data: dict[str, Any] | None = None
+        self.db = MagicMock()
+        self.doc_ref = self.db.collection.return_value.document.return_value
+        self.doc_ref.get = AsyncMock(side_effect=self.snapshot)
+        self.buckets = buckets or []
+        self.transaction = self.db.transaction.return_value
+        self.transaction.get = AsyncMock(side_effect=self.stream)
+        self.transaction.set.side_effect = self.set
+
+    async def stream(self, query: Any) -> AsyncGenerator[MagicMock, None]:
+        async def docs() -> AsyncGenerator[MagicMock, None]:
+            for bucket in self.buckets:
+                yield MagicMock(to_dict=MagicMock(return_value=bucket))
+
+        return docs()
+
+    def snapshot(self, transaction: Any = None) -> MagicMock:
+        snapshot = MagicMock(exists=self.data is not None)
+        snapshot.get.side_effect = lambda field: (self.data or {})[field]
+        return snapshot
+
+    def set(self, doc_ref: Any, data: dict[str, Any]) -> None:
+        self.data = data
+
+
+@pytest.fixture
+def transactional(mocker: MockerFixture) -> None:
+    mocker.patch("memebot.censor.firestore.async_transactional", lambda func: func)
+
+
+@pytest.fixture
+def connect(mocker: MockerFixture) -> MagicMock:
+    get_firestore_pool.cache_clear()
+    return mocker.patch.object(FirestorePool, "connect")
+
+
+class TestPostWindow:
+
+    def test_ring(self) -> None:
+        dt = datetime(2025, 1, 1, 12, 0, tzinfo=timezone.utc)
+        window = PostWindow([Post(ts=dt), Post(ts=dt - timedelta(hours=1))], size=2)
+        window.add(Post(ts=dt + timedelta(hours=1)))
+        assert [post.ts for post in window.posts] == [dt, dt + timedelta(hours=1)]
+
+    def test_expired_dropped(self) -> None:
+        dt = datetime(2025, 1, 1, 12, 0, tzinfo=timezone.utc)
+        window = PostWindow([Post(ts=dt), Post(ts=dt - timedelta(hours=25))], size=2)
+        assert window.recent(dt - timedelta(hours=24)) == [Post(ts=dt)]
+
+
+@pytest.mark.usefixtures("transactional")
+class TestTimeCensor:
+
+    @pytest.mark.asyncio
+    async def test_limit(self, connect: MagicMock) -> None:
+        connect.return_value = (posts := FakePosts()).db
+        censor = TimeCensor()
+        result = await censor.check(make_payload(message_id=1))
+        assert result.is_allowed
+        assert result.reason == "Message sent, 1 left for today"
+        result = await censor.check(make_payload(message_id=2))
+        assert result.is_allowed
+        assert "You can create next post from" in result.reason
+        assert posts.data is not None
+        assert [post["message_id"] for post in posts.data["posts"]] == [1, 2]
+        # one read and one write per passed check
+        assert posts.doc_ref.get.call_count == 2
+        assert posts.transaction.set.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_precheck(self, connect: MagicMock) -> None:
+        connect.return_value = (posts := FakePosts()).db
+        now = datetime.now(timezone.utc)
+        posts.data = {
+            "posts": [
+                {"ts": now - timedelta(minutes=1), "message_id": 1},
+                {"ts": now, "message_id": 2},
+            ]
+        }
+        censor = TimeCensor()
+        assert (await censor.precheck(make_payload(message_id=2))).is_allowed
+        assert not (await censor.precheck(make_payload(message_id=3))).is_allowed
+        # read once, nothing reserved
+        assert posts.doc_ref.get.call_count == 1
+        assert posts.transaction.set.call_count == 0
+
+    @pytest.mark.asyncio
+    async def test_redelivery(self, connect: MagicMock) -> None:
+        connect.return_value = (posts := FakePosts()).db
+        censor = TimeCensor()
+        for message_id in (1, 1, 2, 2):
+            result = await censor.check(make_payload(message_id=message_id))
+            assert result.is_allowed
+        assert posts.data is not None
+        assert [post["message_id"] for post in posts.data["posts"]] == [1, 2]
+        assert posts.transaction.set.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_fast_reject(self, connect: MagicMock) -> None:
+        connect.return_value = (posts := FakePosts()).db
+        censor = TimeCensor()
+        for message_id in range(1, 4):
+            result = await censor.check(make_payload(message_id=message_id))
+        assert not result.is_allowed
+        # the third check is rejected from the cached window
+        assert posts.doc_ref.get.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_concurrent_instance(self, connect: MagicMock) -> None:
+        connect.return_value = (posts := FakePosts()).db
+        now = datetime.now(timezone.utc)
+        # another instance registered two posts after this one cached the window
+        censor = TimeCensor()
+        await censor.check(make_payload(message_id=1))
+        posts.data = {
+            "posts": [
+                {"ts": now - timedelta(minutes=1), "message_id": 2},
+                {"ts": now, "message_id": 3},
+            ]
+        }
+        result = await censor.check(make_payload(message_id=4))
+        assert not result.is_allowed
+        assert posts.transaction.set.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_migrate_buckets(self, connect: MagicMock) -> None:
+        now = datetime.now(timezone.utc)
+        posts = FakePosts(buckets=[{"ts": now - timedelta(hours=1), "count": 1}])
+        connect.return_value = posts.db
+        censor = TimeCensor()
+        result = await censor.check(make_payload(message_id=7))
+        assert result.is_allowed
+        assert posts.data is not None
+        assert [post["message_id"] for post in posts.data["posts"]] == [None, 7]
+        result = await censor.check(make_payload(message_id=8))
+        assert not result.is_allowed
+        # buckets are only read until the user document exists
+        assert posts.transaction.get.call_count == 1
+
+
+class SleepyCensor(AbstractCensor):
+
+    def __init__(self, delay: float, result: CensorResult) -> None:
+        self.delay = delay
+        self.result = result
+        self.cancelled = False
+        self.checks = 0
+
+    async def check(self, message: MemePayload) -> CensorResult:
+        self.checks += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return self.result
+
+
+def make_combined(*censors: AbstractCensor) -> CombinedCensor:
+    combined = CombinedCensor()
+    combined.censors = list(censors)
+    return combined
+
+
+class TestCombinedCensor:
+
+    @pytest.mark.asyncio
+    async def test_reject_cancels(self) -> None:
+        cheap = SleepyCensor(0.01, CensorResult(is_allowed=False, reason="cheap"))
+        expensive = SleepyCensor(10, CensorResult(is_allowed=True))
+        combined = make_combined(expensive, cheap)
+        result = await asyncio.wait_for(combined.check(make_payload()), timeout=1)
+        assert result == CensorResult(is_allowed=False, reason="cheap")
+        await asyncio.sleep(0)
+        assert expensive.cancelled
+
+    @pytest.mark.asyncio
+    async def test_allowed_reason(self) -> None:
+        first = SleepyCensor(0.02, CensorResult(is_allowed=True, reason="first"))
+        second = SleepyCensor(0.01, CensorResult(is_allowed=True))
+        combined = make_combined(first, second)
+        result = await combined.check(make_payload())
+        assert result == CensorResult(is_allowed=True, reason="first")
+
+    @pytest.mark.asyncio
+    async def test_stages(self) -> None:
+        cheap = SleepyCensor(0.01, CensorResult(is_allowed=False, reason="cheap"))
+        expensive = SleepyCensor(0, CensorResult(is_allowed=True))
+        expensive.stage = Stage.EXPENSIVE
+        writing = SleepyCensor(0, CensorResult(is_allowed=True))
+        writing.stage = Stage.WRITE
+        combined = make_combined(writing, expensive, cheap)
+        result = await combined.check(make_payload())
+        assert result == CensorResult(is_allowed=False, reason="cheap")
+        # only the READ stage ran
+        assert expensive.checks == writing.checks == 0
+
+    @pytest.mark.asyncio
+    async def test_precheck(self) -> None:
+        expensive = SleepyCensor(0, CensorResult(is_allowed=True))
+        expensive.stage = Stage.EXPENSIVE
+        writing = SleepyCensor(0, CensorResult(is_allowed=True))
+        writing.stage = Stage.WRITE
+        writing.precheck = AsyncMock(  # type: ignore[method-assign]
+            return_value=CensorResult(is_allowed=False, reason="limit")
+        )
+        combined = make_combined(writing, expensive)
+        result = await combined.check(make_payload())
+        assert result == CensorResult(is_allowed=False, reason="limit")
+        assert expensive.checks == writing.checks == 0
+
+
+def make_change(change_type: ChangeType, uid: str, expires_at: datetime) -> MagicMock:
+    change = MagicMock(type=change_type)
+    change.document.id = uid
+    change.document.get.return_value = expires_at
+    return change
+
+
+class TestAllowlist:
+
+    def test_snapshot(self) -> None:
+        now = datetime.now(timezone.utc)
+        allowlist = Allowlist(collection="allow_users")
+        allowlist.on_snapshot(
+            docs=[],
+            changes=[
+                make_change(ChangeType.ADDED, "1", now + timedelta(days=1)),
+                make_change(ChangeType.ADDED, "2", now - timedelta(days=1)),
+                make_change(ChangeType.ADDED, "3", now + timedelta(days=1)),
+            ],
+            read_time=now,
+        )
+        assert "1" in allowlist
+        # expired, but not removed by TTL yet
+        assert "2" not in allowlist
+        allowlist.on_snapshot(
+            docs=[],
+            changes=[make_change(ChangeType.REMOVED, "3", now)],
+            read_time=now,
+        )
+        assert "3" not in allowlist
+
+
+class TestNewUserCensor:
+
+    @pytest.fixture(autouse=True)
+    def allowlist(self) -> None:
+        get_allowlist.cache_clear()
+
+    @pytest.mark.asyncio
+    async def test_cached(self, connect: MagicMock) -> None:
+        get_allowlist().add(
+            "666", expires_at=datetime.now(timezone.utc) + timedelta(days=1)
+        )
+        censor = NewUserCensor()
+        result = await censor.check(make_payload())
+        assert result.is_allowed
+        connect.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_miss(self, connect: MagicMock) -> None:
+        censor = NewUserCensor()
+        connect.return_value = db = MagicMock()
+        user = MagicMock(exists=True)
+        user.get.return_value = datetime.now(timezone.utc) + timedelta(days=1)
+        db.collection.return_value.document.return_value.get = AsyncMock(
+            return_value=user
+        )
+        assert (await censor.check(make_payload())).is_allowed
+        assert (await censor.check(make_payload())).is_allowed
+        # the second check is answered by the allowlist
+        assert db.collection.call_count == 1
+
+    @pytest.fixture
+    def new_user(self, connect: MagicMock, mocker: MockerFixture) -> NewUserCensor:
+        connect.return_value = FakeFirestore()
+        censor = NewUserCensor()
+        mocker.patch.object(censor, "_NewUserCensor__register")
+        return censor
+
+    def make_photo_payload(self) -> MemePayload:
+        return MemePayload(
+            message_id=1,
+            chat_id=111,
+            user_id=666,
+            photo=(PhotoRef("file", "unique", 90, 90),),
+        )
+
+    @pytest.mark.asyncio
+    async def test_no_quota(
+        self, new_user: NewUserCensor, mocker: MockerFixture
+    ) -> None:
+        mocker.patch.object(
+            new_user.explainer, "explain", side_effect=TooManyExplains()
+        )
+        result = await new_user.check(self.make_photo_payload())
+        assert result == NewUserCensor.try_later
+
+    @pytest.mark.asyncio
+    async def test_already_explained(
+        self, new_user: NewUserCensor, mocker: MockerFixture
+    ) -> None:
+        mocker.patch.object(
+            new_user.explainer, "explain", side_effect=IsAlreadyExplained()
+        )
+        mocker.patch.object(
+            new_user.explainer, "cached", return_value=MagicMock(score=8)
+        )
+        assert (await new_user.check(self.make_photo_payload())).is_allowed
+
+
+class TestRepostCensor:
+
+    @pytest.fixture
+    def stored(self, connect: MagicMock) -> MagicMock:
+        connect.return_value = db = MagicMock()
+        db.collection.return_value.document.return_value.set = AsyncMock()
+        return db
+
+    @pytest.fixture
+    def client(self, mocker: MockerFixture) -> MagicMock:
+        get_firestore_pool.cache_clear()
+        client = mocker.patch.object(FirestorePool, "connect_listener").return_value
+        query = client.collection.return_value.where.return_value
+        query.order_by.return_value.select.return_value.stream.return_value = [
+            MagicMock(to_dict=MagicMock(return_value={"hash": f"{0xFF:016x}"}))
+        ]
+        return client
+
+    @pytest.fixture
+    def censor(self, client: MagicMock) -> Generator[RepostCensor, None, None]:
+        censor = RepostCensor()
+        with censor.listening():
+            yield censor
+
+    def make_payload(self) -> MemePayload:
+        return MemePayload(
+            message_id=1,
+            chat_id=111,
+            user_id=666,
+            photo=(PhotoRef("file", "unique", 90, 90),),
+        )
+
+    @pytest.mark.asyncio
+    async def test_repost(
+        self, censor: RepostCensor, client: MagicMock, mocker: MockerFixture
+    ) -> None:
+        # 2 bits off a hash forwarded before
+        mocker.patch.object(censor, "get_hash", return_value=0xFF ^ 0b11)
+        result = await censor.check(self.make_payload())
+        assert not result.is_allowed
+        # only the hashes are read
+        select = client.collection.return_value.where.return_value.order_by.return_value
+        select.select.assert_called_once_with(["hash"])
+
+    @pytest.mark.asyncio
+    async def test_forwarded(
+        self, censor: RepostCensor, stored: MagicMock, mocker: MockerFixture
+    ) -> None:
+        mocker.patch.object(censor, "get_hash", return_value=0xFF << 32)
+        assert (await censor.check(self.make_payload())).is_allowed
+        await censor.forwarded(self.make_payload())
+        assert len(censor.index) == 2
+        stored.collection.return_value.document.assert_called_with(f"{0xFF << 32:016x}")
+        assert not (await censor.check(self.make_payload())).is_allowed
+
+    @pytest.mark.asyncio
+    async def test_other_instance(
+        self, censor: RepostCensor, mocker: MockerFixture
+    ) -> None:
+        now = datetime.now(timezone.utc)
+        change = MagicMock(type=ChangeType.ADDED)
+        change.document.get.return_value = f"{0xFF << 32:016x}"
+        censor.on_snapshot(docs=[], changes=[change, change], read_time=now)
+        # the same hash isn't added twice
+        assert len(censor.index) == 2
+        mocker.patch.object(censor, "get_hash", return_value=0xFF << 32)
+        assert not (await censor.check(self.make_payload())).is_allowed
+
+    @pytest.mark.asyncio
+    async def test_load_failed(self, client: MagicMock, mocker: MockerFixture) -> None:
+        query = client.collection.return_value.where.return_value
+        query.order_by.return_value.select.return_value.stream.side_effect = (
+            ServiceUnavailable("down")
+        )
+        censor = RepostCensor()
+        get_hash = mocker.patch.object(censor, "get_hash")
+        with censor.listening():
+            # the posts are let through
+            assert (await censor.check(self.make_payload())).is_allowed
+        get_hash.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_no_photo(self, connect: MagicMock) -> None:
+        result = await RepostCensor().check(make_payload())
+        assert result.is_allowed
+        connect.assert_not_called()
+
+
+class TestCensorSubscriber:
+
+    @pytest.mark.asyncio
+    async def test_handle_batch(self, mocker: MockerFixture) -> None:
+        subscriber = CensorSubscriber(loop=asyncio.get_running_loop())
+        prefetch = mocker.patch.object(subscriber.censor, "prefetch")
+        checked: list[tuple[int | None, int]] = []
+
+        async def check(message: MemePayload) -> None:
+            # the first message of a user is the slowest
+            await asyncio.sleep(0.02 if message.message_id < 3 else 0)
+            checked.append((message.user_id, message.message_id))
+            if message.message_id == 4:
+                raise RuntimeError("failed")
+
+        mocker.patch.object(subscriber, "check", side_effect=check)
+        messages = [
+            make_payload(user_id=1, message_id=1),
+            make_payload(user_id=2, message_id=2),
+            make_payload(user_id=1, message_id=3),
+            make_payload(user_id=2, message_id=4),
+        ]
+        errors = await subscriber.handle_batch(messages)
+        prefetch.assert_called_once_with(messages)
+        assert [message_id for uid, message_id in checked if uid == 1] == [1, 3]
+        assert [message_id for uid, message_id in checked if uid == 2] == [2, 4]
+        assert [error is None for error in errors] == [True, True, True, False]
+
+    @pytest_asyncio.fixture
+    async def subscriber(self, mocker: MockerFixture) -> CensorSubscriber:
+        subscriber = CensorSubscriber(loop=asyncio.get_running_loop())
+        mocker.patch.object(
+            subscriber.censor, "check", return_value=CensorResult(is_allowed=True)
+        )
+        mocker.patch.object(subscriber.censor, "forwarded")
+        return subscriber
+
+    @pytest.fixture
+    def db(self, connect: MagicMock) -> FakeFirestore:
+        connect.return_value = db = FakeFirestore()
+        return db
+
+    @pytest.fixture
+    def bot(self, mocker: MockerFixture) -> MagicMock:
+        return mocker.patch("memebot.censor.get_bot").return_value
+
+    @pytest.mark.asyncio
+    async def test_redelivered_after_forward(
+        self, subscriber: CensorSubscriber, db: FakeFirestore, bot: MagicMock
+    ) -> None:
+        bot.forward_message = AsyncMock()
+        subscriber.censor.forwarded.side_effect = [  # type: ignore[attr-defined]
+            ServiceUnavailable("firestore"),
+            None,
+        ]
+        with pytest.raises(ServiceUnavailable):
+            await subscriber.check(make_payload(message_id=1))
+        await subscriber.check(make_payload(message_id=1))
+        # forwarded once, the redelivery only finishes the records
+        assert bot.forward_message.await_count == 1
+        assert subscriber.censor.check.call_count == 1  # type: ignore[attr-defined]
+        assert subscriber.censor.forwarded.call_count == 2  # type: ignore[attr-defined]
+        assert db.docs["forwards", "111_1"]["state"] == ForwardState.FORWARDED
+
+    @pytest.mark.asyncio
+    async def test_forward_failed(
+        self, subscriber: CensorSubscriber, db: FakeFirestore, bot: MagicMock
+    ) -> None:
+        bot.forward_message = AsyncMock(side_effect=[TimedOut(), None])
+        with pytest.raises(TimedOut):
+            await subscriber.check(make_payload(message_id=1))
+        # not recorded, the redelivery forwards it
+        await subscriber.check(make_payload(message_id=1))
+        assert bot.forward_message.await_count == 2
+        assert ("forwards", "111_1") in db.docs
+
+    def claim(self, db: FakeFirestore, claimed_at: datetime) -> None:
+        db.write(
+            ("forwards", "111_1"),
+            {
+                "state": ForwardState.CLAIMED,
+                "claimedAt": claimed_at,
+                "reason": "Message sent",
+            },
+        )
+
+    @pytest.mark.asyncio
+    async def test_stale_claim(
+        self, subscriber: CensorSubscriber, db: FakeFirestore, bot: MagicMock
+    ) -> None:
+        bot.forward_message = AsyncMock()
+        bot.send_message = AsyncMock()
+        # the delivery died between the claim and the forward
+        self.claim(db, claimed_at=datetime.now(timezone.utc) - timedelta(days=1))
+        await subscriber.check(make_payload(message_id=1))
+        assert bot.forward_message.await_count == 1
+        bot.send_message.assert_awaited_once_with(chat_id=111, text="Message sent")
+        assert db.docs["forwards", "111_1"]["state"] == ForwardState.FORWARDED
+        subscriber.censor.check.assert_not_called()  # type: ignore[attr-defined]
+
+    @pytest.mark.asyncio
+    async def test_claimed(
+        self, subscriber: CensorSubscriber, db: FakeFirestore, bot: MagicMock
+    ) -> None:
+        bot.forward_message = AsyncMock()
+        # another delivery is forwarding it
+        self.claim(db, claimed_at=datetime.now(timezone.utc))
+        with pytest.raises(ForwardInProgress):
+            await subscriber.check(make_payload(message_id=1))
+        bot.forward_message.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_rejected_once(
+        self, subscriber: CensorSubscriber, db: FakeFirestore, bot: MagicMock
+    ) -> None:
+        bot.forward_message = AsyncMock()
+        bot.send_message = AsyncMock()
+        subscriber.censor.check.return_value = CensorResult(  # type: ignore[attr-defined]
+            is_allowed=False, reason="Too many posts"
+        )
+        await subscriber.check(make_payload(message_id=1))
+        await subscriber.check(make_payload(message_id=1))
+        bot.send_message.assert_awaited_once_with(chat_id=111, text="Too many posts")
+        assert subscriber.censor.check.call_count == 1  # type: ignore[attr-defined]
+        bot.forward_message.assert_not_called()
+
+
+@pytest.mark.usefixtures("transactional")
+class TestPrefetch:
+
+    @pytest.mark.asyncio
+    async def test_time_censor(self, connect: MagicMock) -> None:
+        now = datetime.now(timezone.utc)
+        posts = FakePosts()
+        posts.data = {
+            "posts": [
+                {"ts": now - timedelta(minutes=2), "message_id": 1},
+                {"ts": now - timedelta(minutes=1), "message_id": 2},
+            ]
+        }
+        snapshot = posts.snapshot(transaction=None)
+        snapshot.id = "666"
+
+        async def get_all(refs: list[Any]) -> AsyncGenerator[MagicMock, None]:
+            yield snapshot
+
+        posts.db.get_all = get_all
+        connect.return_value = posts.db
+        censor = TimeCensor()
+        await censor.prefetch([make_payload(message_id=3)])
+        result = await censor.check(make_payload(message_id=3))
+        assert not result.is_allowed
+        # rejected from the prefetched window
+        assert posts.doc_ref.get.call_count == 0
+
+    @pytest.mark.asyncio
+    async def test_new_user_censor(self, connect: MagicMock) -> None:
+        get_allowlist.cache_clear()
+        known = MagicMock(exists=True, id="1")
+        known.get.return_value = datetime.now(timezone.utc) + timedelta(days=1)
+        unknown = MagicMock(exists=False, id="2")
+
+        async def get_all(refs: list[Any]) -> AsyncGenerator[MagicMock, None]:
+            yield known
+            yield unknown
+
+        connect.return_value = db = MagicMock()
+        db.get_all = get_all
+        censor = NewUserCensor()
+        await censor.prefetch([make_payload(user_id=1), make_payload(user_id=2)])
+        assert (await censor.check(make_payload(user_id=1))).is_allowed
+        result = await censor.check(make_payload(user_id=2))
+        assert result == CensorResult(is_allowed=False, reason="No image in a message")
+        db.collection.return_value.document.return_value.get.assert_not_called()
@@ -1,15 +1,15 @@
-import json
 from asyncio.subprocess import Process
 
 import pytest
 from google.api_core.exceptions import DeadlineExceeded
-from google.cloud.pubsub_v1 import PublisherClient, SubscriberClient
-from google.cloud.pubsub_v1.futures import Future as PublisherFuture
+from google.cloud.pubsub_v1 import SubscriberClient
 from pytest_mock import MockerFixture
 from telegram import Bot, Message
 
 import memebot.commands as commands
 from memebot.config import get_explainer_config
+from memebot.payload import MemePayload
+from memebot.publisher import Publisher
 from tests.helpers import clean_subscription
 
 
@@ -36,11 +36,7 @@ class TestHelpCommand:
     async def test_run_success(self, mocker: MockerFixture, message: Message) -> None:
         bot_mock = mocker.MagicMock(spec=Bot)
         _ = mocker.patch(
-            "memebot.commands.get_token",
-            return_value="NoToken",
-        )
-        _ = mocker.patch(
-            "memebot.commands.Bot",
+            "memebot.commands.get_bot",
             return_value=bot_mock,
         )
         message._unfreeze()
@@ -62,11 +58,10 @@ class TestExplainCommand:
     ) -> None:
         command = commands.ExplainCommand(explain_message)
         mocker.patch.object(command, "validate", mocker.AsyncMock(return_value=True))
-        command.publisher = mocker.MagicMock(spec=PublisherClient)
-        future = mocker.AsyncMock(spec=PublisherFuture)
-        command.publisher.publish = mocker.MagicMock(return_value=future)
+        publisher = mocker.MagicMock(spec=Publisher)
+        mocker.patch("memebot.commands.get_publisher", return_value=publisher)
         await command.run()
-        assert future.result.call_count == 1
+        assert publisher.publish.await_count == 1
 
     @pytest.mark.xdist_group("pubsub")
     @pytest.mark.pubsub
@@ -93,6 +88,7 @@ class TestExplainCommand:
 
         assert len(response.received_messages) == 1
         pubsub_msg = response.received_messages[0].message
-        data = json.loads(pubsub_msg.data.decode("utf-8"))
-        restored_message = Message.de_json(data=data, bot=None)
-        assert restored_message.text == explain_message.text
+        restored_message = MemePayload.from_pubsub(
+            pubsub_msg.data, pubsub_msg.attributes
+        )
+        assert restored_message == MemePayload.from_message(explain_message)
@@ -0,0 +1,94 @@
+import asyncio
+import os
+from datetime import timedelta
+
+import pytest
+from pytest_mock import MockerFixture
+
+from memebot.config import LocalSecretSource, SecretNotLoaded, SecretsLoader
+
+
+class SlowSecretSource(LocalSecretSource):
+    delay = 0.1
+
+    async def fetch(self, resource_name: str) -> str:
+        await asyncio.sleep(self.delay)
+        return await super().fetch(resource_name)
+
+
+@pytest.fixture
+def secret_env(mocker: MockerFixture) -> dict[str, str]:
+    env = {
+        "TELEGRAM_TOKEN": "projects/1/secrets/telegram_token/versions/latest",
+        "SEARCH_CX_KEY": "projects/1/secrets/search_cx_key/versions/latest",
+        "SEARCH_API_KEY": "plain-key",
+    }
+    mocker.patch.dict(os.environ, env)
+    return env
+
+
+class TestSecretsLoader:
+
+    @pytest.mark.asyncio
+    async def test_prefetch(
+        self, mocker: MockerFixture, secret_env: dict[str, str]
+    ) -> None:
+        source = SlowSecretSource(
+            {
+                secret_env["TELEGRAM_TOKEN"]: "token",
+                secret_env["SEARCH_CX_KEY"]: "cx",
+            }
+        )
+        fetch_sync = mocker.spy(source, "fetch_sync")
+        loader = SecretsLoader(source=source, ttl=timedelta(hours=1))
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await loader.prefetch()
+        # secrets are fetched concurrently
+        assert loop.time() - start < 2 * source.delay
+        assert loader.get("TELEGRAM_TOKEN") == "token"
+        assert loader.get("SEARCH_CX_KEY") == "cx"
+        assert loader.get("SEARCH_API_KEY") == "plain-key"
+        assert fetch_sync.call_count == 0
+
+    def test_not_prefetched(self, secret_env: dict[str, str]) -> None:
+        source = LocalSecretSource({secret_env["TELEGRAM_TOKEN"]: "token"})
+        loader = SecretsLoader(source=source, ttl=timedelta(hours=1))
+        assert loader.get("TELEGRAM_TOKEN") == "token"
+        assert loader.get("UNKNOWN_SECRET") == "NoToken"
+
+    @pytest.mark.asyncio
+    async def test_rotation(self, secret_env: dict[str, str]) -> None:
+        resource_name = secret_env["TELEGRAM_TOKEN"]
+        source = LocalSecretSource({resource_name: "token"})
+        loader = SecretsLoader(source=source, ttl=timedelta(0))
+        await loader.prefetch()
+        source.secrets[resource_name] = "rotated"
+        # stale value is served while it's refreshed in background
+        assert loader.get("TELEGRAM_TOKEN") == "token"
+        await asyncio.sleep(0)
+        assert loader.get("TELEGRAM_TOKEN") == "rotated"
+
+    @pytest.mark.asyncio
+    async def test_not_prefetched_on_loop(self, secret_env: dict[str, str]) -> None:
+        source = LocalSecretSource({secret_env["TELEGRAM_TOKEN"]: "token"})
+        loader = SecretsLoader(source=source, ttl=timedelta(hours=1))
+        # a blocking fetch would stall the loop
+        with pytest.raises(SecretNotLoaded):
+            loader.get("TELEGRAM_TOKEN")
+        assert await asyncio.to_thread(loader.get, "TELEGRAM_TOKEN") == "token"
+
+    @pytest.mark.asyncio
+    async def test_refresh_backoff(
+        self, mocker: MockerFixture, secret_env: dict[str, str]
+    ) -> None:
+        resource_name = secret_env["TELEGRAM_TOKEN"]
+        source = LocalSecretSource({resource_name: "token"})
+        loader = SecretsLoader(source=source, ttl=timedelta(0))
+        await loader.prefetch()
+        fetch = mocker.patch.object(source, "fetch", side_effect=RuntimeError("down"))
+        for _ in range(5):
+            assert loader.get("TELEGRAM_TOKEN") == "token"
+            await asyncio.sleep(0)
+        # retried after the backoff only
+        assert fetch.call_count == 1
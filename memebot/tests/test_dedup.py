@@ -0,0 +1,49 @@
+from datetime import timedelta
+
+import pytest
+from pytest_mock import MockerFixture
+
+from memebot.config import DedupConfig
+from memebot.dedup import InMemoryUpdateStore, UpdateDeduplicator, UpdateStore
+
+
+def make_config(max_size: int = 10) -> DedupConfig:
+    return DedupConfig(ttl=timedelta(hours=1), max_size=max_size, store="memory")
+
+
+@pytest.mark.asyncio
+class TestUpdateDeduplicator:
+
+    async def test_local(self) -> None:
+        dedup = UpdateDeduplicator(config=make_config())
+        assert not await dedup.is_duplicate(1)
+        assert await dedup.is_duplicate(1)
+        assert not await dedup.is_duplicate(2)
+
+    async def test_local_eviction(self) -> None:
+        dedup = UpdateDeduplicator(config=make_config(max_size=1))
+        assert not await dedup.is_duplicate(1)
+        assert not await dedup.is_duplicate(2)
+        # evicted from the LRU
+        assert not await dedup.is_duplicate(1)
+
+    async def test_shared_store(self) -> None:
+        # two instances sharing the same store
+        store = InMemoryUpdateStore(ttl=timedelta(hours=1))
+        first = UpdateDeduplicator(config=make_config(), store=store)
+        second = UpdateDeduplicator(config=make_config(), store=store)
+        assert not await first.is_duplicate(1)
+        assert await second.is_duplicate(1)
+
+    async def test_forget(self) -> None:
+        store = InMemoryUpdateStore(ttl=timedelta(hours=1))
+        dedup = UpdateDeduplicator(config=make_config(), store=store)
+        assert not await dedup.is_duplicate(1)
+        await dedup.forget(1)
+        assert not await dedup.is_duplicate(1)
+
+    async def test_store_failure(self, mocker: MockerFixture) -> None:
+        store = mocker.MagicMock(spec=UpdateStore)
+        store.add.side_effect = RuntimeError("Firestore is unavailable")
+        dedup = UpdateDeduplicator(config=make_config(), store=store)
+        assert not await dedup.is_duplicate(1)
@@ -1,8 +1,12 @@
 import asyncio
+import dataclasses
 import queue
 from asyncio import sleep
 from asyncio.subprocess import Process
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from io import BytesIO
+from pathlib import Path
 
 import dspy
 import google.pubsub_v1.types as gapic_types
@@ -15,8 +19,21 @@ from pytest_mock import MockerFixture
 from telegram import Bot, Message
 
 from memebot.config import get_explainer_config, get_token
-from memebot.explainer import Explainer, ExplainSubscriber
-from tests.helpers import clean_subscription
+from memebot.explainer import (
+    Explainer,
+    ExplainSubscriber,
+    IsAlreadyExplained,
+    MemeInfoModel,
+    NoPhoto,
+    TooManyExplains,
+    _get_program,
+    build_program,
+    get_explanation_cache,
+    get_program,
+)
+from memebot.payload import MemePayload, PhotoRef
+from memebot.storage import FirestorePool, get_firestore_pool
+from tests.helpers import FakeFirestore, clean_subscription
 
 
 class TestExplainer:
@@ -38,7 +55,7 @@ class TestExplainer:
     @pytest.mark.skip
     @pytest.mark.asyncio
     async def test_broetchen(self) -> None:
-        image = Image.open("tests/img/broetchen.jpg")
+        image = dspy.Image.from_PIL(Image.open("tests/img/broetchen.jpg"))
         vertexai.init()
         lm = dspy.LM(
             model="vertex_ai/gemini-2.5-pro",
@@ -57,7 +74,7 @@ class TestExplainer:
     @pytest.mark.skip
     @pytest.mark.asyncio
     async def test_dolina(self) -> None:
-        image = Image.open("tests/img/dolina.jpg")
+        image = dspy.Image.from_PIL(Image.open("tests/img/dolina.jpg"))
         vertexai.init()
         lm = dspy.LM(
             model="vertex_ai/gemini-2.5-pro",
@@ -72,7 +89,7 @@ class TestExplainer:
     @pytest.mark.skip
     @pytest.mark.asyncio
     async def test_squidward(self) -> None:
-        image = Image.open("tests/img/squidward.jpg")
+        image = dspy.Image.from_PIL(Image.open("tests/img/squidward.jpg"))
         vertexai.init()
         lm = dspy.LM(
             model="vertex_ai/gemini-2.5-pro",
@@ -88,7 +105,7 @@ class TestExplainer:
     @pytest.mark.skip
     @pytest.mark.asyncio
     async def test_search(self) -> None:
-        image = Image.open("tests/img/ruhs.jpg")
+        image = dspy.Image.from_PIL(Image.open("tests/img/ruhs.jpg"))
         vertexai.init()
         lm = dspy.LM(
             model="vertex_ai/gemini-2.5-pro",
@@ -165,5 +182,181 @@ class TestExplainSubscriber:
             delivery_attempt=0,
             request_queue=queue.Queue(),
         )
+        mock_ack = mocker.patch.object(PubSubMessage, "ack")
         explainer.pull_message(pubsub_message)
+        # acked only once the explain is done
+        assert mock_ack.call_count == 0
+        await sleep(0.1)
         assert mock_explain.call_count == 1
+        assert mock_ack.call_count == 1
+
+
+MEME_INFO = MemeInfoModel(
+    lang="de",
+    persons=set(),
+    animals={"cat"},
+    ru_translation="",
+    grammar_explanation="",
+    score=7,
+    meme_improvement="",
+    explanation="",
+)
+
+
+def make_payload(
+    message_id: int, file_unique_id: str | None = None, caption: str | None = None
+) -> MemePayload:
+    return MemePayload(
+        message_id=message_id,
+        chat_id=111,
+        user_id=666,
+        caption=caption,
+        photo=(
+            PhotoRef(
+                file_id="file",
+                file_unique_id=file_unique_id or f"unique{message_id}",
+                width=700,
+                height=700,
+            ),
+        ),
+    )
+
+
+@pytest.fixture
+def db(mocker: MockerFixture) -> FakeFirestore:
+    get_firestore_pool.cache_clear()
+    get_explanation_cache.cache_clear()
+    db = FakeFirestore()
+    mocker.patch.object(FirestorePool, "connect", return_value=db)
+    return db
+
+
+@pytest.fixture
+def explainer(mocker: MockerFixture) -> Explainer:
+    explainer = Explainer()
+    mocker.patch.object(explainer, "get_image")
+    mocker.patch.object(explainer, "_explain", return_value=MEME_INFO)
+    return explainer
+
+
+def test_no_photo() -> None:
+    with pytest.raises(NoPhoto):
+        Explainer().select_photo(MemePayload(message_id=1, chat_id=111, photo=()))
+
+
+class TestExplainerQuota:
+
+    def make_payload(self, message_id: int) -> MemePayload:
+        return make_payload(message_id=message_id)
+
+    @pytest.mark.asyncio
+    async def test_already_explained(
+        self, db: FakeFirestore, explainer: Explainer
+    ) -> None:
+        await explainer.explain(self.make_payload(message_id=1))
+        with pytest.raises(IsAlreadyExplained):
+            await explainer.explain(self.make_payload(message_id=1))
+        # the same message id in another chat
+        other_chat = dataclasses.replace(self.make_payload(message_id=1), chat_id=222)
+        await explainer.explain(other_chat)
+        assert ("llm_requests", "222_1") in db.docs
+
+    @pytest.mark.asyncio
+    async def test_legacy_request(
+        self, db: FakeFirestore, explainer: Explainer
+    ) -> None:
+        # registered by the message id alone
+        db.write(
+            ("llm_requests", "1"),
+            {"expiresAt": datetime.now(timezone.utc) + timedelta(hours=1)},
+        )
+        with pytest.raises(IsAlreadyExplained):
+            await explainer.explain(self.make_payload(message_id=1))
+
+    @pytest.mark.asyncio
+    async def test_quota(self, db: FakeFirestore, explainer: Explainer) -> None:
+        for message_id in range(Explainer.n_generations_limit):
+            await explainer.explain(self.make_payload(message_id=message_id))
+        with pytest.raises(TooManyExplains):
+            await explainer.explain(self.make_payload(message_id=100))
+
+    @pytest.mark.asyncio
+    async def test_constant_reads(
+        self, db: FakeFirestore, explainer: Explainer
+    ) -> None:
+        reads = []
+        for message_id in range(20):
+            before = db.reads
+            await explainer.explain(self.make_payload(message_id=message_id))
+            reads.append(db.reads - before)
+        # the first check reads every past hour, then only the cached
+        # explanation, the request documents (current and legacy id) and
+        # the current hour, however many explains there were
+        assert reads[0] == 3 + Explainer.n_hour_limit
+        assert set(reads[1:]) == {4}
+
+
+class TestExplanationCache:
+
+    @pytest.mark.asyncio
+    async def test_repost(self, db: FakeFirestore, explainer: Explainer) -> None:
+        await explainer.explain(make_payload(message_id=1, file_unique_id="meme"))
+        meme_info = await explainer.explain(
+            make_payload(message_id=2, file_unique_id="meme")
+        )
+        assert meme_info == MEME_INFO
+        assert explainer._explain.call_count == 1  # type: ignore[attr-defined]
+
+    @pytest.mark.asyncio
+    async def test_caption(self, db: FakeFirestore, explainer: Explainer) -> None:
+        await explainer.explain(make_payload(message_id=1, file_unique_id="meme"))
+        await explainer.explain(
+            make_payload(message_id=2, file_unique_id="meme", caption="Mittwoch")
+        )
+        assert explainer._explain.call_count == 2  # type: ignore[attr-defined]
+
+    @pytest.mark.asyncio
+    async def test_firestore(self, db: FakeFirestore, explainer: Explainer) -> None:
+        await explainer.explain(make_payload(message_id=1, file_unique_id="meme"))
+        # another instance, nothing in memory
+        get_explanation_cache.cache_clear()
+        meme_info = await Explainer().explain(
+            make_payload(message_id=2, file_unique_id="meme")
+        )
+        assert meme_info == MEME_INFO
+        assert explainer._explain.call_count == 1  # type: ignore[attr-defined]
+
+    @pytest.mark.asyncio
+    async def test_no_quota(self, db: FakeFirestore, explainer: Explainer) -> None:
+        for message_id in range(Explainer.n_generations_limit):
+            await explainer.explain(make_payload(message_id=message_id))
+        # over the quota, but the explanation is cached
+        meme_info = await explainer.explain(
+            make_payload(message_id=100, file_unique_id="unique1")
+        )
+        assert meme_info == MEME_INFO
+
+
+class TestProgram:
+
+    def test_built_once(self, mocker: MockerFixture) -> None:
+        _get_program.cache_clear()
+        build = mocker.patch(
+            "memebot.explainer.build_program", side_effect=lambda **_: object()
+        )
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            programs = list(executor.map(lambda _: get_program(), range(8)))
+        assert build.call_count == 1
+        assert all(program is programs[0] for program in programs)
+        _get_program.cache_clear()
+
+    def test_load(self, tmp_path: Path) -> None:
+        optimized = build_program(max_iters=3)
+        optimized.react.signature = optimized.react.signature.with_instructions(
+            "Explain briefly."
+        )
+        optimized.save(str(tmp_path / "program.json"))
+        program = build_program(
+            max_iters=3, program_path=str(tmp_path / "program.json")
+        )
+        assert program.react.signature.instructions == "Explain briefly."
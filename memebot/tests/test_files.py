@@ -0,0 +1,98 @@
+import asyncio
+import os
+from datetime import timedelta
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from pytest_mock import MockerFixture
+
+from memebot.config import FileCacheConfig
+from memebot.files import FileCache
+
+
+def make_cache(directory: Path, max_bytes: int = 1024) -> FileCache:
+    return FileCache(
+        config=FileCacheConfig(
+            directory=str(directory),
+            max_bytes=max_bytes,
+            path_ttl=timedelta(minutes=10),
+        )
+    )
+
+
+@pytest.fixture
+def bot(mocker: MockerFixture) -> MagicMock:
+    bot = MagicMock()
+
+    async def get_file(file_id: str) -> MagicMock:
+        hfile = MagicMock()
+        hfile.download_as_bytearray = AsyncMock(
+            side_effect=lambda: bytearray(file_id.encode() * 100)
+        )
+        return hfile
+
+    bot.get_file = AsyncMock(side_effect=get_file)
+    mocker.patch("memebot.files.get_bot", return_value=bot)
+    return bot
+
+
+class TestFileCache:
+
+    @pytest.mark.asyncio
+    async def test_hit(self, tmp_path: Path, bot: MagicMock) -> None:
+        cache = make_cache(tmp_path)
+        async with cache.open("a", "ua") as data:
+            assert bytes(data) == b"a" * 100
+        async with cache.open("a", "ua") as data:
+            assert data[:] == b"a" * 100
+        assert bot.get_file.await_count == 1
+        assert (tmp_path / "ua").read_bytes() == b"a" * 100
+
+    @pytest.mark.asyncio
+    async def test_concurrent_download(self, tmp_path: Path, bot: MagicMock) -> None:
+        cache = make_cache(tmp_path)
+
+        async def read() -> bytes:
+            async with cache.open("a", "ua") as data:
+                return bytes(data)
+
+        assert await asyncio.gather(read(), read()) == [b"a" * 100] * 2
+        assert bot.get_file.await_count == 1
+
+    @pytest.mark.asyncio
+    async def test_eviction(self, tmp_path: Path, bot: MagicMock) -> None:
+        cache = make_cache(tmp_path, max_bytes=250)
+        for file_id in ("a", "b"):
+            async with cache.open(file_id, f"u{file_id}"):
+                ...
+        # a is used again, b is the least recently used
+        async with cache.open("a", "ua"):
+            ...
+        async with cache.open("c", "uc"):
+            ...
+        assert sorted(os.listdir(tmp_path)) == ["ua", "uc"]
+        assert cache.size == 200
+
+    @pytest.mark.asyncio
+    async def test_too_large(self, tmp_path: Path, bot: MagicMock) -> None:
+        cache = make_cache(tmp_path, max_bytes=50)
+        async with cache.open("a", "ua") as data:
+            assert len(data) == 100
+        assert len(cache) == 0 and not os.listdir(tmp_path)
+
+    @pytest.mark.asyncio
+    async def test_restart(self, tmp_path: Path, bot: MagicMock) -> None:
+        async with make_cache(tmp_path).open("a", "ua"):
+            ...
+        cache = make_cache(tmp_path)
+        async with cache.open("a", "ua") as data:
+            assert data[:] == b"a" * 100
+        assert bot.get_file.await_count == 1
+        assert len(cache) == 1
+
+    @pytest.mark.asyncio
+    async def test_get_file_cached(self, tmp_path: Path, bot: MagicMock) -> None:
+        cache = make_cache(tmp_path)
+        assert await cache.get_file("a") is await cache.get_file("a")
+        assert bot.get_file.await_count == 1
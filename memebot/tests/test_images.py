@@ -0,0 +1,61 @@
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from memebot.config import ImageConfig
+from memebot.images import preprocess, select_photo
+from memebot.payload import PhotoRef
+
+
+def make_config(max_bytes: int = 256 * 1024) -> ImageConfig:
+    return ImageConfig(
+        max_pixels=768 * 768, max_side=768, max_bytes=max_bytes, quality=85
+    )
+
+
+def make_jpeg(width: int, height: int) -> bytes:
+    pixels = np.random.default_rng(0).integers(
+        0, 255, size=(height, width, 3), dtype=np.uint8
+    )
+    buffer = BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG", quality=95)
+    return buffer.getvalue()
+
+
+def make_photo(width: int, height: int) -> PhotoRef:
+    return PhotoRef(
+        file_id=f"{width}", file_unique_id=f"{width}", width=width, height=height
+    )
+
+
+class TestSelectPhoto:
+
+    def test_budget(self) -> None:
+        photos = [make_photo(90, 90), make_photo(320, 320), make_photo(800, 800)]
+        assert select_photo(photos, max_pixels=768 * 768).width == 320
+
+    def test_smallest(self) -> None:
+        photos = [make_photo(1280, 1280), make_photo(2560, 2560)]
+        assert select_photo(photos, max_pixels=768 * 768).width == 1280
+
+
+class TestPreprocess:
+
+    def test_downscale(self) -> None:
+        data = preprocess(make_jpeg(1600, 1200), make_config())
+        with Image.open(BytesIO(data)) as image:
+            assert image.format == "JPEG"
+            assert max(image.size) <= 768
+            assert image.width * image.height <= 768 * 768
+            assert image.size == (768, 576)
+
+    def test_max_bytes(self) -> None:
+        # noise doesn't compress, the picture has to be scaled down
+        data = preprocess(make_jpeg(700, 700), make_config(max_bytes=20 * 1024))
+        assert len(data) <= 20 * 1024
+
+    def test_small(self) -> None:
+        data = preprocess(make_jpeg(90, 60), make_config())
+        with Image.open(BytesIO(data)) as image:
+            assert image.size == (90, 60)
@@ -1,6 +1,16 @@
+import os
+import subprocess
+import sys
+from contextlib import ExitStack
+from pathlib import Path
+
+import pytest
 from fastapi.testclient import TestClient
 from pytest_mock import MockerFixture
-from telegram import Bot, Message, Update
+from telegram import Bot, Chat, Message, Update, WebhookInfo
+
+from main import app, set_webhook, start_subscribers
+from memebot.metrics import get_metrics
 
 
 class TestMain:
@@ -8,6 +18,91 @@ class TestMain:
         response = client.get("/")
         assert response.status_code == 200
 
+    def test_subscribers_down(self, mocker: MockerFixture, client: TestClient) -> None:
+        mocker.patch("memebot.explainer.get_explainer", side_effect=OSError("pubsub"))
+        with pytest.raises(OSError):
+            start_subscribers(app, loop=mocker.MagicMock(), stack=ExitStack())
+        try:
+            response = client.get("/")
+            assert response.status_code == 503
+        finally:
+            del app.state.subscribers_error
+
+
+@pytest.mark.asyncio
+class TestSetWebhook:
+    url = "https://memebot.appspot.com/webhook"
+
+    @pytest.mark.parametrize(
+        ("url", "allowed_updates", "is_set"),
+        [
+            (url, ["message"], False),
+            (url, ["message", "poll"], True),
+            ("", [], True),
+        ],
+    )
+    async def test_set_webhook(
+        self,
+        mocker: MockerFixture,
+        url: str,
+        allowed_updates: list[str],
+        is_set: bool,
+    ) -> None:
+        mocker.patch.dict(os.environ, {"WEBHOOK_URL": self.url})
+        bot_mock = mocker.MagicMock(spec=Bot)
+        bot_mock.get_webhook_info.return_value = WebhookInfo(
+            url=url,
+            has_custom_certificate=False,
+            pending_update_count=0,
+            allowed_updates=allowed_updates,
+        )
+        mocker.patch("main.get_bot", return_value=bot_mock)
+        await set_webhook()
+        if is_set:
+            bot_mock.set_webhook.assert_awaited_once_with(
+                url=self.url, allowed_updates=["message"]
+            )
+        else:
+            bot_mock.set_webhook.assert_not_called()
+
+
+class TestColdStart:
+    # modules loaded on first use, not at the app start
+    heavy_modules = (
+        "dspy",
+        "vertexai",
+        "PIL",
+        "markdownify",
+        "google.cloud.firestore",
+        "google.cloud.pubsub_v1",
+        "google.cloud.secretmanager",
+    )
+    budget_us = int(os.getenv("IMPORT_TIME_BUDGET_MS", "2000")) * 1000
+
+    def test_import_time(self) -> None:
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-X",
+                "importtime",
+                "-c",
+                "import sys, main; print(','.join(sys.modules))",
+            ],
+            cwd=Path(__file__).parent.parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        modules = set(result.stdout.strip().split(","))
+        assert not modules.intersection(self.heavy_modules)
+        # import time: self [us] | cumulative | imported package
+        (cumulative_us,) = (
+            int(line.split("|")[1])
+            for line in result.stderr.splitlines()
+            if line.split("|")[-1].strip() == "main"
+        )
+        assert cumulative_us < self.budget_us
+
 
 class TestWebhook:
     link = "/webhook"
@@ -24,6 +119,20 @@ class TestWebhook:
         assert response.status_code == 200
         assert response.text == "ignored, no message"
 
+    def test_group_chatter(self, client: TestClient, message: Message) -> None:
+        message._unfreeze()
+        message.text = "just chatting"
+        message.chat = Chat(id=1, type="supergroup")
+        message._freeze()
+        fast_path = get_metrics().counter("webhook.fast_path")
+        n_fast_path = fast_path.value
+
+        update = Update(update_id=1, message=message)
+        response = client.post(self.link, json=update.to_dict())
+        assert response.status_code == 200
+        assert response.text == "ignored, not a command"
+        assert fast_path.value == n_fast_path + 1
+
     def test_message_help(
         self, mocker: MockerFixture, client: TestClient, message: Message
     ) -> None:
@@ -33,7 +142,7 @@ class TestWebhook:
 
         bot_mock = mocker.MagicMock(spec=Bot)
         _ = mocker.patch(
-            "memebot.commands.Bot",
+            "memebot.commands.get_bot",
             return_value=bot_mock,
         )
 
@@ -41,3 +150,44 @@ class TestWebhook:
         response = client.post(self.link, json=update.to_dict())
         assert response.status_code == 200
         assert response.text == "OK"
+
+    def test_duplicate(
+        self, mocker: MockerFixture, client: TestClient, message: Message
+    ) -> None:
+        message._unfreeze()
+        message.text = "/help"
+        message._freeze()
+
+        bot_mock = mocker.MagicMock(spec=Bot)
+        _ = mocker.patch(
+            "memebot.commands.get_bot",
+            return_value=bot_mock,
+        )
+
+        update = Update(update_id=2, message=message)
+        response = client.post(self.link, json=update.to_dict())
+        assert response.text == "OK"
+        # Telegram retries the same update
+        response = client.post(self.link, json=update.to_dict())
+        assert response.status_code == 200
+        assert response.text == "ignored, duplicate update"
+        assert bot_mock.send_message.call_count == 1
+
+    def test_busy(
+        self, mocker: MockerFixture, client: TestClient, message: Message
+    ) -> None:
+        message._unfreeze()
+        message.text = "/help"
+        message._freeze()
+
+        queue = mocker.patch("main.get_command_queue").return_value
+        queue.dispatch = mocker.AsyncMock(return_value=False)
+        dedup = mocker.patch("main.get_deduplicator").return_value
+        dedup.is_duplicate = mocker.AsyncMock(return_value=False)
+        dedup.forget = mocker.AsyncMock(side_effect=RuntimeError("firestore"))
+
+        update = Update(update_id=3, message=message)
+        response = client.post(self.link, json=update.to_dict())
+        # still redelivered by Telegram
+        assert response.status_code == 503
+        dedup.forget.assert_awaited_once_with(3)
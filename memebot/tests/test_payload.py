@@ -0,0 +1,36 @@
+import msgpack
+import pytest
+from telegram import Message
+
+from memebot.payload import SCHEMA, SCHEMA_ATTRIBUTE, MemePayload
+
+
+class TestMemePayload:
+
+    def test_from_message(self, explain_message: Message) -> None:
+        payload = MemePayload.from_message(explain_message)
+        assert payload.message_id == explain_message.message_id
+        assert payload.chat_id == explain_message.chat.id
+        assert payload.user_id == 666
+        assert payload.photo == ()
+        assert (reply_to_message := payload.reply_to_message) is not None
+        assert reply_to_message.caption == "Es ist Mittwoch, meine Kerle"
+        assert reply_to_message.photo[0].file_unique_id == "AQADJvAxG2BcAAFKfQ"
+        assert reply_to_message.photo[0].width == 700
+
+    def test_roundtrip(self, explain_message: Message) -> None:
+        payload = MemePayload.from_message(explain_message)
+        data = payload.encode()
+        assert len(data) < len(explain_message.to_json().encode("utf-8"))
+        assert MemePayload.from_pubsub(data, {SCHEMA_ATTRIBUTE: SCHEMA}) == payload
+
+    def test_legacy(self, explain_message: Message) -> None:
+        # published as a full message before the compact schema
+        data = explain_message.to_json().encode("utf-8")
+        assert MemePayload.from_pubsub(data, {}) == MemePayload.from_message(
+            explain_message
+        )
+
+    def test_unknown_version(self) -> None:
+        with pytest.raises(ValueError):
+            MemePayload.decode(msgpack.packb([0, []]))
@@ -0,0 +1,49 @@
+import random
+
+import numpy as np
+from PIL import Image
+
+from memebot.phash import HashIndex, dhash
+
+
+def make_image(seed: int) -> Image.Image:
+    rng = np.random.default_rng(seed)
+    # a smooth gradient with blobs, closer to a picture than pure noise
+    pixels = rng.integers(0, 255, size=(16, 16, 3), dtype=np.uint8)
+    return Image.fromarray(pixels).resize((640, 640), Image.Resampling.BICUBIC)
+
+
+def distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class TestDhash:
+
+    def test_rescaled(self) -> None:
+        image = make_image(seed=1)
+        small = image.resize((320, 320))
+        assert distance(dhash(image), dhash(small)) <= 6
+
+    def test_different(self) -> None:
+        assert distance(dhash(make_image(seed=1)), dhash(make_image(seed=2))) > 6
+
+
+class TestHashIndex:
+
+    def test_distance(self) -> None:
+        index = HashIndex(capacity=100)
+        assert index.distance(0) is None
+        values = [random.getrandbits(64) for _ in range(50)]
+        for value in values:
+            index.add(value)
+        assert index.distance(values[10]) == 0
+        assert (nearest := index.distance(values[10] ^ 0b101)) is not None
+        assert nearest <= 2
+
+    def test_capacity(self) -> None:
+        index = HashIndex(capacity=2)
+        for value in (0, 2**64 - 1, 2**32 - 1):
+            index.add(value)
+        assert len(index) == 2
+        # the oldest hash is overwritten
+        assert index.distance(0) == 32
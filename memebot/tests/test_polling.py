@@ -0,0 +1,105 @@
+import datetime
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+from telegram import Bot, Message, Update
+
+from memebot.commands import CommandInterface
+from memebot.config import PollingConfig, RateLimitConfig
+from memebot.polling import Poller
+from memebot.ratelimit import RateLimiter
+
+
+def make_update(update_id: int, message: Message) -> Update:
+    return Update(update_id=update_id, message=message)
+
+
+@pytest.mark.asyncio
+class TestPoller:
+
+    async def test_poll_once(
+        self, mocker: MockerFixture, message: Message, tmp_path: Path
+    ) -> None:
+        command = mocker.MagicMock(spec=CommandInterface)
+        build_command = mocker.patch(
+            "memebot.polling.build_command", return_value=command
+        )
+        bot = mocker.MagicMock(spec=Bot)
+        bot.get_updates.return_value = [
+            make_update(10, message),
+            make_update(11, message),
+            # not a message
+            Update(update_id=12),
+        ]
+        config = PollingConfig(
+            limit=100,
+            timeout=datetime.timedelta(seconds=1),
+            concurrency=2,
+            offset_path=str(tmp_path / "offset"),
+        )
+        poller = Poller(config=config, bot=bot)
+        assert poller.offset is None
+
+        assert await poller.poll_once() == 3
+        assert build_command.call_count == 2
+        assert command.run.await_count == 2
+        assert poller.offset == 13
+
+        # restarted poller continues from the checkpoint
+        bot.get_updates.return_value = []
+        restarted = Poller(config=config, bot=bot)
+        assert restarted.offset == 13
+        assert await restarted.poll_once() == 0
+        assert bot.get_updates.call_args.kwargs["offset"] == 13
+
+    async def test_failed_command(
+        self, mocker: MockerFixture, message: Message
+    ) -> None:
+        command = mocker.MagicMock(spec=CommandInterface)
+        command.run.side_effect = RuntimeError("Pub/Sub is unavailable")
+        mocker.patch("memebot.polling.build_command", return_value=command)
+        bot = mocker.MagicMock(spec=Bot)
+        bot.get_updates.return_value = [make_update(1, message)]
+        config = PollingConfig(
+            limit=100,
+            timeout=datetime.timedelta(seconds=1),
+            concurrency=2,
+            offset_path="",
+        )
+        poller = Poller(config=config, bot=bot)
+        # a failed command doesn't stop polling
+        assert await poller.poll_once() == 1
+        assert poller.offset == 2
+
+    async def test_rate_limited(self, mocker: MockerFixture, message: Message) -> None:
+        command = mocker.MagicMock(spec=CommandInterface)
+        mocker.patch("memebot.polling.build_command", return_value=command)
+        mocker.patch(
+            "memebot.polling.get_rate_limiter",
+            return_value=RateLimiter(
+                config=RateLimitConfig(
+                    user_rate=1,
+                    user_burst=2,
+                    chat_rate=60,
+                    chat_burst=20,
+                    n_instances=1,
+                    max_keys=100,
+                )
+            ),
+        )
+        bot = mocker.MagicMock(spec=Bot)
+        bot.get_updates.return_value = [make_update(i, message) for i in range(5)]
+        poller = Poller(
+            config=PollingConfig(
+                limit=100,
+                timeout=datetime.timedelta(seconds=1),
+                concurrency=2,
+                offset_path="",
+            ),
+            bot=bot,
+        )
+        assert await poller.poll_once() == 5
+        # the user's burst only, the rest is dropped but confirmed
+        assert command.run.await_count == 2
+        assert poller.offset == 5
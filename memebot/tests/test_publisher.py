@@ -0,0 +1,34 @@
+import asyncio
+from concurrent.futures import Future
+
+import pytest
+from google.cloud.pubsub_v1 import PublisherClient
+from pytest_mock import MockerFixture
+
+from memebot.config import get_publisher_config
+from memebot.publisher import Publisher, get_publisher
+
+
+class TestPublisher:
+
+    @pytest.mark.asyncio
+    async def test_publish(self, mocker: MockerFixture) -> None:
+        publisher = Publisher(config=get_publisher_config())
+        future: Future[str] = Future()
+        client = mocker.MagicMock(spec=PublisherClient)
+        client.publish.return_value = future
+        publisher.client = client
+
+        task = asyncio.create_task(
+            publisher.publish(topic="topic", data=b"data", chat_id="1")
+        )
+        await asyncio.sleep(0)
+        # the loop isn't blocked while the batch is in flight
+        assert not task.done()
+        # the future is resolved by a client's thread
+        await asyncio.to_thread(future.set_result, "42")
+        assert await task == "42"
+        client.publish.assert_called_once_with(topic="topic", data=b"data", chat_id="1")
+
+    def test_shared(self) -> None:
+        assert get_publisher() is get_publisher()
@@ -0,0 +1,79 @@
+import datetime
+
+import pytest
+from pytest_mock import MockerFixture
+from telegram import Message
+
+from memebot.config import RateLimitConfig
+from memebot.ratelimit import RateLimiter
+
+
+def make_limiter(n_instances: int = 1) -> RateLimiter:
+    return RateLimiter(
+        config=RateLimitConfig(
+            user_rate=60,
+            user_burst=2,
+            chat_rate=600,
+            chat_burst=3,
+            n_instances=n_instances,
+            max_keys=100,
+        )
+    )
+
+
+def make_message(user_id: int, chat_id: int) -> Message:
+    return Message.de_json(
+        {
+            "message_id": 1,
+            "chat": {"id": chat_id, "type": "supergroup"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Tester"},
+            "date": int(datetime.datetime.now(datetime.timezone.utc).timestamp()),
+        },
+        bot=None,
+    )
+
+
+class TestRateLimiter:
+
+    @pytest.fixture(autouse=True)
+    def monotonic(self, mocker: MockerFixture):
+        return mocker.patch("memebot.ratelimit.time.monotonic", return_value=0.0)
+
+    def test_user_burst(self, monotonic) -> None:
+        limiter = make_limiter()
+        message = make_message(user_id=1, chat_id=1)
+        assert limiter.admit(message)
+        assert limiter.admit(message)
+        assert not limiter.admit(message)
+        # user_rate is a token per second
+        monotonic.return_value = 1.0
+        assert limiter.admit(message)
+        assert not limiter.admit(message)
+
+    def test_chat_burst(self) -> None:
+        limiter = make_limiter()
+        for user_id in range(3):
+            assert limiter.admit(make_message(user_id=user_id, chat_id=1))
+        assert not limiter.admit(make_message(user_id=4, chat_id=1))
+
+    def test_rejected_takes_no_tokens(self) -> None:
+        limiter = make_limiter()
+        message = make_message(user_id=1, chat_id=1)
+        assert limiter.admit(message)
+        assert limiter.admit(message)
+        assert not limiter.admit(message)
+        # the rejected message didn't take the last chat token
+        assert limiter.admit(make_message(user_id=2, chat_id=1))
+        assert not limiter.admit(make_message(user_id=3, chat_id=1))
+
+    def test_instances_share(self) -> None:
+        limiter = make_limiter(n_instances=2)
+        message = make_message(user_id=1, chat_id=1)
+        assert limiter.admit(message)
+        assert not limiter.admit(message)
+
+    def test_admin(self, mocker: MockerFixture) -> None:
+        mocker.patch("memebot.ratelimit.ADMINS", {1})
+        limiter = make_limiter()
+        message = make_message(user_id=1, chat_id=1)
+        assert all(limiter.admit(message) for _ in range(10))
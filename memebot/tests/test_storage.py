@@ -0,0 +1,116 @@
+import asyncio
+from datetime import timedelta
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from google.api_core.exceptions import NotFound, ServiceUnavailable
+from pytest_mock import MockerFixture
+
+from memebot.config import FirestoreConfig
+from memebot.storage import FirestorePool
+
+
+def make_pool(pool_size: int = 1, deadline: float = 1.0) -> FirestorePool:
+    return FirestorePool(
+        config=FirestoreConfig(
+            pool_size=pool_size,
+            deadline=timedelta(seconds=deadline),
+            health_check_interval=timedelta(seconds=60),
+        )
+    )
+
+
+class TestFirestorePool:
+
+    @pytest.mark.asyncio
+    async def test_round_robin(self, mocker: MockerFixture) -> None:
+        connect = mocker.patch.object(
+            FirestorePool, "connect", side_effect=lambda: MagicMock()
+        )
+        pool = make_pool(pool_size=2)
+        clients = []
+        for _ in range(4):
+            async with pool.session() as db:
+                clients.append(db)
+        assert connect.call_count == 2
+        assert clients[0] is clients[2] and clients[1] is clients[3]
+        assert clients[0] is not clients[1]
+
+    @pytest.mark.asyncio
+    async def test_reconnect(self, mocker: MockerFixture) -> None:
+        connect = mocker.patch.object(
+            FirestorePool, "connect", side_effect=lambda: MagicMock()
+        )
+        pool = make_pool()
+        with pytest.raises(ServiceUnavailable):
+            async with pool.session():
+                raise ServiceUnavailable("channel is broken")
+        async with pool.session():
+            ...
+        assert connect.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_close_dropped(self, mocker: MockerFixture) -> None:
+        client = MagicMock()
+        client._transport.close = AsyncMock()
+        mocker.patch.object(FirestorePool, "connect", return_value=client)
+        pool = make_pool(deadline=0.01)
+        with pytest.raises(ServiceUnavailable):
+            async with pool.session():
+                raise ServiceUnavailable("channel is broken")
+        await asyncio.sleep(0.05)
+        client.close.assert_called_once()
+        client._transport.close.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_application_error(self, mocker: MockerFixture) -> None:
+        connect = mocker.patch.object(
+            FirestorePool, "connect", side_effect=lambda: MagicMock()
+        )
+        pool = make_pool()
+        with pytest.raises(NotFound):
+            async with pool.session():
+                raise NotFound("no document")
+        async with pool.session():
+            ...
+        # the channel is fine, the client is kept
+        assert connect.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_deadline(self, mocker: MockerFixture) -> None:
+        connect = mocker.patch.object(
+            FirestorePool, "connect", side_effect=lambda: MagicMock()
+        )
+        pool = make_pool(deadline=0.01)
+        with pytest.raises(TimeoutError):
+            async with pool.session():
+                await asyncio.sleep(1)
+        async with pool.session():
+            ...
+        assert connect.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_health_check(self, mocker: MockerFixture) -> None:
+        client = MagicMock()
+        document = client.collection.return_value.document.return_value
+        document.get = AsyncMock(side_effect=ServiceUnavailable("down"))
+        connect = mocker.patch.object(FirestorePool, "connect", return_value=client)
+        pool = make_pool()
+        async with pool.session():
+            ...
+        await pool.check_health()
+        async with pool.session():
+            ...
+        assert connect.call_count == 2
+
+    def test_listener(self, mocker: MockerFixture) -> None:
+        clients = [MagicMock(), MagicMock()]
+        mocker.patch.object(FirestorePool, "connect_listener", side_effect=clients)
+        pool = make_pool()
+        with pool.listener() as first, pool.listener() as second:
+            assert first is second is clients[0]
+        clients[0].close.assert_called_once()
+        clients[0]._transport.close.assert_called_once()
+        # the next listener reconnects
+        with pool.listener() as third:
+            assert third is clients[1]
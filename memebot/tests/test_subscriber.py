@@ -0,0 +1,140 @@
+import asyncio
+import queue
+from collections.abc import Sequence
+from datetime import timedelta
+from typing import override
+
+import google.pubsub_v1.types as gapic_types
+import pytest
+from google.cloud.pubsub_v1.subscriber.message import Message as PubSubMessage
+from pytest_mock import MockerFixture
+
+from memebot.config import SubscriberConfig
+from memebot.payload import SCHEMA, SCHEMA_ATTRIBUTE, MemePayload
+from memebot.subscriber import Subscriber
+
+
+class SlowSubscriber(Subscriber):
+
+    name = "slow"
+    permanent_errors = (ValueError,)
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        fail: type[Exception] | None = None,
+        batch_size: int = 1,
+    ) -> None:
+        super().__init__(
+            loop=loop,
+            subscription="projects/test-project/subscriptions/slow",
+            config=SubscriberConfig(
+                max_messages=4,
+                max_concurrency=2,
+                max_lease_duration=timedelta(seconds=60),
+                max_delivery_attempts=3,
+            ),
+            batch_size=batch_size,
+            batch_window=timedelta(milliseconds=20),
+        )
+        self.fail = fail
+        self.running = 0
+        self.max_running = 0
+        self.batches: list[list[int]] = []
+
+    @override
+    async def handle_batch(
+        self, messages: Sequence[MemePayload]
+    ) -> list[BaseException | None]:
+        self.batches.append([message.message_id for message in messages])
+        return await super().handle_batch(messages)
+
+    @override
+    async def handle(self, message: MemePayload) -> None:
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        if self.fail is not None:
+            raise self.fail("handler failed")
+
+
+def make_message(message_id: int, delivery_attempt: int = 0) -> PubSubMessage:
+    msg_pb = gapic_types.PubsubMessage.pb()(
+        data=MemePayload(message_id=message_id, chat_id=111).encode(),
+        attributes={SCHEMA_ATTRIBUTE: SCHEMA},
+        message_id=str(message_id),
+    )
+    return PubSubMessage(
+        message=msg_pb,
+        ack_id=str(message_id),
+        delivery_attempt=delivery_attempt,
+        request_queue=queue.Queue(),
+    )
+
+
+class TestSubscriber:
+
+    @pytest.mark.asyncio
+    async def test_concurrency(self, mocker: MockerFixture) -> None:
+        ack = mocker.patch.object(PubSubMessage, "ack")
+        subscriber = SlowSubscriber(loop=asyncio.get_running_loop())
+        for message_id in range(5):
+            subscriber.pull_message(make_message(message_id))
+        await asyncio.sleep(0.1)
+        assert subscriber.max_running == 2
+        assert ack.call_count == 5
+
+    @pytest.mark.asyncio
+    async def test_nack_on_failure(self, mocker: MockerFixture) -> None:
+        ack = mocker.patch.object(PubSubMessage, "ack")
+        nack = mocker.patch.object(PubSubMessage, "nack")
+        subscriber = SlowSubscriber(loop=asyncio.get_running_loop(), fail=RuntimeError)
+        subscriber.pull_message(make_message(1))
+        await asyncio.sleep(0.1)
+        assert ack.call_count == 0
+        assert nack.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_permanent_error(self, mocker: MockerFixture) -> None:
+        ack = mocker.patch.object(PubSubMessage, "ack")
+        nack = mocker.patch.object(PubSubMessage, "nack")
+        subscriber = SlowSubscriber(loop=asyncio.get_running_loop(), fail=ValueError)
+        subscriber.pull_message(make_message(1))
+        await asyncio.sleep(0.1)
+        assert ack.call_count == 1
+        assert nack.call_count == 0
+
+    @pytest.mark.asyncio
+    async def test_max_delivery_attempts(self, mocker: MockerFixture) -> None:
+        ack = mocker.patch.object(PubSubMessage, "ack")
+        nack = mocker.patch.object(PubSubMessage, "nack")
+        subscriber = SlowSubscriber(loop=asyncio.get_running_loop(), fail=RuntimeError)
+        for _ in range(3):
+            subscriber.pull_message(make_message(1))
+            await asyncio.sleep(0.05)
+        # dropped on the third failure
+        assert nack.call_count == 2
+        assert ack.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_dead_letter(self, mocker: MockerFixture) -> None:
+        ack = mocker.patch.object(PubSubMessage, "ack")
+        nack = mocker.patch.object(PubSubMessage, "nack")
+        subscriber = SlowSubscriber(loop=asyncio.get_running_loop(), fail=RuntimeError)
+        subscriber.pull_message(make_message(1, delivery_attempt=5))
+        await asyncio.sleep(0.05)
+        # Pub/Sub counts the attempts and parks the message
+        assert nack.call_count == 1
+        assert ack.call_count == 0
+
+    @pytest.mark.asyncio
+    async def test_batch(self, mocker: MockerFixture) -> None:
+        ack = mocker.patch.object(PubSubMessage, "ack")
+        subscriber = SlowSubscriber(loop=asyncio.get_running_loop(), batch_size=3)
+        for message_id in range(4):
+            subscriber.pull_message(make_message(message_id))
+        await asyncio.sleep(0.1)
+        # a full batch is handled at once, the rest after the window
+        assert subscriber.batches == [[0, 1, 2], [3]]
+        assert ack.call_count == 4
@@ -0,0 +1,43 @@
+import pytest
+
+from memebot.updates import prefilter
+
+
+@pytest.mark.parametrize(
+    ("data", "reason"),
+    [
+        ("No Json Payload", "invalid update format"),
+        ({"message": {}}, "invalid update format"),
+        ({"update_id": 1}, "no message"),
+        ({"update_id": 1, "poll": {"id": "1"}}, "no message"),
+        ({"update_id": 1, "message": "text"}, "invalid update format"),
+        ({"update_id": 1, "message": {"text": 5}}, "invalid update format"),
+        (
+            {"update_id": 1, "message": {"text": "/help", "chat": []}},
+            "invalid update format",
+        ),
+        (
+            {
+                "update_id": 1,
+                "message": {"text": "hello", "chat": {"id": 1, "type": "supergroup"}},
+            },
+            "not a command",
+        ),
+        (
+            {
+                "update_id": 1,
+                "message": {
+                    "text": "/explain",
+                    "chat": {"id": 1, "type": "supergroup"},
+                },
+            },
+            None,
+        ),
+        (
+            {"update_id": 1, "message": {"chat": {"id": 1, "type": "private"}}},
+            None,
+        ),
+    ],
+)
+def test_prefilter(data, reason) -> None:
+    assert prefilter(data) == reason
@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+from pytest_mock import MockerFixture
+
+from memebot.commands import CommandInterface
+from memebot.config import WorkerConfig
+from memebot.workers import CommandQueue
+
+
+def make_queue(overflow: str = "reject") -> CommandQueue:
+    return CommandQueue(
+        config=WorkerConfig(
+            n_workers=1, queue_size=1, overflow=overflow, drain_timeout=1.0
+        )
+    )
+
+
+@pytest.mark.asyncio
+class TestCommandQueue:
+
+    async def test_inline_when_not_running(self, mocker: MockerFixture) -> None:
+        command = mocker.MagicMock(spec=CommandInterface)
+        assert await make_queue().dispatch(command)
+        command.run.assert_awaited_once()
+
+    async def test_background(self, mocker: MockerFixture) -> None:
+        done = asyncio.Event()
+        command = mocker.MagicMock(spec=CommandInterface)
+        command.run.side_effect = done.wait
+        queue = make_queue()
+        async with queue.running():
+            assert await queue.dispatch(command)
+            # acknowledged before the command is completed
+            assert not done.is_set()
+            done.set()
+        command.run.assert_awaited_once()
+
+    @pytest.mark.parametrize(("overflow", "accepted"), [("reject", 0), ("inline", 1)])
+    async def test_overflow(
+        self, mocker: MockerFixture, overflow: str, accepted: int
+    ) -> None:
+        done = asyncio.Event()
+        blocked = mocker.MagicMock(spec=CommandInterface)
+        blocked.run.side_effect = done.wait
+        command = mocker.MagicMock(spec=CommandInterface)
+        queue = make_queue(overflow=overflow)
+        async with queue.running():
+            # the first command occupies the worker, the second one the queue
+            assert await queue.dispatch(blocked)
+            await asyncio.sleep(0)
+            assert await queue.dispatch(blocked)
+            assert await queue.dispatch(command) == bool(accepted)
+            assert command.run.await_count == accepted
+            done.set()
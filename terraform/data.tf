@@ -1,2 +1,5 @@
 data "google_client_config" "default" {
 }
+
+data "google_project" "default" {
+}
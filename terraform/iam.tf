@@ -79,3 +79,24 @@ resource "google_pubsub_subscription_iam_member" "subscriber" {
   role         = "roles/pubsub.subscriber"
   member       = "serviceAccount:${data.google_client_config.default.project}@appspot.gserviceaccount.com"
 }
+
+# the Pub/Sub service agent moves messages over max_delivery_attempts to the dead-letter topic
+locals {
+  pubsub_service_agent = "serviceAccount:service-${data.google_project.default.number}@gcp-sa-pubsub.iam.gserviceaccount.com"
+}
+
+resource "google_pubsub_topic_iam_member" "dead_letter_publisher" {
+  topic  = google_pubsub_topic.topic_dead_letter.name
+  role   = "roles/pubsub.publisher"
+  member = local.pubsub_service_agent
+}
+
+resource "google_pubsub_subscription_iam_member" "dead_letter_subscriber" {
+  for_each = {
+    explain = google_pubsub_subscription.sub_explain.name
+    message = google_pubsub_subscription.sub_message.name
+  }
+  subscription = each.value
+  role         = "roles/pubsub.subscriber"
+  member       = local.pubsub_service_agent
+}
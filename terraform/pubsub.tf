@@ -10,6 +10,17 @@ resource "google_pubsub_subscription" "sub_explain" {
   ack_deadline_seconds         = 600
   retain_acked_messages        = false
   enable_exactly_once_delivery = true
+
+  # failing messages are parked instead of redelivered until the retention ends
+  dead_letter_policy {
+    dead_letter_topic     = google_pubsub_topic.topic_dead_letter.id
+    max_delivery_attempts = 5
+  }
+
+  retry_policy {
+    minimum_backoff = "10s"
+    maximum_backoff = "600s"
+  }
 }
 
 resource "google_pubsub_topic" "topic_message" {
@@ -24,4 +35,27 @@ resource "google_pubsub_subscription" "sub_message" {
   ack_deadline_seconds         = 600
   retain_acked_messages        = false
   enable_exactly_once_delivery = true
+
+  # failing messages are parked instead of redelivered until the retention ends
+  dead_letter_policy {
+    dead_letter_topic     = google_pubsub_topic.topic_dead_letter.id
+    max_delivery_attempts = 5
+  }
+
+  retry_policy {
+    minimum_backoff = "10s"
+    maximum_backoff = "600s"
+  }
+}
+
+resource "google_pubsub_topic" "topic_dead_letter" {
+  name = "dead-letter"
+  message_retention_duration = "604800s" # 7 days
+}
+
+resource "google_pubsub_subscription" "sub_dead_letter" {
+  name  = "sub-dead-letter-pull"
+  topic = google_pubsub_topic.topic_dead_letter.name
+
+  retain_acked_messages = false
 }